@@ -2,12 +2,23 @@ from __future__ import division
 
 import multiprocessing
 import time
+import traceback
 import winsound
 
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
 import cv2
 
-from scan import GeometryScanner, SlotScanner, OpenScanner
+from dls_barcode.datamatrix import DataMatrix, Locator
+from dls_barcode.datamatrix.read import DatamatrixPreFilter
+from dls_barcode.geometry.unipuck_calculator import UnipuckCalculator
+from scan import GeometryScanner, SlotScanner, OpenScanner, PlateScanner
 from dls_util.image import Image, Color
+from .frame_gate import FrameGate
+from .frame_ring import FrameRing
 from .overlay import PlateOverlay, TextOverlay, Overlay
 
 _OPENCV_MAJOR = cv2.__version__[0]
@@ -18,10 +29,15 @@ NO_PUCK_TIME = 2
 
 EXIT_KEY = 'q'
 
-# Maximum frame rate to sample at (rate will be further limited by speed at which frames can be processed)
-MAX_SAMPLE_RATE = 10.0
+# Maximum frame rate to sample at (rate will be further limited by speed at which frames can be processed). While
+# the puck is still, the barcodes are tracked from frame to frame, which is much quicker than locating them again.
+MAX_SAMPLE_RATE = 20.0
 INTERVAL = 1.0 / MAX_SAMPLE_RATE
 
+# Time (in seconds) that the scanner waits for the next frame from the locator pool before giving up on it (e.g.,
+# because its locator has died) and moving on to the frames that came after it
+LOCATOR_TIMEOUT = 5.0
+
 
 class CameraScanner:
     """ Manages the continuous scanning mode which takes a live feed from an attached camera and
@@ -29,7 +45,14 @@ class CameraScanner:
     together until enough barcodes are scanned to make a full plate.
 
     Two separate processes are spawned, one to handle capturing and displaying images from the camera,
-    and the other to handle processing (scanning) of those images.
+    and the other to handle processing (scanning) of those images. The frames are passed between the two
+    in a shared memory FrameRing.
+
+    If more than one scanner process is configured, a pool of locator processes is spawned as well. Each
+    frame is handed to one of them to locate its barcodes, and the scanner process merges the results into
+    the plate in the order that the frames were captured, only reading the barcodes in slots that haven't
+    already been read. This lets frames be processed in
+    parallel while the plate is still built up one frame at a time.
     """
     def __init__(self, result_queue):
         """ The task queue is used to store a queue of captured frames to be processed; the overlay
@@ -45,23 +68,41 @@ class CameraScanner:
     def stream_camera(self, config):
         """ Spawn the processes that will continuously capture and process images from the camera.
         """
-        capture_args = (self.task_queue, self.overlay_queue, self.kill_queue, config)
-        scanner_args = (self.task_queue, self.overlay_queue, self.result_queue, config)
+        num_locators = config.scanner_processes.value()
+        if num_locators <= 1:
+            num_locators = 0
+
+        # Each frame in the ring is either waiting on the task queue, or being located, or waiting to be
+        # merged, or being scanned; and there is a spare one for the capture process to fill
+        num_slots = Q_LIMIT + 2 * max(num_locators, 1)
+        max_frame_size = config.camera_width.value() * config.camera_height.value() * 3
+        frame_ring = FrameRing(num_slots, max_frame_size)
+
+        # Whether the plate has been completely scanned, so the locators can skip unchanged frames
+        plate_complete = multiprocessing.Value('b', False)
+        located_queue = multiprocessing.Queue() if num_locators else None
 
-        capture_pool = multiprocessing.Process(target=_capture_worker, args=capture_args)
-        scanner_pool = multiprocessing.Process(target=_scanner_worker, args=scanner_args)
+        capture_args = (self.task_queue, self.overlay_queue, self.kill_queue, frame_ring, config)
+        scanner_args = (self.task_queue, located_queue, num_locators, self.overlay_queue, self.result_queue,
+                        frame_ring, plate_complete, config)
+        locator_args = (self.task_queue, located_queue, frame_ring, plate_complete, config)
 
-        capture_pool.start()
-        scanner_pool.start()
+        processes = [multiprocessing.Process(target=_capture_worker, args=capture_args),
+                     multiprocessing.Process(target=_scanner_worker, args=scanner_args)]
+        for _ in range(num_locators):
+            processes.append(multiprocessing.Process(target=_locator_worker, args=locator_args))
+
+        for process in processes:
+            process.start()
 
     def kill(self):
         self.kill_queue.put(None)
         self.task_queue.put(None)
 
 
-def _capture_worker(task_queue, overlay_queue, kill_queue, config):
+def _capture_worker(task_queue, overlay_queue, kill_queue, frame_ring, config):
     """ Function used as the main loop of a worker process. Continuously captures images from
-    the camera and puts them on a queue to be processed. The images are displayed (as video)
+    the camera and puts them on a queue (via the frame ring) to be processed. The images are displayed (as video)
     to the user with appropriate highlights (taken from the overlay queue) which indicate the
     position of scanned and unscanned barcodes.
     """
@@ -91,9 +132,11 @@ def _capture_worker(task_queue, overlay_queue, kill_queue, config):
 
         # Add the frame to the task queue to be processed
         if task_queue.qsize() < Q_LIMIT and (time.time() - last_time >= INTERVAL):
-            # Make a copy of image so the overlay doesn't overwrite it
-            task_queue.put(frame.copy())
-            last_time = time.time()
+            # Copy the image into the frame ring so the overlay doesn't overwrite it
+            ticket = frame_ring.put(frame)
+            if ticket is not None:
+                task_queue.put(ticket)
+                last_time = time.time()
 
         # Get the latest overlay
         while not overlay_queue.empty():
@@ -116,7 +159,125 @@ def _capture_worker(task_queue, overlay_queue, kill_queue, config):
     cv2.destroyAllWindows()
 
 
-def _scanner_worker(task_queue, overlay_queue, result_queue, options):
+def _configure_scanning(options):
+    SlotScanner.DEBUG = options.slot_images.value()
+    SlotScanner.DEBUG_DIR = options.slot_image_directory.value()
+    DatamatrixPreFilter.ENABLED = options.scan_prefilter.value()
+    Locator.NUM_THREADS = max(1, options.locator_threads.value())
+    PlateScanner.NUM_THREADS = max(1, options.slot_scan_threads.value())
+    FrameGate.ENABLED = options.scan_frame_gate.value()
+    UnipuckCalculator.ROBUST_CENTER_FIT = options.robust_center_fit.value()
+
+
+def _locator_worker(task_queue, located_queue, frame_ring, plate_complete, options):
+    """ Function used as the main loop of each process of the locator pool. Locates the barcodes in each
+    frame and passes them on unread (with the frame's ticket) to the scanner worker, which reads the ones
+    that it needs when it merges them into the plate. Where nothing has moved since the last frame that
+    this locator scanned, the barcodes are tracked rather than located again (see DataMatrix.track_barcodes()).
+    The barcodes of an open plate are all read here, as the scanner would read every one of them anyway.
+
+    Each locator has its own FrameGate, so unchanged frames are passed on unscanned if the locator
+    found no barcodes in the last frame that it scanned, or if the plate is complete. If locating the
+    barcodes fails, the frame is passed on unscanned so that the scanner isn't left waiting for it.
+    """
+    _configure_scanning(options)
+    barcode_size = options.barcode_size.value()
+    is_open_plate = options.plate_type.value() == "None"
+    frame_gate = FrameGate()
+
+    last_image = None
+    last_barcodes = []
+    frames_since_full_locate = 0
+
+    while True:
+        ticket = task_queue.get(True)
+        if ticket is None:
+            # Pass the sentinel on to the other locators, and tell the scanner that this locator has stopped
+            task_queue.put(None)
+            located_queue.put(None)
+            break
+
+        try:
+            frame = frame_ring.get(ticket)
+            if not frame_gate.should_scan(frame):
+                located_queue.put((ticket, False, None))
+                continue
+
+            gray_image = Image(frame).to_grayscale()
+
+            barcodes = None
+            frames_since_full_locate += 1
+            if GeometryScanner.TRACKING and last_barcodes and \
+                    frames_since_full_locate < GeometryScanner.FULL_LOCATE_INTERVAL:
+                barcodes = DataMatrix.track_barcodes(gray_image, last_image, last_barcodes, barcode_size)
+                if any(barcode is None for barcode in barcodes):
+                    barcodes = None
+
+            if barcodes is None:
+                barcodes = DataMatrix.locate_all_barcodes_in_image(gray_image, barcode_size)
+                frames_since_full_locate = 0
+            last_image, last_barcodes = gray_image, barcodes
+
+            # An open plate only holds the new barcodes, so it is complete once every barcode in the frame is read
+            if is_open_plate:
+                DataMatrix.read_many(barcodes, DataMatrix.DIAG_WIGGLES)
+                complete = all(barcode.is_valid() for barcode in barcodes)
+            else:
+                complete = plate_complete.value
+            frame_gate.set_idle(not barcodes or complete)
+
+        except Exception:
+            traceback.print_exc()
+            located_queue.put((ticket, False, None))
+            continue
+
+        located_queue.put((ticket, True, barcodes))
+
+
+def _captured_frames(task_queue, frame_ring, frame_gate):
+    """ Yields (ticket, should scan, barcodes) for each frame on the task queue. The barcodes haven't
+    been located, so are always None. """
+    while True:
+        ticket = task_queue.get(True)
+        if ticket is None:
+            return
+
+        should_scan = frame_gate.should_scan(frame_ring.get(ticket))
+        yield ticket, should_scan, None
+
+
+def _located_frames(located_queue, num_locators, frame_ring):
+    """ Yields (ticket, should scan, barcodes) for each frame passed on by the locator pool, in the order
+    that the frames were captured. Stops once every locator has stopped. If a frame hasn't arrived after
+    LOCATOR_TIMEOUT, it is given up on; it is skipped, and released if it arrives later. """
+    pending = {}
+    next_number = 0
+    num_stopped = 0
+    while num_stopped < num_locators:
+        try:
+            message = located_queue.get(True, LOCATOR_TIMEOUT)
+        except Empty:
+            if pending:
+                next_number = min(pending)
+        else:
+            if message is None:
+                num_stopped += 1
+            elif message[0].number < next_number:
+                frame_ring.release(message[0])
+            else:
+                pending[message[0].number] = message
+
+        while next_number in pending:
+            yield pending.pop(next_number)
+            next_number += 1
+
+    # Frames after a gap that was never filled
+    for ticket, _, _ in pending.values():
+        frame_ring.release(ticket)
+
+
+def _scanner_worker(task_queue, located_queue, num_locators, overlay_queue, result_queue, frame_ring,
+                    plate_complete, options):
     """ Function used as the main loop of a worker process. Scan images for barcodes,
     combining partial scans until a full puck is reached.
 
@@ -124,11 +285,20 @@ def _scanner_worker(task_queue, overlay_queue, result_queue, options):
     and some barcodes scanned). For each new frame, we can attempt to merge the results with
     this previous plates so that we don't have to re-read any of the previously captured barcodes
     (because this is a relatively expensive operation).
+
+    Frames that haven't changed since the last scan are skipped if there is nothing left to scan (no puck,
+    or the puck has been fully scanned) - see FrameGate. The overlay from the last scan is kept on the
+    screen while frames are being skipped.
+
+    If there is a locator pool (the located queue isn't None), the frames come from the pool with their
+    barcodes already located, rather than directly from the task queue.
     """
     last_plate_time = time.time()
+    last_overlay = None
+    num_frames = 0
+    num_skipped = 0
 
-    SlotScanner.DEBUG = options.slot_images.value()
-    SlotScanner.DEBUG_DIR = options.slot_image_directory.value()
+    _configure_scanning(options)
 
     plate_type = options.plate_type.value()
     barcode_size = options.barcode_size.value()
@@ -138,11 +308,25 @@ def _scanner_worker(task_queue, overlay_queue, result_queue, options):
     else:
         scanner = GeometryScanner(plate_type, barcode_size)
 
-    while True:
-        # Get next image from queue (terminate if a queue contains a 'None' sentinel)
-        frame = task_queue.get(True)
-        if frame is None:
-            break
+    frame_gate = FrameGate()
+    if located_queue is None:
+        frames = _captured_frames(task_queue, frame_ring, frame_gate)
+    else:
+        frames = _located_frames(located_queue, num_locators, frame_ring)
+
+    # Get the next image from the queue (terminates if the queue contains a 'None' sentinel)
+    for ticket, should_scan, barcodes in frames:
+        frame = frame_ring.get(ticket)
+        num_frames += 1
+
+        # Nothing to do if the frame is the same as the last one, but keep the last overlay displayed
+        if not should_scan:
+            num_skipped += 1
+            frame_ring.release(ticket)
+            if last_overlay is not None and last_overlay.needs_renewal():
+                last_overlay.renew()
+                overlay_queue.put(last_overlay)
+            continue
 
         # Make grayscale version of image
         image = Image(frame)
@@ -151,10 +335,15 @@ def _scanner_worker(task_queue, overlay_queue, result_queue, options):
         # If we have an existing partial plate, merge the new plate with it and only try to read the
         # barcodes which haven't already been read. This significantly increases efficiency because
         # barcode read is expensive.
-        scan_result = scanner.scan_next_frame(gray_image)
+        scan_result = scanner.scan_next_frame(gray_image, barcodes=barcodes)
+        frame_gate.set_scan_result(scan_result)
+        plate_complete.value = scan_result.is_complete()
 
         if options.console_frame.value():
             scan_result.print_summary()
+            print("Unchanged Frames Skipped: {} of {} ({:.0%})".format(
+                num_skipped, num_frames, num_skipped / num_frames))
+            print("Capture to Result Latency: {0:.3f} secs".format(ticket.latency()))
 
         if scan_result.success():
             # Record the time so we can see how long its been since we last saw a plate
@@ -163,19 +352,27 @@ def _scanner_worker(task_queue, overlay_queue, result_queue, options):
             plate = scan_result.plate()
 
             if scan_result.already_scanned():
-                overlay_queue.put(TextOverlay(SCANNED_TAG, Color.Green()))
+                last_overlay = TextOverlay(SCANNED_TAG, Color.Green())
+                overlay_queue.put(last_overlay)
 
             elif scan_result.any_valid_barcodes():
-                overlay_queue.put(PlateOverlay(plate, options))
+                last_overlay = PlateOverlay(plate, options)
+                overlay_queue.put(last_overlay)
                 _plate_beep(plate, options)
 
             if scan_result.any_new_barcodes():
-                result_queue.put((plate, image))
+                # The frame is only borrowed from the ring, so send a copy of it
+                result_queue.put((plate, Image(frame.copy())))
 
         else:
             time_since_plate = time.time() - last_plate_time
             if time_since_plate > NO_PUCK_TIME:
-                overlay_queue.put(TextOverlay(scan_result.error(), Color.Red()))
+                last_overlay = TextOverlay(scan_result.error(), Color.Red())
+                overlay_queue.put(last_overlay)
+            else:
+                last_overlay = None
+
+        frame_ring.release(ticket)
 
 
 def _plate_beep(plate, options):
@@ -0,0 +1,74 @@
+from __future__ import division
+
+import time
+
+import cv2
+import numpy as np
+
+
+class FrameGate:
+    """ Cheap change detection for the continuous scanner. Decides whether each frame taken from the camera
+    needs to be scanned, or whether it is so similar to the last frame that was scanned that scanning it
+    again would just produce the same result.
+
+    Each frame is reduced to a small grayscale thumbnail (averaging over areas, so that camera noise is
+    smoothed away) and compared with the thumbnail of the last scanned frame. A frame is only skipped if
+    nothing has changed and the last scan showed that there is nothing left to do - either no puck was
+    present (no finder patterns were found at all) or the plate has been completely scanned. Partially
+    scanned plates are always scanned, as later frames can still read the remaining barcodes. Even while
+    idle, a frame is scanned every MAX_SKIP_TIME seconds in case of a change too gradual to be noticed.
+    """
+    ENABLED = True
+
+    THUMBNAIL_SIZE = (64, 48)
+
+    # Only every nth row and column of the frame is used to make the thumbnail; averaging over the whole
+    # frame would take several milliseconds, most of the time that skipping a frame takes
+    SUBSAMPLE = 4
+
+    # A thumbnail pixel has changed if it differs by more than this many grey levels, and the frame has
+    # changed if more than this fraction of the thumbnail pixels have changed
+    PIXEL_CHANGE_LIMIT = 12
+    CHANGED_FRACTION = 0.002
+
+    MAX_SKIP_TIME = 2.0
+
+    def __init__(self):
+        self._last_thumbnail = None
+        self._last_scan_time = 0
+        self._idle = False
+
+    def should_scan(self, frame):
+        """ Returns true if the frame (a color or grayscale numpy image) should be scanned. """
+        thumbnail = self._thumbnail(frame)
+
+        skip = self.ENABLED and self._idle and not self._has_changed(thumbnail) \
+            and time.time() - self._last_scan_time < self.MAX_SKIP_TIME
+
+        if not skip:
+            self._last_thumbnail = thumbnail
+            self._last_scan_time = time.time()
+
+        return not skip
+
+    def set_scan_result(self, scan_result):
+        """ Record the result of scanning the last frame that should_scan() let through. """
+        no_puck = not scan_result.success() and not scan_result.any_finder_patterns()
+        self.set_idle(no_puck or scan_result.is_complete())
+
+    def set_idle(self, idle):
+        """ Set whether there was nothing left to scan in the last frame that was scanned. """
+        self._idle = idle
+
+    def _thumbnail(self, frame):
+        sampled = np.ascontiguousarray(frame[::self.SUBSAMPLE, ::self.SUBSAMPLE])
+        if len(sampled.shape) == 3:
+            sampled = cv2.cvtColor(sampled, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(sampled, self.THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+
+    def _has_changed(self, thumbnail):
+        if self._last_thumbnail is None:
+            return True
+
+        changed = cv2.absdiff(thumbnail, self._last_thumbnail) > self.PIXEL_CHANGE_LIMIT
+        return np.count_nonzero(changed) > self.CHANGED_FRACTION * changed.size
@@ -0,0 +1,89 @@
+import ctypes
+import multiprocessing
+import time
+
+import numpy as np
+
+
+class FrameTicket:
+    """ Identifies a frame that has been put in a FrameRing. This is what is passed between processes
+    instead of the frame itself, so it is small and quick to pickle. If the frame was too big to fit in
+    a slot of the ring, the ticket carries a copy of the frame instead.
+    """
+    def __init__(self, number, slot, shape, capture_time, frame=None):
+        self.number = number
+        self.slot = slot
+        self.shape = shape
+        self.capture_time = capture_time
+        self.frame = frame
+
+    def latency(self):
+        """ Time (in seconds) since the frame was captured. """
+        return time.time() - self.capture_time
+
+
+class FrameRing:
+    """ A ring buffer of camera frames held in shared memory, used to pass frames from the capture process
+    to the scanner process(es) without copying (pickling) each multi-megabyte frame through a queue.
+
+    The capture process copies each frame into the next free slot of the ring and puts the (small) ticket
+    for it on the task queue; the scanner reads the frame in place and releases the slot when it has
+    finished with it. A slot is not reused until it has been released, so a frame can't be overwritten
+    while it is being scanned - if all of the slots are in use, the new frame is dropped instead.
+
+    The ring must be created before the worker processes are started and passed to them as an argument.
+    """
+    def __init__(self, num_slots, max_frame_size):
+        """ The maximum frame size is the size (in bytes) of each slot. """
+        self._num_slots = num_slots
+        self._slot_size = max_frame_size
+        self._buffer = multiprocessing.RawArray(ctypes.c_uint8, num_slots * max_frame_size)
+        self._in_use = multiprocessing.RawArray(ctypes.c_uint8, num_slots)
+        self._lock = multiprocessing.Lock()
+        self._next_slot = 0
+        self._next_number = 0
+
+    def put(self, frame):
+        """ Copy the frame (a uint8 numpy array) into a free slot and return its ticket. Returns None
+        if there are no free slots. The tickets are numbered consecutively in the order they are issued. """
+        capture_time = time.time()
+        if frame.nbytes > self._slot_size:
+            ticket = FrameTicket(self._next_number, None, frame.shape, capture_time, frame.copy())
+        else:
+            slot = self._claim_slot()
+            if slot is None:
+                return None
+
+            self._slot_array(slot, frame.shape)[...] = frame
+            ticket = FrameTicket(self._next_number, slot, frame.shape, capture_time)
+
+        self._next_number += 1
+        return ticket
+
+    def get(self, ticket):
+        """ The frame identified by the ticket. This is a view on the shared memory, so it must not be
+        used once the ticket has been released (copy it if it is needed for longer). """
+        if ticket.slot is None:
+            return ticket.frame
+        return self._slot_array(ticket.slot, ticket.shape)
+
+    def release(self, ticket):
+        """ Make the slot used by the ticket's frame free to be reused. """
+        if ticket.slot is not None:
+            with self._lock:
+                self._in_use[ticket.slot] = 0
+
+    def _claim_slot(self):
+        with self._lock:
+            for i in range(self._num_slots):
+                slot = (self._next_slot + i) % self._num_slots
+                if not self._in_use[slot]:
+                    self._in_use[slot] = 1
+                    self._next_slot = (slot + 1) % self._num_slots
+                    return slot
+        return None
+
+    def _slot_array(self, slot, shape):
+        size = int(np.prod(shape))
+        offset = slot * self._slot_size
+        return np.frombuffer(self._buffer, dtype=np.uint8, count=size, offset=offset).reshape(shape)
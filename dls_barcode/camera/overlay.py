@@ -17,6 +17,14 @@ class Overlay:
     def has_expired(self):
         return (time.time() - self._start_time) > self._lifetime
 
+    def needs_renewal(self):
+        """ True once more than half of the lifetime has passed. """
+        return (time.time() - self._start_time) > self._lifetime / 2
+
+    def renew(self):
+        """ Restart the lifetime of the overlay so that it can continue to be displayed. """
+        self._start_time = time.time()
+
 
 class TextOverlay(Overlay):
     """ Represents an overlay that can be drawn on top of an image. Used to write status text messages.
@@ -1,7 +1,9 @@
 import sys
 
 from dls_barcode.geometry import Geometry
-from dls_barcode.datamatrix import DataMatrix
+from dls_barcode.geometry.unipuck_calculator import UnipuckCalculator
+from dls_barcode.datamatrix import DataMatrix, Locator
+from dls_barcode.scan import PlateScanner
 from dls_barcode.datamatrix.read import DatamatrixSizeTable
 from dls_util.image import Color
 from dls_util.config import Config, DirectoryConfigItem, ColorConfigItem, \
@@ -33,11 +35,18 @@ class BarcodeConfig(Config):
         self.camera_height = add(IntConfigItem, "Camera Height", default=1080)
 
         self.plate_type = add(EnumConfigItem, "Sample Plate Type", default=Geometry.UNIPUCK, extra_arg=Geometry.TYPES)
+        self.robust_center_fit = add(BoolConfigItem, "Robust Puck Center Fit",
+                                     default=UnipuckCalculator.ROBUST_CENTER_FIT)
         self.barcode_size = add(EnumConfigItem, "Datamatrix Size", default=DataMatrix.DEFAULT_SIZE,
-                                extra_arg=DatamatrixSizeTable.valid_sizes())
+                                extra_arg=[DataMatrix.AUTO_SIZE] + DatamatrixSizeTable.valid_sizes())
 
         self.scan_beep = add(BoolConfigItem, "Beep While Scanning", default=True)
         self.scan_clipboard = add(BoolConfigItem, "Results to Clipboard", default=True)
+        self.scan_prefilter = add(BoolConfigItem, "Pre-filter Datamatrix Candidates", default=True)
+        self.locator_threads = add(IntConfigItem, "Deep Search Threads", default=Locator.NUM_THREADS)
+        self.slot_scan_threads = add(IntConfigItem, "Slot Scan Threads", default=PlateScanner.NUM_THREADS)
+        self.scan_frame_gate = add(BoolConfigItem, "Skip Unchanged Frames", default=True)
+        self.scanner_processes = add(IntConfigItem, "Scanner Processes", default=1)
 
         self.image_puck = add(BoolConfigItem, "Draw Puck", default=True)
         self.image_pins = add(BoolConfigItem, "Draw Slot Highlights", default=True)
@@ -25,6 +25,7 @@ class BarcodeConfigDialog(ConfigDialog):
 
         self.start_group("Sample Plate")
         add(cfg.plate_type)
+        add(cfg.robust_center_fit)
         add(cfg.barcode_size)
 
         self.start_group("Colors")
@@ -38,6 +39,11 @@ class BarcodeConfigDialog(ConfigDialog):
         self.start_group("Scanning")
         add(cfg.scan_beep)
         add(cfg.scan_clipboard)
+        add(cfg.scan_prefilter)
+        add(cfg.locator_threads)
+        add(cfg.slot_scan_threads)
+        add(cfg.scan_frame_gate)
+        add(cfg.scanner_processes)
 
         self.start_group("Result Image")
         add(cfg.image_puck)
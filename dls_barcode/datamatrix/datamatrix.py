@@ -1,3 +1,7 @@
+from collections import OrderedDict
+
+import numpy as np
+
 from .locate import Locator
 from .read import DatamatrixSizeTable
 from .read import DatamatrixReaderError, ReedSolomonError
@@ -5,6 +9,8 @@ from .read import DatamatrixBitReader
 from .read import DatamatrixByteExtractor
 from .read import ReedSolomonDecoder
 from .read import DatamatrixByteInterpreter
+from .read import DatamatrixDecodeCache
+from .read import DatamatrixPreFilter
 
 
 # We predict the location of the center of each square (pixel/bit) in the datamatrix based on the
@@ -27,21 +33,32 @@ class DataMatrix:
     """
     DEFAULT_SIZE = 14
 
+    # Matrix size setting for which the size of each datamatrix is detected from its timing pattern
+    AUTO_SIZE = "Auto"
+
     _w = 0.25
     DIAG_WIGGLES = [[0, 0], [_w, _w], [-_w, -_w], [_w, -_w], [-_w, _w]]
 
+    # Results of previous reads, shared by all barcodes (see DatamatrixDecodeCache)
+    DECODE_CACHE = DatamatrixDecodeCache()
+
+    # Quick checks used to reject samples that can't be a datamatrix (see DatamatrixPreFilter)
+    PRE_FILTER = DatamatrixPreFilter()
+
     def __init__(self, finder_pattern, image):
         """ Initialize the DataMatrix object with its finder pattern location in an image. To actually
         interpret the DataMatrix, the perform_read() function must be called, which will attempt to read
         the DM from the supplied image.
 
-        The matrix size is the width/height (in modules) of the Data matrix (including +2 for the edges).
-        The message length is the number of data bytes in the encoded message (i.e. not including the
-        error correction bytes).
+        The matrix size is the width/height (in modules) of the Data matrix (including +2 for the edges),
+        or "<rows>x<columns>" for a rectangular Data matrix (see DatamatrixSizeTable). If it is set to
+        AUTO_SIZE, the size is detected when the read is performed. The message length is the number of
+        data bytes in the encoded message (i.e. not including the error correction bytes).
         """
         self._finder_pattern = finder_pattern
         self._image = image.img
         self._matrix_size = self.DEFAULT_SIZE
+        self._detected_size = None
 
         self._data = None
         self._error_message = ""
@@ -49,18 +66,72 @@ class DataMatrix:
         self._damaged_symbol = False
         self._is_read_performed = False
 
+    def __getstate__(self):
+        """ The image isn't pickled with the barcode. It is only needed to perform the read, and including it
+        would make every plate passed between processes (e.g. to the camera overlay) several megabytes. """
+        state = self.__dict__.copy()
+        state['_image'] = None
+        return state
+
+    def set_image(self, image):
+        """ Set the image that the barcode is read from, e.g., to restore it after the barcode has been pickled. """
+        self._image = image.img
+
     def set_matrix_size(self, matrix_size):
-        self._matrix_size = int(matrix_size)
+        if str(matrix_size) == self.AUTO_SIZE:
+            self._matrix_size = self.AUTO_SIZE
+        else:
+            self._matrix_size = DatamatrixSizeTable.canonical_size(matrix_size)
+
+    def matrix_size(self):
+        """ The size of the datamatrix; if it is automatically detected, this is the detected size (or None
+        if the read hasn't been performed or the size couldn't be detected). """
+        if self._matrix_size == self.AUTO_SIZE:
+            return self._detected_size
+        return self._matrix_size
 
     def perform_read(self, offsets=wiggle_offsets, force_read=False):
         """ Attempt to read the DataMatrix from the image supplied in the constructor at the position
         given by the finder pattern. This is not performed automatically upon construction because the
         read operation is relatively expensive and might not always be needed.
         """
-        if not self._is_read_performed or force_read:
-            # Read the data contained in the barcode from the image
-            self._read(self._image, offsets)
-            self._is_read_performed = True
+        DataMatrix.read_many([self], offsets, force_read)
+
+    @staticmethod
+    def read_many(barcodes, offsets=wiggle_offsets, force_read=False):
+        """ Perform the read operation (see perform_read()) on each of a list of barcodes. The barcodes
+        are processed together, so the sampling, thresholding, byte extraction and error correction
+        checks for all of them are each done as a single batch operation, which is much quicker than
+        reading each barcode in turn. The results are stored in each barcode object exactly as if its
+        perform_read() had been called. Returns the list of barcodes.
+        """
+        unread = [bc for bc in barcodes if force_read or not bc._is_read_performed]
+
+        # Barcodes can only be processed as a batch if they have the same number of modules
+        batches = OrderedDict()
+        for barcode in unread:
+            if barcode._matrix_size == DataMatrix.AUTO_SIZE and not barcode._detect_size():
+                continue
+            batches.setdefault(barcode.matrix_size(), []).append(barcode)
+
+        for matrix_size, batch in batches.items():
+            DataMatrix._read_batch(batch, matrix_size, offsets)
+
+        for barcode in unread:
+            barcode._damaged_symbol = not barcode._read_ok
+            barcode._is_read_performed = True
+
+        return barcodes
+
+    def _detect_size(self):
+        """ Detect the size of the datamatrix from its timing pattern. Returns False if this fails. """
+        self._detected_size = DatamatrixBitReader.detect_matrix_size(self._finder_pattern, self._image)
+        if self._detected_size is None:
+            self._read_ok = False
+            self._error_message = "Unable to determine the size of the Datamatrix"
+            return False
+
+        return True
 
     def is_read(self):
         """ True if the read operation has been performed (whether successful or not) """
@@ -102,36 +173,107 @@ class DataMatrix:
         """ The radius (center-to-corner distance) of the DataMatrix finder pattern. """
         return self._finder_pattern.radius
 
-    def _read(self, gray_image, offsets):
-        """ From the supplied grayscale image, attempt to read the barcode at the location
-        given by the datamatrix finder pattern.
+    @staticmethod
+    def _read_batch(barcodes, matrix_size, offsets):
+        """ Attempt to read each of the barcodes (which must all be of the given matrix size) from its
+        image at the location given by its datamatrix finder pattern.
         """
-        bit_reader = DatamatrixBitReader(self._matrix_size)
+        bit_reader = DatamatrixBitReader(matrix_size)
         extractor = DatamatrixByteExtractor()
-        decoder = ReedSolomonDecoder()
+        decoder = ReedSolomonDecoder.for_matrix_size(matrix_size)
         interpreter = DatamatrixByteInterpreter()
 
-        message_length = DatamatrixSizeTable.num_data_bytes(self._matrix_size)
+        message_length = DatamatrixSizeTable.num_data_bytes(matrix_size)
 
-        # Try a few different small offsets for the sample positions until we find one that works
-        for offset in offsets:
-            # Read the bit array at the target location (with offset)
-            # If the bit array is valid, decode it and create a datamatrix object
+        # Sample the image at every module position for all of the offsets at once
+        sampled, sample_grids = [], []
+        for barcode in barcodes:
+            barcode._read_ok = False
             try:
-                bit_array = bit_reader.read_bit_array(self._finder_pattern, offset, gray_image)
-                encoded_bytes = extractor.extract_bytes(bit_array)
-                decoded_bytes = decoder.decode(encoded_bytes, message_length)
-                data = interpreter.interpret_bytes(decoded_bytes)
-
-                self._data = data
-                self._read_ok = True
-                self._error_message = ""
+                sample_grids.append(bit_reader.sample_grids(barcode._finder_pattern, offsets, barcode._image))
+                sampled.append(barcode)
+            except DatamatrixReaderError as ex:
+                barcode._error_message = str(ex)
+
+        if not sampled:
+            return
+
+        # Array of shape (num barcodes, num offsets, n, n)
+        sample_grids = np.stack(sample_grids)
+
+        # Try a few different small offsets for the sample positions until we find one that works. At each
+        # offset, every barcode that hasn't been read yet is processed in a single batch.
+        remaining = np.arange(len(sampled))
+        for k in range(len(offsets)):
+            if not len(remaining):
                 break
-            except (DatamatrixReaderError, ReedSolomonError) as ex:
-                self._read_ok = False
-                self._error_message = str(ex)
 
-        self._damaged_symbol = not self._read_ok
+            grids = sample_grids[remaining, k]
+            active = remaining
+
+            # Reject anything that obviously isn't a datamatrix before doing any further work on it
+            if DatamatrixPreFilter.ENABLED:
+                passed, rejected_by = DataMatrix.PRE_FILTER.check(grids)
+                for i, stage in zip(remaining, rejected_by):
+                    if stage is not None:
+                        sampled[i]._error_message = "Area doesn't look like a Datamatrix (failed {} check)".format(stage)
+
+                grids = grids[passed]
+                active = remaining[passed]
+                if not len(active):
+                    continue
+
+            # Read the bit arrays at the target locations (with offset)
+            try:
+                bit_arrays, sane = bit_reader.bits_from_sample_batch(grids)
+            except DatamatrixReaderError as ex:
+                for i in active:
+                    sampled[i]._error_message = str(ex)
+                continue
+
+            for i in active[~sane]:
+                sampled[i]._error_message = bit_reader.NOT_DATAMATRIX_MESSAGE
+
+            # If the bit array is valid, use the result from the last time it was decoded (if any)
+            candidates = active[sane]
+            bit_arrays = bit_arrays[sane]
+            keys = DataMatrix.DECODE_CACHE.keys(bit_arrays)
+
+            uncached = []
+            for j, key in enumerate(keys):
+                result = DataMatrix.DECODE_CACHE.get(key)
+                if result is None:
+                    uncached.append(j)
+                else:
+                    sampled[candidates[j]]._set_decode_result(*result)
+
+            # Otherwise decode it and interpret the data
+            if uncached:
+                encoded_bytes = extractor.extract_bytes_many(bit_arrays[uncached])
+                decoded = decoder.decode_many(encoded_bytes, message_length)
+
+                for j, decoded_bytes in zip(uncached, decoded):
+                    if isinstance(decoded_bytes, ReedSolomonError):
+                        data, error_message = None, str(decoded_bytes)
+                    else:
+                        # Bytes that pass the error correction can still be an invalid encoding
+                        try:
+                            data, error_message = interpreter.interpret_bytes(decoded_bytes), ""
+                        except ValueError as ex:
+                            data, error_message = None, str(ex)
+
+                    DataMatrix.DECODE_CACHE.put(keys[j], data, error_message)
+                    sampled[candidates[j]]._set_decode_result(data, error_message)
+
+            remaining = np.array([i for i in remaining if not sampled[i]._read_ok], dtype=int)
+
+    def _set_decode_result(self, data, error_message):
+        """ Store the result of decoding the bit array; the data is None if the decoding failed. """
+        if data is not None:
+            self._data = data
+            self._read_ok = True
+
+        self._error_message = error_message
 
     def draw(self, img, color):
         """ Draw the lines of the finder pattern on the specified image. """
@@ -144,10 +286,22 @@ class DataMatrix:
         """ Searches the image for all datamatrix finder patterns
         """
         locator = Locator()
+        locator.set_max_aspect_ratio(DataMatrix._max_aspect_ratio(matrix_size))
         finder_patterns = locator.locate_shallow(grayscale_img)
         unread_barcodes = DataMatrix._fps_to_barcodes(grayscale_img, finder_patterns, matrix_size)
         return unread_barcodes
 
+    @staticmethod
+    def track_barcodes(grayscale_img, last_img, barcodes, matrix_size=DEFAULT_SIZE):
+        """ Finds the barcodes located in the last image (e.g., the previous camera frame) in the new image (see
+        Locator.track()). Returns a list with the new (unread) barcode for each of the old ones, or None if it
+        couldn't be found.
+        """
+        finder_patterns = Locator.track(grayscale_img, last_img, [bc._finder_pattern for bc in barcodes],
+                                        DataMatrix._max_aspect_ratio(matrix_size))
+        return [None if fp is None else DataMatrix._fps_to_barcodes(grayscale_img, [fp], matrix_size)[0]
+                for fp in finder_patterns]
+
     @staticmethod
     def locate_all_barcodes_in_image_deep(grayscale_img, matrix_size=DEFAULT_SIZE):
         """ Searches the image for all datamatrix finder patterns
@@ -155,10 +309,19 @@ class DataMatrix:
         # TODO: deep scan is more likely to find some false finder patterns. Filter these out
         locator = Locator()
         locator.set_median_radius_tolerance(0.2)
+        locator.set_max_aspect_ratio(DataMatrix._max_aspect_ratio(matrix_size))
         finder_patterns = locator.locate_deep(grayscale_img, expected_radius=None, filter_overlap=True)
         unread_barcodes = DataMatrix._fps_to_barcodes(grayscale_img, finder_patterns, matrix_size)
         return unread_barcodes
 
+    @staticmethod
+    def _max_aspect_ratio(matrix_size):
+        """ The largest aspect ratio (columns to rows) of a datamatrix of the specified size; if the size is
+        to be detected, this is the largest aspect ratio of any size. """
+        if str(matrix_size) == DataMatrix.AUTO_SIZE:
+            return max(DatamatrixSizeTable.aspect_ratio(size) for size in DatamatrixSizeTable.valid_sizes())
+        return DatamatrixSizeTable.aspect_ratio(matrix_size)
+
     @staticmethod
     def _fps_to_barcodes(grayscale_img, finder_patterns, matrix_size):
         unread_barcodes = [DataMatrix(fp, grayscale_img) for fp in finder_patterns]
@@ -26,6 +26,10 @@ class FinderPattern:
         # Radius of datamatrix (distance from center to a corner) in pixels
         self.radius = corner.distance_to(self.center)
 
+    def offset(self, point):
+        """ Returns a new finder pattern which is the same as this one but offset (moved by the specified amount). """
+        return FinderPattern(self.corner + point, self.baseVector, self.sideVector)
+
     def point_in_radius(self, point):
         return self.bounds().contains_point(point)
 
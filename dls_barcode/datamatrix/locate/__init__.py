@@ -1 +1,2 @@
 from .locate import Locator
+from .locate_contour import ContourLocator
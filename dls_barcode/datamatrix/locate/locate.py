@@ -1,9 +1,13 @@
 from __future__ import division
 
 import math
+import threading
+from multiprocessing.pool import ThreadPool
 
+import cv2
 import numpy as np
 
+from dls_util.shape import CircleGrid, Point
 from .locate_contour import ContourLocator
 from .locate_square import SquareLocator
 
@@ -12,9 +16,26 @@ class Locator:
     """ Provides access to several different algorithms for locating (not reading) datamatrix
     finder patterns in an image.
     """
+    # Number of threads used to run the parameter sets of the deep contour search at the same time (most of
+    # the work is done by OpenCV, which releases the GIL). A value of 1 runs them one after another.
+    NUM_THREADS = 4
+
+    # When tracking finder patterns from one frame to the next: the mean difference in brightness (0-255) of the
+    # area around a pattern above which the pattern is assumed to have moved, the size of the area searched for
+    # a pattern that has moved (half of the side length, relative to the radius of the pattern), and the fraction
+    # of the patterns that can move before it is quicker to search the whole image again
+    TRACK_CHANGE_LIMIT = 10.0
+    TRACK_SEARCH_FACTOR = 2.0
+    TRACK_MAX_MOVED = 0.5
+
+    # Thread pools shared by all locators, keyed by size, see _thread_pool()
+    _pools = {}
+    _pool_lock = threading.Lock()
+
     def __init__(self):
         self._median_radius_tolerance = 0.3
         self._median_radius = 0
+        self._max_aspect_ratio = 1
         self._image = None
 
     def set_median_radius_tolerance(self, value):
@@ -23,13 +44,18 @@ class Locator:
         defines how much the size of a pattern must differ by before it is discarded. """
         self._median_radius_tolerance = value
 
+    def set_max_aspect_ratio(self, value):
+        """ The largest ratio of the lengths of the two arms of the finder patterns to look for. This is 1 for
+        square datamatrices, but the long arm of a rectangular datamatrix is up to 4 times the short one. """
+        self._max_aspect_ratio = value
+
     def locate_shallow(self, img):
         """ Use contour locating algorithm to locate finder patterns in the image. Uses a single set of
         parameters to the contour algorithm. This is quick to run and most suitable for scanning an image
         that contains multiple datamatrices. To run the algorithm multiple times with varying parameters,
         use locate_deep(). """
         # Locate finder patterns in whole image
-        finder_patterns = self._contours_shallow(img)
+        finder_patterns = self._contours_shallow(img, self._max_aspect_ratio)
 
         # Filter out any which differ significantly in size
         if len(finder_patterns) > 3:
@@ -58,7 +84,7 @@ class Locator:
         self._median_radius = expected_radius
         self._image = img
 
-        finder_patterns = self._contours_deep(img)
+        finder_patterns = self._contours_deep(img, self._max_aspect_ratio)
 
         if expected_radius is None and any(finder_patterns):
             expected_radius = np.median([fp.radius for fp in finder_patterns])
@@ -71,64 +97,155 @@ class Locator:
         if filter_overlap:
             finder_patterns = self._filter_overlapping_patterns(finder_patterns)
 
-        # If the fps are asymmetrical, correct the side lengths
+        # If the fps are asymmetrical, correct the side lengths (unless they belong to a rectangular datamatrix)
         side = expected_radius * (2 / math.sqrt(2))
-        finder_patterns = [fp.correct_lengths(side) for fp in finder_patterns]
+        finder_patterns = [fp.correct_lengths(side) if self._is_square(fp) else fp for fp in finder_patterns]
 
         return finder_patterns
 
     @staticmethod
-    def locate_square(img, side_length):
+    def track(img, last_img, finder_patterns, max_aspect_ratio=1):
+        """ Find the finder patterns that were located in the last image (e.g., the previous camera frame) in the
+        new image. Where the area of the image covered by a pattern has hardly changed, the pattern can't have
+        moved and is kept as it is. The others are looked for near their old positions (see locate_near()).
+        Returns a list with the new finder pattern for each of the old ones, or None if it couldn't be found. If
+        too many of the patterns have moved, none of them are looked for (and all are None). """
+        tracked = list(finder_patterns)
+        moved = [i for i, fp in enumerate(finder_patterns) if Locator._area_changed(img, last_img, fp)]
+
+        if len(moved) > Locator.TRACK_MAX_MOVED * len(finder_patterns):
+            return [None] * len(finder_patterns)
+
+        if moved:
+            search_radius = Locator.TRACK_SEARCH_FACTOR * np.mean([fp.radius for fp in finder_patterns])
+            positions = [finder_patterns[i].center for i in moved]
+            for i, fp in zip(moved, Locator.locate_near(img, positions, search_radius, max_aspect_ratio)):
+                tracked[i] = fp
+
+        return tracked
+
+    @staticmethod
+    def _area_changed(img, last_img, fp):
+        """ True if the area of the image covered by the finder pattern is different in the two images. """
+        new_area, _ = img.sub_image(fp.center, fp.radius)
+        last_area, _ = last_img.sub_image(fp.center, fp.radius)
+        if new_area.img.size == 0 or new_area.img.shape != last_area.img.shape:
+            return True
+
+        return np.mean(cv2.absdiff(new_area.img, last_area.img)) > Locator.TRACK_CHANGE_LIMIT
+
+    @staticmethod
+    def locate_near(img, positions, search_radius, max_aspect_ratio=1):
+        """ Use the contour locating algorithm (with the same parameters as locate_shallow()) on just the small
+        areas of the image around each of the positions, e.g., to find the finder patterns near where they were
+        in the previous frame. The areas are squares with sides 2 * search_radius. Returns a list with an item
+        for each position; the finder pattern closest to the position (as long as its center is less than half
+        of the search radius away) or None. """
+        found = []
+        for position in positions:
+            roi, rect = img.sub_image(position, search_radius)
+            origin = Point(rect[0], rect[1])
+
+            nearest = None
+            max_distance_sq = (search_radius / 2) ** 2
+            for fp in Locator._contours_shallow(roi, max_aspect_ratio):
+                fp = fp.offset(origin)
+                distance_sq = fp.center.distance_to_sq(position)
+                if distance_sq < max_distance_sq:
+                    nearest, max_distance_sq = fp, distance_sq
+
+            found.append(nearest)
+
+        return found
+
+    @staticmethod
+    def locate_square(img, side_length, warm_start=None):
         """ Use the square locator algorithm to find the most likely location of a single datamatrix in a small
         image (i.e., an image that just contains the datamatrix and its immediate surroundings. This is a 'best
-        fit' algorithm so will always return a result regardless of what the image contains. """
-        finder_pattern = SquareLocator().locate(img, side_length)
+        fit' algorithm so will always return a result regardless of what the image contains. If a finder pattern
+        previously found in the same place is supplied, the search is just a refinement of it. """
+        finder_pattern = SquareLocator().locate(img, side_length, warm_start)
         return finder_pattern
 
     @staticmethod
-    def _contours_shallow(img):
+    def _contours_shallow(img, max_aspect_ratio=1):
         """ Run the contour locating algorithm with a single parameter set. """
         c_values = [16, 8]
         morph_size = 3
         block_size = 35
 
-        # Use a couple of different values of C as much more likely to locate the finder patterns
+        # Use a couple of different values of C as much more likely to locate the finder patterns. The
+        # same contour locator is used for each so that the threshold calculation is shared.
+        contour_locator = ContourLocator(max_aspect_ratio)
         finder_patterns = []
         for C in c_values:
-            fps = ContourLocator().locate_datamatrices(img, block_size, C, morph_size)
+            fps = contour_locator.locate_datamatrices(img, block_size, C, morph_size)
             finder_patterns.extend(fps)
 
         return finder_patterns
 
     @staticmethod
-    def _contours_deep(img):
-        """ Run the contour locating algorithm multiple times with different parameter sets. """
+    def _contours_deep(img, max_aspect_ratio=1):
+        """ Run the contour locating algorithm multiple times with different parameter sets. The parameter
+        sets are shared out between NUM_THREADS threads, but the results are always combined in the same
+        order as if they had been run one after another. """
         c_values = [16, 8, 0, 4, 20]
         morph_sizes = [3, 2]
         block_size = 35
 
-        # Use a couple of different values of C as much more likely to locate the finder patterns
+        # Use a couple of different values of C as much more likely to locate the finder patterns. The
+        # same contour locator is used for each so that the thresholded images are shared.
+        contour_locator = ContourLocator(max_aspect_ratio)
+        parameter_sets = [(C, ms) for ms in morph_sizes for C in c_values]
+
+        def locate(parameters):
+            C, ms = parameters
+            return contour_locator.locate_datamatrices(img, block_size, C, ms)
+
+        if Locator.NUM_THREADS > 1:
+            results = Locator._thread_pool().map(locate, parameter_sets)
+        else:
+            results = map(locate, parameter_sets)
+
         finder_patterns = []
-        for ms in morph_sizes:
-            for C in c_values:
-                fps = ContourLocator().locate_datamatrices(img, block_size, C, ms)
-                finder_patterns.extend(fps)
+        for fps in results:
+            finder_patterns.extend(fps)
 
         return finder_patterns
 
+    @staticmethod
+    def _thread_pool():
+        """ The shared pool of NUM_THREADS threads. A pool is never closed once created, as another thread may
+        still be using it after the number of threads has been changed; the pool for the old number is kept
+        (idle) instead, and reused if that number is chosen again. """
+        with Locator._pool_lock:
+            size = Locator.NUM_THREADS
+            if size not in Locator._pools:
+                Locator._pools[size] = ThreadPool(size)
+
+            return Locator._pools[size]
+
     @staticmethod
     def _filter_overlapping_patterns(finder_patterns):
-        """ Filter out any finder patterns that overlap with others that appear earlier in the list. """
-        # Filter out patterns that overlap
+        """ Filter out any finder patterns that overlap with others that appear earlier in the list. The
+        accepted patterns are kept in a spatial index (with cells about the size of a pattern) so that
+        each one is only checked against the accepted patterns that are close to it. """
+        if not finder_patterns:
+            return []
+
+        accepted = CircleGrid(2 * np.median([fp.radius for fp in finder_patterns]))
         valid_patterns = []
         for fp in finder_patterns:
-            in_radius = False
-            for ex in valid_patterns:
-                in_radius = in_radius | ex.point_in_radius(fp.center)
-            if not in_radius:
+            if not accepted.contains_point(fp.center):
+                accepted.add(fp.bounds())
                 valid_patterns.append(fp)
         return valid_patterns
 
+    @staticmethod
+    def _is_square(fp):
+        """ True if the two arms of the finder pattern are similar in length (as for a square datamatrix). """
+        return abs(fp.baseLength - fp.sideLength) / (fp.baseLength + fp.sideLength) < 0.1
+
     def _filter_median_radius(self, fp):
         """Return true iff finder pattern radius is close to the median"""
         median = self._median_radius
@@ -1,4 +1,5 @@
 import math
+import threading
 from functools import partial, reduce
 from operator import add
 
@@ -14,16 +15,49 @@ OPENCV_MAJOR = cv2.__version__[0]
 
 class ContourLocator:
     """ Utility for finding the positions of all of the datamatrix barcodes
-    in an image """
-
-    def __init__(self):
-        pass
+    in an image.
+
+    The same locator can be used to search an image several times with different parameters. The local
+    mean image used by the adaptive threshold only depends on the block size, so it is calculated once per
+    image and each value of C then only needs a cheap comparison with it. Each thresholded image is also
+    kept so that it can be reused with a different close size. The locator can be used from several
+    threads at once.
+
+    The contours found in the image are approximated by polygons, and then the polygons that probably
+    aren't datamatrix perimeters are discarded by a series of filters. All of the polygons are checked at
+    once, as rows of padded arrays. The numbers of polygons dropped by each filter (for all locators) are
+    recorded, see filter_counts().
+    """
+    # Names of the polygon filters, in the order they are applied
+    NON_TRIVIAL = "non-trivial"
+    LONGEST_ADJACENT = "longest adjacent"
+    LONGEST_ORTHOGONAL = "longest orthogonal"
+    LONGEST_SIMILAR = "longest similar in length"
+    FILTERS = [NON_TRIVIAL, LONGEST_ADJACENT, LONGEST_ORTHOGONAL, LONGEST_SIMILAR]
+
+    # Structuring elements for the morphological close, keyed by size
+    _close_elements = {}
+
+    # Number of polygons checked and dropped by each filter
+    _num_polygons = 0
+    _num_dropped = dict((name, 0) for name in FILTERS)
+    _counts_lock = threading.Lock()
+
+    def __init__(self, max_aspect_ratio=1):
+        """ The arms of the finder pattern of a square datamatrix are the same length, but the long arm of a
+        rectangular datamatrix can be up to max_aspect_ratio times the length of the short arm. """
+        self._max_aspect_ratio = max_aspect_ratio
+        self._image = None
+        self._block_size = None
+        self._mean_difference = None
+        self._threshold_images = {}
+        self._lock = threading.Lock()
 
     def locate_datamatrices(self, gray_image, blocksize, C, close_size):
         """Get the positions of (hopefully all) datamatrices within an image.
         """
         # Perform adaptive threshold, reducing to a binary image
-        threshold_image = self._do_threshold(gray_image, blocksize, C)
+        threshold_image = self._cached_threshold(gray_image, blocksize, C)
 
         # Perform a morphological close, removing noise and closing some gaps
         morphed_image = self._do_close_morph(threshold_image, close_size)
@@ -32,32 +66,143 @@ class ContourLocator:
         contours = self._get_contours(morphed_image)
         polygons = self._contours_to_polygons(contours)
 
-        # Convert lists of vertices to lists of edges (easier to work with).
-        edge_sets = map(self._polygons_to_edges, polygons)
-
-        # Discard all edge sets which probably aren't datamatrix perimeters.
-        edge_sets = filter(self._filter_non_trivial, edge_sets)
-        edge_sets = filter(self._filter_longest_adjacent, edge_sets)
-        edge_sets = filter(self._filter_longest_approx_orthogonal, edge_sets)
-        edge_sets = filter(self._filter_longest_similar_in_length, edge_sets)
+        # Discard all polygons which probably aren't datamatrix perimeters.
+        survivors, longest_pairs = self._filter_polygons(polygons, self._max_aspect_ratio)
 
-        # Convert edge sets to FinderPattern objects
-        fps = [self._get_finder_pattern(es) for es in edge_sets]
+        # Convert lists of vertices to lists of edges (easier to work with), and then to FinderPattern objects
+        edge_sets = [self._polygons_to_edges(polygons[k]) for k in survivors]
+        fps = [self._get_finder_pattern(es, pair) for es, pair in zip(edge_sets, longest_pairs)]
 
         return fps
 
+    @staticmethod
+    def filter_counts():
+        """ The total number of polygons checked by the filters, and a dictionary of the number that were
+        dropped by each filter. """
+        with ContourLocator._counts_lock:
+            return ContourLocator._num_polygons, dict(ContourLocator._num_dropped)
+
+    @staticmethod
+    def reset_filter_counts():
+        with ContourLocator._counts_lock:
+            ContourLocator._num_polygons = 0
+            for name in ContourLocator.FILTERS:
+                ContourLocator._num_dropped[name] = 0
+
+    @staticmethod
+    def _filter_polygons(polygons, max_aspect_ratio=1):
+        """ Apply each of the filters (the same as the _filter_* functions, in turn) to all of the polygons
+        at once. Returns the indices of the polygons that passed every filter and the indices of the two
+        longest edges of each of those polygons.
+
+        The vertices of the polygons are gathered into a padded array (one row per polygon) and the edge
+        vectors, edge lengths and the two longest edges of every polygon are calculated in single operations.
+        """
+        sizes = np.array([len(p) for p in polygons], dtype=int)
+
+        # A polygon with n > 1 vertices has n edges
+        candidates = np.flatnonzero(sizes > 6)
+        dropped = [len(polygons) - len(candidates)]
+
+        longest = np.zeros((0, 2), dtype=int)
+        if len(candidates):
+            sizes = sizes[candidates]
+            num, width = len(candidates), sizes.max()
+
+            # Vertices of each polygon, padded out to the same number
+            positions = np.arange(width)
+            valid = positions < sizes[:, np.newaxis]
+            vertices = np.zeros((num, width, 2), dtype=np.int64)
+            vertices[valid] = np.concatenate([polygons[k] for k in candidates])
+
+            # Edge k runs from vertex k to the next vertex (wrapping around); its vector points back to the start
+            next_vertex = np.where(positions + 1 < sizes[:, np.newaxis], positions + 1, 0)
+            vectors = vertices - vertices[np.arange(num)[:, np.newaxis], next_vertex]
+            lengths = np.sqrt(np.sum(vectors * vectors, axis=2))
+            lengths[~valid] = -np.inf
+
+            # Indices of the longest and second longest edges
+            order = np.argsort(lengths, axis=1)
+            rows = np.arange(num)
+            i, j = order[:, -1], order[:, -2]
+            l_i, l_j = lengths[rows, i], lengths[rows, j]
+
+            # Where the longest edges are tied, which ones are picked depends on the sort, so use the same
+            # choice as _longest_pair_indices()
+            l_k = lengths[rows, order[:, -3]]
+            for row in np.flatnonzero((l_i == l_j) | (l_j == l_k)):
+                i[row], j[row] = np.asarray(lengths[row, :sizes[row]].tolist()).argsort()[-2:][::-1]
+            l_i, l_j = lengths[rows, i], lengths[rows, j]
+            v_i, v_j = vectors[rows, i], vectors[rows, j]
+
+            separation = np.abs(i - j)
+            adjacent = (separation == 1) | (separation == sizes - 1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                orthogonal = np.abs(np.sum(v_i * v_j, axis=1) / (l_i * l_j)) < 0.1
+                similar = (l_i - max_aspect_ratio * l_j) / (l_i + max_aspect_ratio * l_j) < 0.1
+
+            # Each polygon is dropped by the first filter that it fails
+            passed = np.ones(num, dtype=bool)
+            for check in [adjacent, orthogonal, similar]:
+                dropped.append(np.count_nonzero(passed & ~check))
+                passed &= check
+
+            candidates = candidates[passed]
+            longest = np.column_stack((i[passed], j[passed]))
+        else:
+            dropped.extend([0] * (len(ContourLocator.FILTERS) - 1))
+
+        with ContourLocator._counts_lock:
+            ContourLocator._num_polygons += len(polygons)
+            for name, count in zip(ContourLocator.FILTERS, dropped):
+                ContourLocator._num_dropped[name] += int(count)
+
+        return candidates.tolist(), longest.tolist()
+
+    def _cached_threshold(self, gray_image, block_size, c):
+        """ Perform an adaptive threshold operation on the image, reusing the local mean image (and the
+        result) from earlier thresholds of the same image. """
+        with self._lock:
+            if gray_image.img is not self._image or block_size != self._block_size:
+                self._image = gray_image.img
+                self._block_size = block_size
+                self._mean_difference = self._local_mean_difference(gray_image, block_size)
+                self._threshold_images = {}
+
+            if c not in self._threshold_images:
+                self._threshold_images[c] = Image(self._threshold_difference(self._mean_difference, c))
+
+            return self._threshold_images[c]
+
     @staticmethod
     def _do_threshold(gray_image, block_size, c):
         """ Perform an adaptive threshold operation on the image. """
+        difference = ContourLocator._local_mean_difference(gray_image, block_size)
+        return Image(ContourLocator._threshold_difference(difference, c))
+
+    @staticmethod
+    def _local_mean_difference(gray_image, block_size):
+        """ The difference between each pixel and the mean of the block around it, calculated in exactly
+        the same way as cv2.adaptiveThreshold() does (with ADAPTIVE_THRESH_MEAN_C). """
         raw = gray_image.img
-        thresh = cv2.adaptiveThreshold(raw, 255.0, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block_size, c)
-        return Image(thresh)
+        mean = cv2.boxFilter(raw, cv2.CV_8U, (block_size, block_size), normalize=True,
+                             borderType=cv2.BORDER_REPLICATE | cv2.BORDER_ISOLATED)
+        return cv2.subtract(raw, mean, dtype=cv2.CV_16S)
+
+    @staticmethod
+    def _threshold_difference(difference, c):
+        """ Binary threshold of the local mean difference image, which gives the same result as
+        cv2.adaptiveThreshold() (THRESH_BINARY with a max value of 255) for the given value of C. """
+        return cv2.compare(difference, -math.ceil(c), cv2.CMP_GT)
 
     @staticmethod
     def _do_close_morph(threshold_image, morph_size):
         """ Perform a generic morphological operation on an image. """
-        element = cv2.getStructuringElement(cv2.MORPH_RECT, (morph_size, morph_size))
-        closed = cv2.morphologyEx(threshold_image.img, cv2.MORPH_CLOSE, element, iterations=1)
+        elements = ContourLocator._close_elements
+        if morph_size not in elements:
+            elements[morph_size] = cv2.getStructuringElement(cv2.MORPH_RECT, (morph_size, morph_size))
+
+        closed = cv2.morphologyEx(threshold_image.img, cv2.MORPH_CLOSE, elements[morph_size], iterations=1)
         return Image(closed)
 
     @staticmethod
@@ -131,12 +276,13 @@ class ContourLocator:
         return abs(_cosine(v_i, v_j)) < 0.1
 
     @staticmethod
-    def _filter_longest_similar_in_length(edges):
-        """Return True iff the two longest edges are similar in length.
+    def _filter_longest_similar_in_length(edges, max_aspect_ratio=1):
+        """Return True iff the two longest edges are similar in length (once the shorter one has
+        been scaled by up to the maximum aspect ratio).
         """
         i, j = ContourLocator._longest_pair_indices(edges)
         l_i, l_j = (_length(edges[x]) for x in (i, j))
-        return abs(l_i - l_j)/abs(l_i + l_j) < 0.1
+        return (l_i - max_aspect_ratio * l_j)/(l_i + max_aspect_ratio * l_j) < 0.1
 
     @staticmethod
     def _longest_pair_indices(edges):
@@ -146,7 +292,7 @@ class ContourLocator:
         return np.asarray(lengths).argsort()[-2:][::-1]
 
     @staticmethod
-    def _get_finder_pattern(edges):
+    def _get_finder_pattern(edges, longest_pair=None):
         """Return information about the "main" corner from a set of edges.
 
         This function finds the corner between the longest two edges, which should
@@ -162,11 +308,12 @@ class ContourLocator:
               X--->
          corner
 
-        This provides a convenient way to refer to the position of a datamatrix.
+        This provides a convenient way to refer to the position of a datamatrix. The indices of the two
+        longest edges are calculated if they aren't supplied.
         """
         self = ContourLocator
 
-        i, j = self._longest_pair_indices(edges)
+        i, j = self._longest_pair_indices(edges) if longest_pair is None else longest_pair
         pair_longest_edges = [edges[x] for x in (i, j)]
         x_corner = self._get_shared_vertex(*pair_longest_edges)
         c, d = map(partial(self._get_other_vertex, x_corner), pair_longest_edges)
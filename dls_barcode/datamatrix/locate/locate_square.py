@@ -1,6 +1,7 @@
 from __future__ import division
 
 import math
+import time
 
 import cv2
 import numpy as np
@@ -13,10 +14,31 @@ from dls_util.image import Image, Color
 
 class SquareLocator:
     """ Utility to locate a single datamatrix finder pattern in a small image in which the datamatrix
-    is located roughly in the middle of the image, but at any orientation. """
+    is located roughly in the middle of the image, but at any orientation.
+
+    The search only tries whole degree rotations, so rather than rotating the image for every candidate
+    square, the brightness of a square is summed from an integral image of the whole image rotated by the
+    candidate's angle (see _RotatedIntegrals). The search is first made on downsampled copies of the image
+    (coarsest first), and then refined at full resolution from the coarse result.
+    """
 
     DEBUG = False
 
+    # Factor by which the image is downsampled at each level of the coarse search, and the smallest barcode
+    # side length (in the downsampled image) for which a level is used
+    COARSE_FACTOR = 2
+    MIN_COARSE_SIZE = 16
+
+    # Rotations (in degrees) tried by the search; after the first (coarsest) level, the search only needs to
+    # refine the angle that has already been found
+    ANGLE_STEPS = [-30, -20, -10, -5, -2, -1, 0, 1, 2, 5, 10, 20, 30]
+    FINE_ANGLE_STEPS = [-2, -1, 0, 1, 2]
+
+    # Default search budget: the maximum number of metric evaluations and the maximum time (in seconds) that
+    # a single locate may take. None means no limit. When the budget runs out, the best fit found so far is used.
+    MAX_EVALUATIONS = 2000
+    TIME_LIMIT = None
+
     OPT_ADAPT_SIZE = True
 
     # Specifies the geometry of the text that appears above and below each
@@ -29,30 +51,61 @@ class SquareLocator:
     def __init__(self):
         self.metric_cache = dict()
         self.count = 0
+        self._max_evaluations = None
+        self._deadline = None
 
-    def locate(self, gray_img, barcode_size):
-        """ Get the finder pattern of the datamatrix of the specified side length. """
+    def locate(self, gray_img, barcode_size, warm_start=None, max_evaluations=None, time_limit=None):
+        """ Get the finder pattern of the datamatrix of the specified side length.
+
+        If the finder pattern found in (roughly) the same place before is supplied as the warm start (e.g.,
+        from the previous frame of a stationary puck) the search starts from it, and only refines the fit.
+        The search stops early, with the best fit so far, if it uses up the budget of metric evaluations or
+        time (the class defaults are used if these aren't given).
+        """
         # Clear cache
         self.metric_cache = dict()
         self.count = 0
+        self._max_evaluations = self.MAX_EVALUATIONS if max_evaluations is None else max_evaluations
+        time_limit = self.TIME_LIMIT if time_limit is None else time_limit
+        self._deadline = None if time_limit is None else time.time() + time_limit
 
         if self.DEBUG:
             gray_img.rescale(4).popup()
 
         # Threshold the image converting it to a binary image
         binary_image = self._adaptive_threshold(gray_img.img, 99, 0)
+        integrals = _RotatedIntegrals(binary_image.img)
+
+        # Find the transform that best fits the square to the barcode. If the barcode is big enough, the
+        # search starts on smaller versions of the image, each one refining the result of the previous one
+        if warm_start is None:
+            transform = Transform(gray_img.center().intify(), 0, 1)
+            angle_steps = self.ANGLE_STEPS
+            coarse_factors = self._coarse_factors(barcode_size)
+        else:
+            transform = self._finder_pattern_transform(warm_start)
+            angle_steps = self.FINE_ANGLE_STEPS
+            coarse_factors = []
+
+        for factor in coarse_factors:
+            height, width = binary_image.img.shape
+            coarse_image = Image(cv2.resize(binary_image.img, (int(width / factor), int(height / factor)),
+                                            interpolation=cv2.INTER_AREA))
+            coarse_start = Transform((transform.trans / factor).intify(), transform.rot, 1)
+            coarse_transform = self._minimise_integer_grid(coarse_image, _RotatedIntegrals(coarse_image.img),
+                                                           coarse_start, barcode_size / factor, angle_steps)
+            transform = Transform((coarse_transform.trans * factor).intify(), coarse_transform.rot, 1)
+            angle_steps = self.FINE_ANGLE_STEPS
+
+        best_transform = self._minimise_integer_grid(binary_image, integrals, transform, barcode_size, angle_steps)
 
-        # Find the transform that best fits the square to the barcode
-        best_transform = self._minimise_integer_grid(binary_image, gray_img.center(), barcode_size)
-
-        # Get the finder pattern
-        fp = self._locate_finder_in_square(binary_image, best_transform, barcode_size)
-
-        if self.DEBUG and fp is not None:
-            img = _draw_finder_pattern(binary_image, best_transform, fp)
-            img.rescale(4).popup()
+        if self.DEBUG:
+            fp = self._locate_finder_in_square(binary_image, best_transform, barcode_size)
+            if fp is not None:
+                img = _draw_finder_pattern(binary_image, best_transform, fp)
+                img.rescale(4).popup()
 
-        best_transform = self._find_best_fp(binary_image, best_transform, barcode_size)
+        best_transform = self._find_best_fp(integrals, best_transform, barcode_size)
         fp = self._locate_finder_in_square(binary_image, best_transform, barcode_size)
 
         if self.DEBUG and fp is not None:
@@ -62,6 +115,30 @@ class SquareLocator:
 
         return fp
 
+    def budget_exhausted(self):
+        """ True if the search budget of the current (or last) locate has been used up. """
+        if self._max_evaluations is not None and self.count >= self._max_evaluations:
+            return True
+        return self._deadline is not None and time.time() >= self._deadline
+
+    @staticmethod
+    def _finder_pattern_transform(fp):
+        """ The transform of the square covered by the finder pattern. The square metric is the same for
+        rotations of 90 degrees, so the angle is given in whole degrees in the range [0, 90). """
+        degrees = int(round(math.degrees(math.atan2(fp.baseVector.y, fp.baseVector.x)))) % 90
+        return Transform(fp.center.intify(), math.radians(degrees), 1)
+
+    @staticmethod
+    def _coarse_factors(barcode_size):
+        """ The factors by which the image is downsampled for the coarse searches, largest first. The
+        barcode must still be at least MIN_COARSE_SIZE pixels across in each downsampled image. """
+        factors = []
+        factor = SquareLocator.COARSE_FACTOR
+        while barcode_size / factor >= SquareLocator.MIN_COARSE_SIZE:
+            factors.insert(0, factor)
+            factor *= SquareLocator.COARSE_FACTOR
+        return factors
+
     @staticmethod
     def _adaptive_threshold(image, block_size, c):
         """ Perform an adaptive threshold operation on the image, reducing it to a binary image.
@@ -71,16 +148,18 @@ class SquareLocator:
 
         return Image(thresh)
 
-    def _minimise_integer_grid(self, binary_image, center, side_length):
-        """ Attempt to locate the square area (of the specified size, centered on the specified
-        center point) in the binary image which has the minimum brightness.
+    def _minimise_integer_grid(self, binary_image, integrals, initial_transform, side_length, angle_steps):
+        """ Attempt to locate the square area (of the specified size, starting from the specified
+        transform) in the binary image which has the minimum brightness.
 
         The datamatrix is a relatively dark area on a relative light background, so the area
         corresponding to the datamatrix should have the lowest brightness.
         """
         done = False
 
-        initial_transform = Transform(center.intify(), 0, 1)
+        # The cached metrics only apply to this image
+        self.metric_cache = dict()
+
         best_val = 1000000000000000
         best_trs = initial_transform
 
@@ -93,10 +172,13 @@ class SquareLocator:
         done_previous = False
         while not done:
             count += 1
-            transforms = self._make_minimisation_transforms(initial_transform, iteration=count)
+            transforms = self._make_minimisation_transforms(initial_transform, angle_steps, iteration=count)
 
             for trs in transforms:
-                val = self._calculate_square_metric(binary_image, trs, side_length)
+                if self.budget_exhausted():
+                    return best_trs
+
+                val = self._calculate_square_metric(integrals, trs, side_length)
                 if val < best_val:
                     best_val = val
                     best_trs = trs
@@ -120,7 +202,7 @@ class SquareLocator:
         return best_trs
 
     @staticmethod
-    def _make_minimisation_transforms(transform, iteration=0):
+    def _make_minimisation_transforms(transform, angle_steps, iteration=0):
         """ Create a selection of transforms that differ slightly from the supplied transform.
         """
         angle_points = [0]
@@ -131,7 +213,7 @@ class SquareLocator:
         if even:
             grid_points = [-5, -1, 0, 1, 5]
         else:
-            angle_points = [-30, -20, -10, -5, -2, -1, 0, 1, 2, 5, 10, 20, 30]
+            angle_points = angle_steps
 
         return SquareLocator._make_transforms(transform, grid_points, angle_points)
 
@@ -157,7 +239,7 @@ class SquareLocator:
 
         return transforms
 
-    def _calculate_square_metric(self, binary_image, transform, size):
+    def _calculate_square_metric(self, integrals, transform, size):
         """ For the square area (defined by the transform and size) in the binary
         image, calculate the average brightness per pixel.
 
@@ -176,8 +258,9 @@ class SquareLocator:
             brightness = self.metric_cache[key]
 
         else:
-            rotated = binary_image.rotate(angle, center)
-            brightness = rotated.calculate_brightness(center, size, size)
+            x1, y1 = int(round(center.x - size / 2)), int(round(center.y - size / 2))
+            x2, y2 = int(round(x1 + size)), int(round(y1 + size))
+            brightness = integrals.rect_sums(transform, [(x1, y1, x2, y2)], period=90)[0] / (size * size)
 
             # Store in dictionary
             self.metric_cache[key] = brightness
@@ -211,53 +294,39 @@ class SquareLocator:
         self.count += 1
         return brightness
 
-    def _find_best_fp(self, binary_image, initial_transform, side_length):
+    def _find_best_fp(self, integrals, initial_transform, side_length):
         best_val = 1000000000000000
         best_trs = initial_transform
 
         kings = self._make_fp_optimiser_transforms(initial_transform)
         for trs in kings:
-            val = self._calculate_fp_metric(binary_image, trs, side_length)
+            if self.budget_exhausted():
+                break
+
+            val = self._calculate_fp_metric(integrals, trs, side_length)
             if val < best_val:
                 best_val = val
                 best_trs = trs
 
         return best_trs
 
-    def _calculate_fp_metric(self, image, transform, size):
+    def _calculate_fp_metric(self, integrals, transform, size):
         """ For the located barcode in the image, identify which of the sides make
         up the finder pattern.
         """
         self.count += 1
         radius = int(round(size/2))
         center = transform.trans
-        angle = transform.rot
-
-        rotated = image.rotate(angle, center)
 
         sx1, sy1 = center.x - radius, center.y - radius
         sx2, sy2 = center.x + radius, center.y + radius
         thick = int(round(size / 14))
 
-        # Top
-        x1, y1 = sx1, sy1
-        x2, y2 = sx2, sy1 + thick
-        top = np.sum(rotated.img[y1:y2, x1:x2]) / (size * thick)
-
-        # Left
-        x1, y1 = sx1, sy1
-        x2, y2 = sx1 + thick, sy2
-        left = np.sum(rotated.img[y1:y2, x1:x2]) / (size * thick)
-
-        # Bottom
-        x1, y1 = sx1, sy2 - thick
-        x2, y2 = sx2, sy2
-        bottom = np.sum(rotated.img[y1:y2, x1:x2]) / (size * thick)
-
-        # Right
-        x1, y1 = sx2 - thick, sy1
-        x2, y2 = sx2, sy2
-        right = np.sum(rotated.img[y1:y2, x1:x2]) / (size * thick)
+        strips = [(sx1, sy1, sx2, sy1 + thick),  # Top
+                  (sx1, sy1, sx1 + thick, sy2),  # Left
+                  (sx1, sy2 - thick, sx2, sy2),  # Bottom
+                  (sx2 - thick, sy1, sx2, sy2)]  # Right
+        top, left, bottom, right = [total / (size * thick) for total in integrals.rect_sums(transform, strips)]
 
         # Identify finder edges
         if top < bottom and left < right:
@@ -342,6 +411,63 @@ class SquareLocator:
         return fp
 
 
+class _RotatedIntegrals:
+    """ Integral images of a (binary) image rotated by whole numbers of degrees, used to sum the pixels
+    of a rectangle in the image as it would be after rotating the image around any point.
+
+    Rotating the image around a point c is the same as rotating it around the middle of the image and then
+    shifting it, so the pixels of a rectangle in the image rotated around c can be summed from the
+    rectangle shifted by the same amount in the image rotated around the middle. That image is made large
+    enough to hold the whole of the rotated image, and its integral image is calculated once per angle,
+    the first time the angle is needed.
+    """
+    def __init__(self, image):
+        self._image = image
+        height, width = image.shape
+        self._side = int(math.ceil(math.hypot(width, height))) + 2
+        self._center = (width / 2, height / 2)
+        self._integrals = {}
+
+    def rect_sums(self, transform, rects, period=360):
+        """ The sums of the pixels in each of the rectangles (x1, y1, x2, y2), covering [x1, x2) x [y1, y2),
+        of the image after it has been rotated by the transform's angle around the transform's position (see
+        Image.rotate). If the measurement is unchanged by rotations of a smaller period (e.g. 90 degrees for
+        a square centered on the position) then the angle can be reduced to that period, so that fewer
+        images are needed. """
+        degrees = int(round(math.degrees(transform.rot)))
+        integral, (a, b, tx, c, d, ty) = self._rotated_integral(degrees % period)
+
+        # Shift of the center of rotation caused by rotating around the middle of the image instead
+        x, y = transform.trans.x, transform.trans.y
+        dx = int(round(a * x + b * y + tx - x))
+        dy = int(round(c * x + d * y + ty - y))
+
+        side = self._side
+        sums = []
+        for x1, y1, x2, y2 in rects:
+            x1, x2 = min(max(int(x1) + dx, 0), side), min(max(int(x2) + dx, 0), side)
+            y1, y2 = min(max(int(y1) + dy, 0), side), min(max(int(y2) + dy, 0), side)
+            if x2 <= x1 or y2 <= y1:
+                sums.append(0)
+            else:
+                sums.append(int(integral[y2, x2]) - int(integral[y1, x2]) -
+                            int(integral[y2, x1]) + int(integral[y1, x1]))
+
+        return sums
+
+    def _rotated_integral(self, degrees):
+        if degrees not in self._integrals:
+            # Rotate about the middle of the image, and move the middle to the middle of the larger frame
+            matrix = cv2.getRotationMatrix2D(self._center, degrees, 1.0)
+            matrix[0, 2] += self._side / 2 - self._center[0]
+            matrix[1, 2] += self._side / 2 - self._center[1]
+
+            rotated = cv2.warpAffine(self._image, matrix, (self._side, self._side))
+            self._integrals[degrees] = (cv2.integral(rotated, sdepth=cv2.CV_32S), tuple(matrix.ravel().tolist()))
+
+        return self._integrals[degrees]
+
+
 def _rotate_around_point(point, angle, center):
     """ Rotate the point about the center position """
     x = point.x - center.x
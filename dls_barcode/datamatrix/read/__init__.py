@@ -3,5 +3,5 @@ from .bits import DatamatrixBitReader, DatamatrixReaderError
 from .extract import DatamatrixByteExtractor
 from .reedsolo import ReedSolomonDecoder, ReedSolomonError
 from .interpret import DatamatrixByteInterpreter
-
-
+from .cache import DatamatrixDecodeCache
+from .prefilter import DatamatrixPreFilter
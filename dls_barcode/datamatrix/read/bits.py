@@ -1,7 +1,9 @@
 from __future__ import division
 
+import cv2
 import numpy as np
-import itertools
+
+from .size_table import DatamatrixSizeTable
 
 
 class DatamatrixReaderError(Exception):
@@ -12,8 +14,27 @@ class DatamatrixBitReader:
     """ Contains functionality to read the bit pattern that encodes a barcode from an image
     """
 
+    WINDOW_SIZE = 3
+
+    NOT_DATAMATRIX_MESSAGE = "Area doesn't look like a Datamatrix (too many/too few bits)"
+
+    # Number of points sampled along the timing edges (per module of the largest datamatrix) when
+    # detecting the matrix size
+    TIMING_SAMPLES_PER_MODULE = 6
+
+    # Largest (short edge) size that is considered when detecting the matrix size; the larger symbols
+    # have too many modules to count the transitions reliably at the resolution of the images
+    MAX_DETECTED_SIZE = 26
+
     def __init__(self, matrix_size):
         self._matrix_size = matrix_size
+        self._rows, self._cols = DatamatrixSizeTable.dimensions(matrix_size)
+
+        # Positions of the rows and columns of data modules in the (flipped) grid, skipping the finder and
+        # timing patterns around each data region
+        region_rows, region_cols = DatamatrixSizeTable.data_region_size(matrix_size)
+        self._data_rows = _data_module_positions(self._rows, region_rows)
+        self._data_cols = _data_module_positions(self._cols, region_cols)
 
     def read_bit_array(self, finder_pattern, offset, cv_img):
         """ Return a datamatrix boolean array by sampling points in the image array.
@@ -28,57 +49,179 @@ class DatamatrixBitReader:
         If this function doesn't work, it's quite likely that the cause is that one of the vectors
         passed in has slightly the wrong length.
         """
-        n = self._matrix_size
+        datamatrix_samples = self.sample_grids(finder_pattern, [offset], cv_img)[0]
+        return self.bits_from_samples(datamatrix_samples)
 
+    def sample_grids(self, finder_pattern, offsets, cv_img):
+        """ Sample the image at the center of every module of the datamatrix, once for each of the
+        supplied offsets. Returns an array of shape (num offsets, rows, columns) where element [k, y, x] is
+        the average brightness around the module (x, y) for the k-th offset.
+
+        All of the sample positions (for every offset) are calculated in a single operation and the
+        window averages are then gathered from an integral image of the area being sampled, so this
+        is much cheaper than sampling each module (or each offset) individually.
+        """
         try:
-            # Determine the pixel locations to sample
-            datamatrix_samples = np.empty((n, n))
-            grid = self._datamatrix_sample_points(finder_pattern, offset, matrix_size=n)
-            for ((x, y), point) in grid:
-                datamatrix_samples[y, x] = int(self._window_average(cv_img, point))
+            points = self._sample_point_array(finder_pattern, offsets, self._rows, self._cols)
+            sums = self._window_sums(cv_img, points)
+        except IndexError:
+            raise DatamatrixReaderError("Error reading Datamatrix")
+
+        # Integer average brightness (sums are non-negative, so floor division is the same as truncation)
+        return (sums // (self.WINDOW_SIZE * self.WINDOW_SIZE)).astype(float)
+
+    def bits_from_samples(self, datamatrix_samples):
+        """ Convert a single grid of brightness samples (as returned by sample_grids()) into the array
+        of datamatrix bits, removing the finder, timing and alignment patterns.
+        """
+        bit_arrays, sane = self.bits_from_sample_batch(datamatrix_samples[np.newaxis])
+
+        if not sane[0]:
+            raise DatamatrixReaderError(self.NOT_DATAMATRIX_MESSAGE)
 
-            thresholds = [self._threshold(datamatrix_samples, val) for val in range(256)]
-            b_errors = [self._border_errors(t) for t in thresholds]
-            best_threshold_value, badness = self._smart_minimum(b_errors)
+        return bit_arrays[0]
+
+    def bits_from_sample_batch(self, sample_batch):
+        """ Threshold a stack of sample grids (shape (num grids, rows, columns)) all at once. Returns an
+        array of the bit arrays (shape (num grids, mapping rows, mapping columns), see
+        DatamatrixSizeTable.mapping_matrix_size()) and a boolean array which is False for any grid that
+        failed the sanity check (see _sanity_check_batch()).
+        """
+        try:
+            b_errors = self._border_error_curves(sample_batch)
+            best_threshold_values, badness = self._smart_minimum(b_errors)
 
             _ = badness  # Throw this away (for now).
             # TODO: Tweak vector lengths to minimise badness?
 
             # Flip the datamatrix so its reference corner is at large i, small j.
-            # Also now remove the border (reference edges and timing patterns).
-            bit_array = self._threshold(datamatrix_samples, best_threshold_value)[::-1, :][1:-1, 1:-1]
+            # Also now remove the border (reference edges and timing patterns), and the alignment patterns
+            # between the data regions.
+            thresholds = best_threshold_values[:, np.newaxis, np.newaxis]
+            bit_arrays = self._threshold(sample_batch, thresholds)[:, ::-1, :]
+            bit_arrays = bit_arrays[:, self._data_rows[:, np.newaxis], self._data_cols]
 
         except IndexError:
             raise DatamatrixReaderError("Error reading Datamatrix")
 
-        self._perform_sanity_check(bit_array)
+        sane = self._sanity_check_batch(bit_arrays)
+
+        return bit_arrays, sane
+
+    @staticmethod
+    def detect_matrix_size(finder_pattern, cv_img, valid_sizes=None):
+        """ Estimate the size (number of modules along each edge) of the datamatrix located by the finder
+        pattern by counting the transitions between dark and light modules along each of the two
+        alternating timing edges. An edge of n modules has n-1 transitions. The estimate is snapped to the
+        nearest of the valid sizes; None is returned if it isn't close to any of them. If the two edges
+        are clearly different lengths, only the rectangular sizes are considered.
+
+        Each edge is sampled along lines a quarter, a half and three quarters of the way into the edge
+        modules of the largest valid size (so that the lines lie within the timing pattern whatever the
+        actual size), and the line with the most transitions is used. The other lines can only have
+        fewer transitions, because they either miss the datamatrix or cross the data modules.
+        """
+        if valid_sizes is None:
+            valid_sizes = [size for size in DatamatrixSizeTable.valid_sizes()
+                           if min(DatamatrixSizeTable.dimensions(size)) <= DatamatrixBitReader.MAX_DETECTED_SIZE]
+        dimensions = [DatamatrixSizeTable.dimensions(size) for size in valid_sizes]
+        max_size = max(min(dims) for dims in dimensions)
+
+        corner = np.asarray(finder_pattern.corner.tuple(), dtype=float)
+        base_vec = np.asarray(finder_pattern.baseVector.tuple(), dtype=float)
+        side_vec = np.asarray(finder_pattern.sideVector.tuple(), dtype=float)
+
+        # Fractional positions along the edges, and of the lines across the edges
+        num_samples = DatamatrixBitReader.TIMING_SAMPLES_PER_MODULE * max_size
+        along = np.linspace(0.25 / max_size, 1 - 0.25 / max_size, num_samples)[np.newaxis, :, np.newaxis]
+        across = 1 - (np.array([0.25, 0.5, 0.75]) / max_size)[:, np.newaxis, np.newaxis]
 
-        return bit_array
+        # One timing edge is opposite the base (runs along the base vector), the other is opposite the side
+        top_edge = corner + along * base_vec + across * side_vec
+        right_edge = corner + across * base_vec + along * side_vec
+        points = np.array([top_edge, right_edge]).astype(int)
+
+        profiles = DatamatrixBitReader._window_sums(cv_img, points).astype(float)
+
+        # Count the transitions ignoring very short runs (noise), then count again ignoring any runs
+        # shorter than 40% of the module length for the first estimate of the size
+        min_run = DatamatrixBitReader.TIMING_SAMPLES_PER_MODULE // 2
+        transitions = _count_transitions(profiles, min_run).max()
+        min_run = max(min_run, int(0.4 * num_samples / (transitions + 1)))
+        transitions = _count_transitions(profiles, min_run).max(axis=1)
+
+        # The top edge has a module for each column and the right edge a module for each row
+        cols, rows = transitions + 1
+
+        # The edges of the rectangular sizes differ by at least 10 modules
+        if abs(rows - cols) <= 4:
+            estimate = np.mean(transitions) + 1
+            errors = [abs(r - estimate) if r == c else np.inf for r, c in dimensions]
+        else:
+            errors = [max(abs(r - rows), abs(c - cols)) if r != c else np.inf for r, c in dimensions]
+
+        best = int(np.argmin(errors))
+        if errors[best] > 1:
+            return None
+
+        return valid_sizes[best]
 
     @staticmethod
-    def _datamatrix_sample_points(finder_pattern, offset, matrix_size):
+    def _sample_point_array(finder_pattern, offsets, rows, cols):
         """ Get pixel positions corresponding to individual bits in a datamatrix. This is done based on the
         position of a datamatrix.
 
-        Each returned pixel position comes also with an (x, y) pair which denotes the position of the
-        corresponding bit in the datamatrix, starting at (0, 0) in the bottom left corner and up to (n-1, n-1)
-        at the top right.
+        Returns an integer array of shape (num offsets, rows, cols, 2) where element [k, y, x] is the (x, y)
+        pixel position of the bit (x, y) for the k-th offset. Bit positions start at (0, 0) in the bottom
+        left corner and go up to (cols-1, rows-1) at the top right; the columns run along the base vector
+        and the rows along the side vector.
 
         The base and side vectors are free to be non-orthogonal, so any skew of the datamatrix (because of lens
         distortion, say) is already accounted for (to first order).
         """
-        n = matrix_size
-        corner = finder_pattern.corner.tuple()
+        corner = np.asarray(finder_pattern.corner.tuple())
         base_vec = np.asarray(finder_pattern.baseVector.tuple())
         side_vec = np.asarray(finder_pattern.sideVector.tuple())
+        offsets = np.asarray(offsets, dtype=float).reshape(-1, 2)
+
+        # Multiples of the half-module step along each vector, shapes (num offsets, cols) and (num offsets, rows)
+        base_steps = (2 * np.arange(cols) + 1)[np.newaxis, :] + offsets[:, 0:1]
+        side_steps = (2 * np.arange(rows) + 1)[np.newaxis, :] + offsets[:, 1:2]
+
+        base_part = base_steps[:, np.newaxis, :, np.newaxis] * base_vec
+        side_part = side_steps[:, :, np.newaxis, np.newaxis] * side_vec
+        points = corner + (base_part * (rows / cols) + side_part) / (2 * rows)
 
-        return (((x, y),
-                 list(map(int, corner + ((2*x+1+offset[0])*base_vec + (2*y+1+offset[1])*side_vec)/(2*n))))
-                for x, y in itertools.product(range(n), range(n)))
+        # Truncate towards zero, the same as int()
+        return points.astype(int)
+
+    @staticmethod
+    def _window_sums(arr, points, side=WINDOW_SIZE):
+        """ Return the sum of the brightness over a small square window surrounding each of the points
+        (an integer array whose last axis is (x, y)). The window bounds are interpreted in exactly the same
+        way as slicing the image would, so windows that overlap the image edge are truncated.
+
+        The sums are looked up in an integral image that covers only the region spanned by the windows.
+        """
+        height, width = arr.shape[:2]
+        x1, y1 = points[..., 0] - (side // 2), points[..., 1] - (side // 2)
+        x1, x2 = _slice_bounds(x1, x1 + side, width)
+        y1, y2 = _slice_bounds(y1, y1 + side, height)
+
+        # Integral image of the part of the image that is actually sampled
+        rx, ry = x1.min(), y1.min()
+        roi = np.ascontiguousarray(arr[ry:y2.max(), rx:x2.max()])
+        if roi.size == 0:
+            return np.zeros(x1.shape, dtype=np.int64)
+
+        integral = cv2.integral(roi).astype(np.int64)
+
+        x1, x2, y1, y2 = x1 - rx, x2 - rx, y1 - ry, y2 - ry
+        return integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
 
     @staticmethod
     def _smart_minimum(data):
-        """Return the index half-way between the outermost minimising indices.
+        """Return the index half-way between the outermost minimising indices (for each row of data).
 
         To illustrate:
                     ...                 ..  ..
@@ -89,58 +232,121 @@ class DatamatrixBitReader:
 
         The returned index is at the position of the pipe.
         """
-        least_y = min(data)
-        leftmost = data.index(least_y)
-        rightmost = len(data) - list(reversed(data)).index(least_y)
-        return int((leftmost + rightmost)/2), least_y
-
-    @staticmethod
-    def _window_average(arr, point, side=3):
-        """Return the average brightness over a small region surrounding a point.
-        """
-        x1, y1 = point[0] - (side // 2), point[1] - (side // 2)
-        x2, y2 = x1 + side, y1 + side
-        brightness = int(np.sum(arr[y1:y2, x1:x2]) / (side * side))
-        return brightness
+        data = np.asarray(data)
+        least_y = data.min(axis=-1)
+        leftmost = np.argmin(data, axis=-1)
+        rightmost = data.shape[-1] - np.argmin(data[..., ::-1], axis=-1)
+        return (leftmost + rightmost) // 2, least_y
 
     @staticmethod
     def _threshold(matrix, value):
         """Return a thresholded matrix, with low values corresponding to True.
         """
-        value_matrix = np.empty_like(matrix)
-        value_matrix.fill(value)
-        return matrix < value_matrix
+        return matrix < value
 
     @staticmethod
-    def _border_errors(datamatrix_candidate):
-        """Return the number of border bits not matching datamatrix specification.
+    def _border_error_curves(sample_batch):
+        """Return an array containing, for each grid of samples and for every threshold value in [0, 255],
+        the number of border bits that would not match the datamatrix specification if the samples were
+        thresholded at that value. The result has shape (num grids, 256).
+
+        The border consists of the two solid finder edges (which should be dark/True) and the two
+        alternating timing edges. Rather than thresholding the whole matrix 256 times, the error count
+        for every threshold is derived from cumulative counts of the border sample values: a sample
+        that should be dark is an error for all thresholds at or below its value and a sample that
+        should be light is an error for all thresholds above it.
         """
-        n, m = datamatrix_candidate.shape
-        # Could extend to non-square datamatrices (which do exist)...
-        assert n == m and n % 2 == 0
-        errors_in_base = datamatrix_candidate[:1, :] != np.ones((1, n))
-        errors_in_side = datamatrix_candidate[:, :1] != np.ones((n, 1))
-        errors_in_timing = (  # ("Timing pattern".)
-            [[datamatrix_candidate[i, -1:]] != [(i+1) % 2] for i in range(n)] +
-            [[datamatrix_candidate[-1:, i]] != [(i+1) % 2] for i in range(n)])
-        return sum(map(np.sum, (errors_in_base, errors_in_side, errors_in_timing)))
+        num, n, m = sample_batch.shape
+        assert n % 2 == 0 and m % 2 == 0
+
+        timing_dark = np.concatenate(((np.arange(n) + 1) % 2 == 1, (np.arange(m) + 1) % 2 == 1))
+        finder = np.concatenate((sample_batch[:, 0, :], sample_batch[:, :, 0]), axis=1)
+        timing_samples = np.concatenate((sample_batch[:, :, -1], sample_batch[:, -1, :]), axis=1)
+
+        should_be_dark = np.concatenate((finder, timing_samples[:, timing_dark]), axis=1)
+        should_be_light = timing_samples[:, ~timing_dark]
+
+        dark_errors = should_be_dark.shape[1] - _count_below_thresholds(should_be_dark)
+        light_errors = _count_below_thresholds(should_be_light)
+        return dark_errors + light_errors
 
     @staticmethod
-    def _perform_sanity_check(bit_array):
-        """ Do some simple checks on the array of datamatrix bits to make sure that it looks
-        sensible. This weeds out any patterns that are obviously not datamatricies.
+    def _sanity_check_batch(bit_arrays):
+        """ Do some simple checks on each array of datamatrix bits to make sure that it looks
+        sensible. Returns a boolean array which is False for any that are obviously not datamatricies.
         """
-        width = len(bit_array)
-        height = len(bit_array[0])
-        num_bits = width * height
-        true_bits = 0
-
-        for row in bit_array:
-            true_bits = true_bits + sum(bool(x) for x in row)
+        num_bits = bit_arrays.shape[1] * bit_arrays.shape[2]
+        true_bits = np.sum(bit_arrays.reshape(len(bit_arrays), -1), axis=1)
 
         # We assume that if almost all of the bits are True or False then its not likely to be a valid datamatrix
         too_dark = true_bits > 0.9 * num_bits
         too_light = true_bits < 0.1 * num_bits
 
-        if too_dark or too_light:
-            raise DatamatrixReaderError("Area doesn't look like a Datamatrix (too many/too few bits)")
+        return ~(too_dark | too_light)
+
+
+def _data_module_positions(size, region_size):
+    """ The positions of the data modules along one direction of a (flipped) datamatrix with the given
+    number of modules, split into data regions of the given size. The grid is sampled outwards from the
+    corner of the finder pattern, so along both the rows and the columns each data region is preceded by
+    its finder pattern and followed by its timing pattern. """
+    positions = np.arange(size).reshape(-1, region_size + 2)[:, 1:-1]
+    return positions.ravel()
+
+
+def _slice_bounds(start, stop, size):
+    """ Convert arrays of slice start/stop indices into the actual (non-negative) bounds that slicing a
+    sequence of the given size with them would produce, i.e., the same as slice(start, stop).indices(size).
+    """
+    start = np.where(start < 0, start + size, start).clip(0, size)
+    stop = np.where(stop < 0, stop + size, stop).clip(0, size)
+    return start, np.maximum(start, stop)
+
+
+def _count_below_thresholds(samples):
+    """ For each row of integer sample values in [0, 255], count the number of samples that are less than
+    each threshold value in [0, 255]. Returns an array of shape (num rows, 256). This is the same as sorting
+    each row and searching it for every threshold value, but works on all of the rows at once.
+    """
+    num_rows = samples.shape[0]
+    values = np.clip(samples, 0, 255).astype(int) + 256 * np.arange(num_rows)[:, np.newaxis]
+    histograms = np.bincount(values.ravel(), minlength=256 * num_rows).reshape(num_rows, 256)
+    return np.cumsum(histograms, axis=1) - histograms
+
+
+def _count_transitions(profiles, min_run=3):
+    """ Count the number of dark/light transitions along each brightness profile (the last axis).
+
+    The profiles are smoothed slightly and then thresholded at the midpoint of their (approximate) 10th
+    and 90th percentile values, with a small hysteresis band around the threshold. A majority filter then
+    removes any runs shorter than min_run samples, which are treated as noise (all of the modules in a
+    timing pattern are the same size).
+    """
+    smoothed = (profiles[..., :-2] + profiles[..., 1:-1] + profiles[..., 2:]) / 3
+
+    ordered = np.sort(smoothed, axis=-1)
+    size = ordered.shape[-1]
+    low, high = ordered[..., size // 10], ordered[..., size - 1 - size // 10]
+    band = (high - low)[..., np.newaxis] / 6
+    mid = ((low + high) / 2)[..., np.newaxis]
+
+    # +1 for clearly light, -1 for clearly dark, 0 within the band (which doesn't change the state)
+    state = np.where(smoothed > mid + band, 1, np.where(smoothed < mid - band, -1, 0))
+
+    # Fill in the samples within the band with the preceding state (or the first state, at the start)
+    positions = np.where(state != 0, np.arange(size), 0)
+    positions = np.maximum.accumulate(positions, axis=-1)
+    first = np.argmax(state != 0, axis=-1)[..., np.newaxis]
+    positions = np.maximum(positions, first)
+    # (the same as np.take_along_axis(), which needs numpy 1.15)
+    rows = np.arange(state.size // size).reshape(state.shape[:-1] + (1,))
+    light = state.reshape(-1, size)[rows, positions] > 0
+
+    # Majority filter, which removes runs of fewer than min_run samples
+    width = 2 * min_run - 1
+    padded = np.concatenate((light[..., :1].repeat(min_run - 1, axis=-1), light,
+                             light[..., -1:].repeat(min_run - 1, axis=-1)), axis=-1)
+    totals = np.cumsum(np.concatenate((np.zeros(light.shape[:-1] + (1,), dtype=int), padded), axis=-1), axis=-1)
+    light = (totals[..., width:] - totals[..., :-width]) >= min_run
+
+    return np.sum(light[..., 1:] != light[..., :-1], axis=-1)
@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class DatamatrixDecodeCache:
+    """ Bounded least-recently-used cache of datamatrix decode results, keyed by the thresholded bit array.
+
+    In live mode the same barcodes are read frame after frame, and a barcode that is sampled and
+    thresholded to exactly the same bits as before will always decode to exactly the same result. The
+    result (the decoded data, or the error message if it couldn't be decoded) is stored here so that
+    the byte extraction, error correction and interpretation can be skipped for a repeated bit array.
+
+    The cache is shared by all readers, so access is protected by a lock.
+    """
+    DEFAULT_MAX_SIZE = 2048
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def keys(bit_arrays):
+        """ The cache keys for a stack of datamatrix bit arrays (each key is the shape of the bit array
+        and the bits packed into bytes). """
+        bit_arrays = np.asarray(bit_arrays, dtype=bool)
+        shape = bit_arrays.shape[1:]
+        packed = np.packbits(bit_arrays.reshape(len(bit_arrays), int(np.prod(shape))), axis=1)
+        return [(shape, row.tobytes()) for row in packed]
+
+    def get(self, key):
+        """ Returns the cached (data, error message) result for the key, or None if there isn't one. """
+        with self._lock:
+            result = self._entries.pop(key, None)
+            if result is None:
+                self._misses += 1
+                return None
+
+            # Re-insert to mark as the most recently used
+            self._entries[key] = result
+            self._hits += 1
+            return result
+
+    def put(self, key, data, error_message):
+        """ Store the result of decoding the bit array with the given key. If the read was unsuccessful
+        the data should be None. """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (data, error_message)
+
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self):
+        return len(self._entries)
+
+    def max_size(self):
+        return self._max_size
+
+    def hits(self):
+        return self._hits
+
+    def misses(self):
+        return self._misses
+
+    def evictions(self):
+        return self._evictions
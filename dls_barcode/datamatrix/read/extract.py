@@ -7,47 +7,81 @@ class DatamatrixByteExtractor:
     """Class for decoding a datamatrix from an array of bits retrieving the data that is
     encoded by the barcode.
     """
+    # Cache of placement tables, keyed by the shape of the bit array
+    _placement_tables = {}
+
     @staticmethod
     def extract_bytes(bits):
         """Convert the array of bits into a set of raw bytes according to the datamatrix standard.
         The bytes require further processing before the actual message is retrieved.
         """
-        n, m = bits.shape
-        i, j = 4, 0
-        read = np.zeros((n, m), dtype=np.int8)  # "Have we read this bit yet?"
-        corner_read = 0  # "Which corner case was found?"
-        data_bytes = []
-        while True:
-            if i == n and j == 0 and corner_read != 1:
-                data_bytes.append(read_corner_case_1(bits, read, n, m))
-                i -= 2;  j += 2;  corner_read = 1
-            elif i == n - 2 and j == 0 and m & 0x03 != 0 and corner_read != 2:
-                data_bytes.append(read_corner_case_2(bits, read, n, m))
-                i -= 2;  j += 2;  corner_read = 2
-            elif i == n + 4 and j == 2 and m & 0x07 != 0 and corner_read != 3:
-                data_bytes.append(read_corner_case_3(bits, read, n, m))
-                i -= 2;  j += 2;  corner_read = 3
-            elif i == n - 2 and j == 0 and m & 0x07 != 4 and corner_read != 4:
-                data_bytes.append(read_corner_case_4(bits, read, n, m))
-                i -= 2;  j += 2;  corner_read = 4
-            else:
-                while True:
-                    if i < n and j >= 0 and not read[i, j]:
-                        data_bytes.append(read_utah(i, j, bits, read, n, m))
-                    i -= 2;  j += 2
-                    if not(i >= 0 and j < m):
-                        break
-                i += 1;  j += 3
-                while True:
-                    if i >= 0 and j < m and not read[i, j]:
-                        data_bytes.append(read_utah(i, j, bits, read, n, m))
-                    i += 2;  j -= 2
-                    if not (i < n and j >= 0):
-                        break
-                i += 3;  j += 1
-            if not(i < n or j < m):
-                break
-        return data_bytes
+        return DatamatrixByteExtractor.extract_bytes_many(np.asarray(bits)[np.newaxis])[0].tolist()
+
+    @staticmethod
+    def extract_bytes_many(bit_arrays):
+        """Extract the raw bytes from a stack of bit arrays (all the same size) at once. Returns an
+        array of shape (num arrays, num codewords) with one row of raw bytes for each bit array.
+        """
+        bit_arrays = np.asarray(bit_arrays)
+        num, n, m = bit_arrays.shape
+        table = DatamatrixByteExtractor.placement_table(n, m)
+        codeword_bits = bit_arrays.reshape(num, n * m)[:, table]
+        return np.packbits(codeword_bits, axis=2)[:, :, 0]
+
+    @staticmethod
+    def placement_table(n, m):
+        """Return the placement table for an n x m array of datamatrix bits. This is an integer array
+        of shape (num codewords, 8) where each row holds the (flattened) positions in the bit array of
+        the 8 bits of a codeword, from most to least significant.
+
+        The placement only depends on the size of the matrix, so each table is generated once (by
+        walking the ECC200 placement algorithm) and then cached.
+        """
+        tables = DatamatrixByteExtractor._placement_tables
+        if (n, m) not in tables:
+            tables[(n, m)] = _generate_placement_table(n, m)
+        return tables[(n, m)]
+
+
+def _generate_placement_table(n, m):
+    """Walk the ECC200 placement algorithm for an n x m array of bits, recording the position of
+    each bit of each codeword.
+    """
+    i, j = 4, 0
+    read = np.zeros((n, m), dtype=np.int8)  # "Have we read this bit yet?"
+    corner_read = 0  # "Which corner case was found?"
+    codewords = []
+    while True:
+        if i == n and j == 0 and corner_read != 1:
+            codewords.append(place_corner_case_1(read, n, m))
+            i -= 2;  j += 2;  corner_read = 1
+        elif i == n - 2 and j == 0 and m & 0x03 != 0 and corner_read != 2:
+            codewords.append(place_corner_case_2(read, n, m))
+            i -= 2;  j += 2;  corner_read = 2
+        elif i == n + 4 and j == 2 and m & 0x07 == 0 and corner_read != 3:
+            codewords.append(place_corner_case_3(read, n, m))
+            i -= 2;  j += 2;  corner_read = 3
+        elif i == n - 2 and j == 0 and m & 0x07 == 4 and corner_read != 4:
+            codewords.append(place_corner_case_4(read, n, m))
+            i -= 2;  j += 2;  corner_read = 4
+        else:
+            while True:
+                if i < n and j >= 0 and not read[i, j]:
+                    codewords.append(place_utah(i, j, read, n, m))
+                i -= 2;  j += 2
+                if not(i >= 0 and j < m):
+                    break
+            i += 1;  j += 3
+            while True:
+                if i >= 0 and j < m and not read[i, j]:
+                    codewords.append(place_utah(i, j, read, n, m))
+                i += 2;  j -= 2
+                if not (i < n and j >= 0):
+                    break
+            i += 3;  j += 1
+        if not(i < n or j < m):
+            break
+    return np.array(codewords, dtype=np.intp).reshape(-1, 8)
 
 
 utah = lambda _, __: [  # (i, j), msb to lsb
@@ -106,23 +140,18 @@ corner_case_4 = lambda n, m: [
 ]
 
 
-def read_shape(shape, i, j, bits, read, n, m):
-    return sum(1 << s
-               for s, b
-               # `reversed` flips endianness.
-               in enumerate(reversed(list(
-                   read_bit(i+r, j+c, bits, read, n, m)
-                   for r, c in shape(n, m))))
-               if b)
+def place_shape(shape, i, j, read, n, m):
+    """Return the (flattened) positions of the bits of a codeword with the given shape, msb first. """
+    return [place_bit(i+r, j+c, read, n, m) for r, c in shape(n, m)]
 
-read_utah = partial(read_shape, utah)
-read_corner_case_1 = partial(read_shape, corner_case_1, 0, 0)
-read_corner_case_2 = partial(read_shape, corner_case_2, 0, 0)
-read_corner_case_3 = partial(read_shape, corner_case_3, 0, 0)
-read_corner_case_4 = partial(read_shape, corner_case_4, 0, 0)
+place_utah = partial(place_shape, utah)
+place_corner_case_1 = partial(place_shape, corner_case_1, 0, 0)
+place_corner_case_2 = partial(place_shape, corner_case_2, 0, 0)
+place_corner_case_3 = partial(place_shape, corner_case_3, 0, 0)
+place_corner_case_4 = partial(place_shape, corner_case_4, 0, 0)
 
 
-def read_bit(i, j, bits, read, n, m):
+def place_bit(i, j, read, n, m):
     if i < 0:
         i += n
         j += 4 - ((n + 4) & 0x07)
@@ -130,4 +159,4 @@ def read_bit(i, j, bits, read, n, m):
         i += 4 - ((m + 4) & 0x07)
         j += m
     read[i, j] = 1
-    return bits[i, j]
\ No newline at end of file
+    return i * m + j
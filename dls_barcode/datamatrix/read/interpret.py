@@ -1,103 +1,194 @@
+_DIGITS = "0123456789"
+_UPPER = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_LOWER = "abcdefghijklmnopqrstuvwxyz"
+
+# The FNC1 character is transmitted as the ASCII group separator (GS)
+_FNC1 = "\x1d"
+
+# Markers in the C40/Text character set tables for values that aren't characters
+_SHIFT_1, _SHIFT_2, _SHIFT_3, _UPPER_SHIFT = "Shift 1", "Shift 2", "Shift 3", "Upper Shift"
+_SHIFTS = [_SHIFT_1, _SHIFT_2, _SHIFT_3]
+
+
 class DatamatrixByteInterpreter:
+    """ Interprets the data codewords of an ECC200 datamatrix (after error correction), according to the
+    encodation schemes of ISO/IEC 16022. All of the schemes are supported: ASCII (including digit pairs and
+    the upper shift), C40, Text, ANSI X12, EDIFACT and Base 256, along with the FNC1, Structured Append,
+    Reader Programming, Macro and ECI codewords.
+
+    Bytes (e.g. from Base 256 or the upper shift) are returned as the characters with the same values
+    (i.e., ISO 8859-1, the default interpretation). ECI designators and the Structured Append and Reader
+    Programming codewords don't form part of the message and are skipped.
+    """
+    # ASCII encodation codewords
+    PAD = 129
+    LATCH_C40 = 230
+    LATCH_BASE_256 = 231
+    FNC1 = 232
+    STRUCTURED_APPEND = 233
+    READER_PROGRAMMING = 234
+    UPPER_SHIFT = 235
+    MACRO_05 = 236
+    MACRO_06 = 237
+    LATCH_X12 = 238
+    LATCH_TEXT = 239
+    LATCH_EDIFACT = 240
+    ECI = 241
+
+    # Codeword that returns to ASCII encodation from C40, Text and X12, and EDIFACT value that does the same
+    UNLATCH = 254
+    EDIFACT_UNLATCH = 31
+
+    # Header and trailer for the message of a symbol that starts with one of the macro codewords
+    MACRO_HEADERS = {MACRO_05: "[)>\x1e05\x1d", MACRO_06: "[)>\x1e06\x1d"}
+    MACRO_TRAILER = "\x1e\x04"
+
+    # Character sets for C40 and Text encodation, indexed by value
+    C40_BASIC_SET = _SHIFTS + [" "] + list(_DIGITS) + list(_UPPER)
+    TEXT_BASIC_SET = _SHIFTS + [" "] + list(_DIGITS) + list(_LOWER)
+    SHIFT_1_SET = [chr(i) for i in range(32)]
+    SHIFT_2_SET = list("!\"#$%&'()*+,-./:;<=>?@[\\]^_") + [_FNC1, None, None, _UPPER_SHIFT]
+    C40_SHIFT_3_SET = [chr(i) for i in range(96, 128)]
+    TEXT_SHIFT_3_SET = ["`"] + list(_UPPER) + list("{|}~") + [chr(127)]
+
+    C40_SETS = [C40_BASIC_SET, SHIFT_1_SET, SHIFT_2_SET, C40_SHIFT_3_SET]
+    TEXT_SETS = [TEXT_BASIC_SET, SHIFT_1_SET, SHIFT_2_SET, TEXT_SHIFT_3_SET]
+
+    # Character set for ANSI X12 encodation
+    X12_SET = ["\r", "*", ">", " "] + list(_DIGITS) + list(_UPPER)
+
     @staticmethod
     def interpret_bytes(data_bytes):
-        """ Converts the raw set of bytes from the datamatrix into an ASCII .
+        """ Converts the data codewords from the datamatrix into the encoded message.
         """
         DBI = DatamatrixByteInterpreter
+        data_bytes = list(data_bytes)
+
+        # Decoders for the latched encodation schemes; each one decodes codewords from the start position
+        # until it returns to ASCII encodation, and returns the characters and the next position
+        latches = {
+            DBI.LATCH_C40: lambda start: DBI._interpret_text_mode_bytes(data_bytes, start, DBI.C40_SETS),
+            DBI.LATCH_TEXT: lambda start: DBI._interpret_text_mode_bytes(data_bytes, start, DBI.TEXT_SETS),
+            DBI.LATCH_X12: lambda start: DBI._interpret_x12_bytes(data_bytes, start),
+            DBI.LATCH_EDIFACT: lambda start: DBI._interpret_edifact_bytes(data_bytes, start),
+            DBI.LATCH_BASE_256: lambda start: DBI._interpret_base_256_bytes(data_bytes, start),
+        }
+
         message = []
+        trailer = ""
+        upper_shift = False
 
         i = 0
-        eom_reached = False
-
-        while not eom_reached and not i >= len(data_bytes):
+        while i < len(data_bytes):
             byte = data_bytes[i]
+            i += 1
 
-            if 1 <= byte < 129:  # ASCII.
-                character = chr(byte - 1)
-                message.append(character)
-                i += 1
+            if 1 <= byte <= 128:  # ASCII.
+                message.append(chr(byte - 1 + (128 if upper_shift else 0)))
+                upper_shift = False
 
-            elif byte == 129:  # EOM byte.
-                eom_reached = True
+            elif byte == DBI.PAD:  # End of message, the rest of the codewords are padding.
+                break
 
-            elif 130 <= byte < 230:  # Digit pairs 00-99.
-                value = byte - 130
-                digit_pair = str(value).zfill(2)
-                message.append(digit_pair)
-                i += 1
+            elif 130 <= byte <= 229:  # Digit pairs 00-99.
+                message.append(str(byte - 130).zfill(2))
 
-            elif byte == 230:  # Switch to C40 encoding scheme
-                chars, num_bytes = DBI._interpret_text_mode_bytes(data_bytes[i:])
+            elif byte in latches:
+                chars, i = latches[byte](i)
                 message.extend(chars)
-                i += num_bytes
 
-            elif byte == 231:
-                raise NotImplementedError("Datamatrix Base 256 decoding not implemented")
+            elif byte == DBI.FNC1:
+                message.append(_FNC1)
 
-            elif 232 <= byte <= 237:  # Other parts of the Data Matrix spec., not supported.
-                raise NotImplementedError("Datamatrix encoded symbol {} not implemented".format(byte))
+            elif byte == DBI.STRUCTURED_APPEND:  # Followed by the symbol sequence and file identification.
+                i += 3
 
-            elif byte == 238:
-                raise NotImplementedError("Datamatrix ANSI X12 decoding not implemented")
+            elif byte == DBI.READER_PROGRAMMING:
+                pass
 
-            elif byte == 239:
-                chars, num_bytes = DBI._interpret_text_mode_bytes(data_bytes[i:])
-                message.extend(chars)
-                i += num_bytes
+            elif byte == DBI.UPPER_SHIFT:
+                upper_shift = True
 
-            elif byte == 240:
-                raise NotImplementedError("Datamatrix EDIFACT decoding not implemented")
+            elif byte in DBI.MACRO_HEADERS:
+                message.append(DBI.MACRO_HEADERS[byte])
+                trailer = DBI.MACRO_TRAILER
 
-            elif byte == 241:
-                raise NotImplementedError("Datamatrix Extended Channel Interpretation code not implemented")
+            elif byte == DBI.ECI:  # Followed by 1-3 codewords designating the ECI.
+                i += DBI._eci_length(data_bytes, i)
 
-            elif 242 <= byte < 256 or byte == 0:  # Unused parts of message space.
+            else:  # 0 and 242-255 are not used in ASCII encodation.
                 raise ValueError("Code {} is not used in Datamatrix specification".format(byte))
 
-        return ''.join(m for m in message)
+        return ''.join(message) + trailer
 
     @staticmethod
-    def _interpret_text_mode_bytes(data_bytes):
-        """ For efficiency, Datamatrix encoding sometimes switches to the C40 encoding scheme
+    def _interpret_text_mode_bytes(data_bytes, start, char_sets):
+        """ For efficiency, Datamatrix encoding sometimes switches to the C40 (or Text) encoding scheme
         which can encode 3 characters in 2 bytes, as long as the characters are digits or capital
-        letters. This function decodes those bytes.
-        """
-        encoded_bytes = []
-        mode = None
-        for b in data_bytes:
-            if b == 230:  # start of C40 encoding
-                mode = "C40"
-                continue
-
-            elif b == 239:  # start of Text encoding
-                mode = "Text"
-                continue
-
-            elif b == 254:  # end of c40 encoding
-                break
-
-            else:
-                encoded_bytes.append(b)
+        (or lower case) letters. Other characters are encoded with two values, the first of which shifts
+        to one of the other character sets. This function decodes those bytes, starting at the specified
+        position, until the unlatch codeword (or the end of the data) is reached.
 
-        num_encoded_bytes = len(encoded_bytes)
+        Returns the decoded characters and the position of the first codeword after this encodation.
+        """
+        DBI = DatamatrixByteInterpreter
+        chars = []
+        char_set = 0
+        upper_shift = False
+
+        i = start
+        for values, i in DBI._triples(data_bytes, start):
+            for value in values:
+                try:
+                    char = char_sets[char_set][value]
+                except IndexError:
+                    char = None
+
+                if char is None:
+                    raise ValueError("Value {} is not a valid C40 or Text symbol".format(value))
+
+                # A shift only applies to the following value
+                char_set = 0
+                if char in _SHIFTS:
+                    char_set = _SHIFTS.index(char) + 1
+                elif char == _UPPER_SHIFT:
+                    upper_shift = True
+                else:
+                    chars.append(chr(ord(char) + 128) if upper_shift else char)
+                    upper_shift = False
+
+        return chars, i
 
-        if num_encoded_bytes == 0:
-            return ValueError("No data bytes encoded in Datamatrix Text Mode encoding")
-        elif num_encoded_bytes % 2 != 0:
-            raise ValueError("Odd number of Text mode encoded bytes")
+    @staticmethod
+    def _interpret_x12_bytes(data_bytes, start):
+        """ Decode ANSI X12 encoded bytes, which work in the same way as C40 except that there is only a
+        single character set (with 40 characters). """
+        DBI = DatamatrixByteInterpreter
+        chars = []
 
-        byte_pairs = [encoded_bytes[i:i + 2] for i in range(0, len(encoded_bytes), 2)]
+        i = start
+        for values, i in DBI._triples(data_bytes, start):
+            for value in values:
+                if value >= len(DBI.X12_SET):
+                    raise ValueError("Value {} is not a valid X12 symbol".format(value))
+                chars.append(DBI.X12_SET[value])
 
-        decoded_bytes = []
-        DBI = DatamatrixByteInterpreter
-        for pair in byte_pairs:
-            decoded = DBI._decode_txt_mode_byte_pair(pair)
-            decoded_bytes.extend(decoded)
+        return chars, i
 
-        ascii_chars = [DBI._interpret_decoded_text_byte(byte, mode) for byte in decoded_bytes]
+    @staticmethod
+    def _triples(data_bytes, start):
+        """ Generator over the triples of values encoded in the pairs of C40, Text or X12 codewords from the
+        start position. Yields each triple along with the position of the codeword after the pair. Stops
+        at the unlatch codeword, or when fewer than 2 codewords remain (in which case the remaining codeword,
+        if any, is in ASCII encodation).
+        """
+        i = start
+        while i + 1 < len(data_bytes) and data_bytes[i] != DatamatrixByteInterpreter.UNLATCH:
+            yield DatamatrixByteInterpreter._decode_txt_mode_byte_pair(data_bytes[i:i + 2]), i + 2
+            i += 2
 
-        num_bytes = num_encoded_bytes + 2
-        return ascii_chars, num_bytes
+        if i < len(data_bytes) and data_bytes[i] == DatamatrixByteInterpreter.UNLATCH:
+            yield [], i + 1
 
     @staticmethod
     def _decode_txt_mode_byte_pair(byte_pair):
@@ -105,43 +196,84 @@ class DatamatrixByteInterpreter:
         i1 = byte_pair[0]
         i2 = byte_pair[1]
 
-        val16 = (i1 * 256) + i2
-        c1 = (val16 - 1) // 1600
-        c2 = (val16 - (c1 * 1600)) // 40
-        c3 = val16 - (c1 * 1600) - (c2 * 40) - 1
+        val16 = (i1 * 256) + i2 - 1
+        if val16 < 0:
+            raise ValueError("Codeword pair {}, {} is not a valid C40, Text or X12 pair".format(i1, i2))
+
+        c1 = val16 // 1600
+        c2 = (val16 % 1600) // 40
+        c3 = val16 % 40
 
         return [c1, c2, c3]
 
     @staticmethod
-    def _interpret_decoded_text_byte(byte, mode):
-        """ Interpret the byte by lookup in the C40 or Text tables.
+    def _interpret_edifact_bytes(data_bytes, start):
+        """ Decode EDIFACT encoded bytes, in which each group of 3 codewords holds 4 6-bit values. Values
+        0-31 are the ASCII characters 64-95 and 32-63 are the ASCII characters 32-63. Encodation returns
+        to ASCII at the unlatch value (the rest of that codeword is padding), or when fewer than 3
+        codewords remain.
+        """
+        DBI = DatamatrixByteInterpreter
+        chars = []
 
-        C40 includes 4 encoding sets which each map the values 0-39 to a table of symbols. The first
-        table is the default and includes the digits, capital letters, and the space character. The
-        other tables contain the rest of the ascii characters including control characters. If the
-        codes 0, 1, or 2 are used, it means that the next character should be read from table 1, 2,
-        and 3 respectively.
+        i = start
+        while i + 2 < len(data_bytes):
+            group = (data_bytes[i] << 16) | (data_bytes[i + 1] << 8) | data_bytes[i + 2]
+            for k in range(4):
+                value = (group >> (18 - 6 * k)) & 0x3f
+                if value == DBI.EDIFACT_UNLATCH:
+                    # Continue from the codeword after the one that holds the end of this value
+                    return chars, i + (6 * (k + 1) + 7) // 8
 
-        Text mode is exactly the same as C40 except that the upper and lower case characters are swapped
+                chars.append(chr(value + 64 if value < 32 else value))
+
+            i += 3
+
+        return chars, i
+
+    @staticmethod
+    def _interpret_base_256_bytes(data_bytes, start):
+        """ Decode Base 256 encoded bytes. These start with a length field (1 or 2 codewords, where a length
+        of 0 means that the bytes extend to the end of the data), and each codeword (including the length)
+        is randomised with the 255-state algorithm.
         """
-        if mode not in ["C40", "Text"]:
-            raise ValueError("Unrecognised Text encoding mode")
+        DBI = DatamatrixByteInterpreter
 
-        if 0 <= byte <= 2:  # Used to switch to other encoding tables - not implemented here
-            # Todo: implement the other tables
-            raise NotImplementedError("{} Set 1, 2, and 3 encoding not implemented".format(mode))
+        def unrandomize(position):
+            if position >= len(data_bytes):
+                raise ValueError("Datamatrix Base 256 encodation runs past the end of the data")
+            return DBI._unrandomize_255_state(data_bytes[position], position + 1)
 
-        elif byte == 3:  # C40 3 is space
-            return " "
+        i = start
+        length = unrandomize(i)
+        i += 1
+        if length == 0:
+            length = len(data_bytes) - i
+        elif length >= 250:
+            length = 250 * (length - 249) + unrandomize(i)
+            i += 1
 
-        elif 4 <= byte <= 13:  # C40 number range, add 40 to get ascii value
-            return chr(byte + 44)
+        chars = [chr(unrandomize(j)) for j in range(i, i + length)]
+        return chars, i + length
 
-        elif byte <= 39:  # C40 range A-Z, add 51 to get ascii value
-            if mode == "C40":
-                return chr(byte + 51)
-            elif mode == "Text":
-                return chr(byte + 83)
+    @staticmethod
+    def _unrandomize_255_state(codeword, position):
+        """ Reverse the 255-state randomising algorithm, for a codeword at the specified (1-based) position
+        in the data. """
+        pseudo_random = ((149 * position) % 255) + 1
+        value = codeword - pseudo_random
+        return value if value >= 0 else value + 256
 
+    @staticmethod
+    def _eci_length(data_bytes, start):
+        """ The number of codewords used to designate the ECI value following an ECI codeword. """
+        if start >= len(data_bytes):
+            raise ValueError("Datamatrix ECI codeword at the end of the data")
+
+        first = data_bytes[start]
+        if first <= 127:
+            return 1
+        elif first <= 191:
+            return 2
         else:
-            raise ValueError("Value {} is not a valid C40 or Text symbol".format(byte))
+            return 3
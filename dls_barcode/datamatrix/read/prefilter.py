@@ -0,0 +1,98 @@
+from __future__ import division
+
+import threading
+
+import numpy as np
+
+
+class DatamatrixPreFilter:
+    """ Cheap checks performed on the raw brightness samples of a candidate datamatrix, used to reject
+    candidates that are obviously not datamatrices (e.g. the false finder patterns produced by a deep
+    contour scan) before the thresholding and error correction stages.
+
+    Each sample grid is split into dark and light modules at its mean brightness, and then must pass
+    each of the following stages in turn:
+     - timing: the two timing edges should alternate between dark and light modules;
+     - finder: the two finder edges should be (almost) solid dark;
+     - dark ratio: the fraction of dark modules should be neither very high nor very low.
+
+    The limits are deliberately loose so that a readable datamatrix is never rejected. The number of
+    grids checked and rejected by each stage are recorded.
+    """
+    ENABLED = True
+
+    # Minimum fraction of the timing edge modules that must match the alternating pattern
+    MIN_TIMING_MATCH = 0.65
+
+    # Minimum fraction of the finder edge modules that must be dark
+    MIN_FINDER_DARK = 0.75
+
+    # Allowed range for the fraction of dark modules in the whole grid
+    MIN_DARK_RATIO = 0.15
+    MAX_DARK_RATIO = 0.85
+
+    TIMING = "timing"
+    FINDER = "finder"
+    DARK_RATIO = "dark ratio"
+    STAGES = [TIMING, FINDER, DARK_RATIO]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._num_checked = 0
+        self._num_rejected = dict((stage, 0) for stage in self.STAGES)
+
+    def check(self, sample_batch):
+        """ Check a stack of sample grids (shape (num grids, rows, columns), as returned by
+        DatamatrixBitReader.sample_grids()). Returns a boolean array which is True for each grid that
+        passed every stage, and a list with the name of the stage that rejected each grid (or None).
+        """
+        sample_batch = np.asarray(sample_batch)
+        num, n, m = sample_batch.shape
+
+        mean = sample_batch.reshape(num, -1).mean(axis=1)
+        dark = sample_batch < mean[:, np.newaxis, np.newaxis]
+
+        # The finder edges are the first row and column, and the timing edges are the last row and column
+        expected = np.concatenate(((np.arange(n) + 1) % 2 == 1, (np.arange(m) + 1) % 2 == 1))
+        timing = np.concatenate((dark[:, :, -1], dark[:, -1, :]), axis=1)
+        timing_match = np.mean(timing == expected, axis=1)
+
+        finder = np.concatenate((dark[:, 0, :], dark[:, :, 0]), axis=1)
+        finder_dark = np.mean(finder, axis=1)
+
+        dark_ratio = np.mean(dark.reshape(num, -1), axis=1)
+
+        # Each rejected grid is attributed to the first stage that it failed (the last index means passed)
+        failures = np.array([
+            timing_match < self.MIN_TIMING_MATCH,
+            finder_dark < self.MIN_FINDER_DARK,
+            (dark_ratio < self.MIN_DARK_RATIO) | (dark_ratio > self.MAX_DARK_RATIO),
+            np.ones(num, dtype=bool)
+        ])
+        first_failure = np.argmax(failures, axis=0)
+        counts = np.bincount(first_failure, minlength=len(self.STAGES) + 1)
+
+        with self._lock:
+            self._num_checked += num
+            for stage, count in zip(self.STAGES, counts):
+                self._num_rejected[stage] += int(count)
+
+        passed = first_failure == len(self.STAGES)
+        rejected_by = [self.STAGES[i] if i < len(self.STAGES) else None for i in first_failure]
+        return passed, rejected_by
+
+    def num_checked(self):
+        """ The total number of sample grids that have been checked. """
+        return self._num_checked
+
+    def num_rejected(self, stage=None):
+        """ The number of sample grids rejected by the specified stage (or by all stages). """
+        if stage is None:
+            return sum(self._num_rejected.values())
+        return self._num_rejected[stage]
+
+    def reset_counts(self):
+        with self._lock:
+            self._num_checked = 0
+            for stage in self.STAGES:
+                self._num_rejected[stage] = 0
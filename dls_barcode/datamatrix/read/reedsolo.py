@@ -31,16 +31,66 @@ The following is the header from the original author:
 --------------------------------------------------------------------------------------------------------
 """
 
+import numpy as np
+
+from .size_table import DatamatrixSizeTable
+
 
 class ReedSolomonError(Exception):
     pass
 
 
 class ReedSolomonDecoder:
-    def __init__(self):
-        self.gf = GaloisField(GaloisField.DATAMATRIX)
+    # Shared decoders for each size of datamatrix, see for_matrix_size()
+    _size_decoders = {}
+
+    def __init__(self, num_error_bytes=None, num_blocks=1):
+        """ Create a decoder for the datamatrix Galois field. The field tables are shared by all decoders.
+        If the number of error correction bytes is given, the generator polynomial and the syndrome
+        calculation for that number are prepared up front and become the defaults for decode() and encode().
+
+        The larger datamatrices split their codewords into several blocks, each with its own error
+        correction bytes, which are interleaved: codeword i (of the data and of the error correction
+        bytes) belongs to block i % num_blocks. The number of error bytes is the total for all blocks.
+        """
+        self.gf = GaloisField.shared(GaloisField.DATAMATRIX)
+        self._num_error_bytes = num_error_bytes
+        self._num_blocks = num_blocks
+
+        if num_error_bytes is not None:
+            self.gf.generator_poly(num_error_bytes // num_blocks)
+
+    @staticmethod
+    def for_matrix_size(matrix_size):
+        """ The shared decoder for a datamatrix of the given size. Decoders hold no state between
+        messages, so the same decoder can be used for every read of that size of datamatrix.
+        """
+        matrix_size = DatamatrixSizeTable.canonical_size(matrix_size)
+        decoders = ReedSolomonDecoder._size_decoders
+        if matrix_size not in decoders:
+            num_blocks = DatamatrixSizeTable.num_blocks(matrix_size)
+            decoder = ReedSolomonDecoder(DatamatrixSizeTable.num_error_bytes(matrix_size), num_blocks)
+
+            num_bytes = DatamatrixSizeTable.num_bytes(matrix_size)
+            for block_length in set(len(range(b, num_bytes, num_blocks)) for b in range(num_blocks)):
+                decoder.gf.syndromes([0] * block_length, decoder._num_error_bytes // num_blocks)
+            decoders[matrix_size] = decoder
+
+        return decoders[matrix_size]
+
+    def decode(self, encoded_msg, num_data_bytes=None):
+        if self._num_blocks > 1:
+            decoded = self.decode_many([encoded_msg], num_data_bytes)[0]
+            if isinstance(decoded, ReedSolomonError):
+                raise decoded
+            return decoded
+
+        return self._decode_block(encoded_msg, num_data_bytes)
+
+    def _decode_block(self, encoded_msg, num_data_bytes=None):
+        if num_data_bytes is None:
+            num_data_bytes = len(encoded_msg) - self._num_error_bytes
 
-    def decode(self, encoded_msg, num_data_bytes):
         num_error_bytes = len(encoded_msg) - num_data_bytes
 
         try:
@@ -50,6 +100,63 @@ class ReedSolomonDecoder:
 
         return decoded
 
+    def decode_many(self, encoded_msgs, num_data_bytes=None):
+        """ Decode a batch of messages (a 2D array with one encoded message per row). The syndromes of
+        the whole batch are calculated at once and any messages which contain no errors are returned
+        directly, so only the damaged messages go through the (much slower) error correction.
+
+        Returns a list with an entry for each message which is either the list of decoded data bytes
+        or, if the message could not be corrected, the ReedSolomonError describing why.
+        """
+        encoded_msgs = np.asarray(encoded_msgs)
+        msg_length = encoded_msgs.shape[1]
+        if num_data_bytes is None:
+            num_data_bytes = msg_length - self._num_error_bytes
+
+        if self._num_blocks > 1:
+            return self._decode_interleaved_many(encoded_msgs, num_data_bytes)
+
+        num_error_bytes = msg_length - num_data_bytes
+        if msg_length > 255:
+            clean = np.zeros(len(encoded_msgs), dtype=bool)  # Let decode() reject them
+        else:
+            clean = ~self.gf.syndromes(encoded_msgs, num_error_bytes).any(axis=1)
+
+        results = []
+        for msg, is_clean in zip(encoded_msgs.tolist(), clean):
+            if is_clean:
+                results.append(msg[:num_data_bytes])
+                continue
+
+            try:
+                results.append(self._decode_block(msg, num_data_bytes))
+            except ReedSolomonError as ex:
+                results.append(ex)
+
+        return results
+
+    def _decode_interleaved_many(self, encoded_msgs, num_data_bytes):
+        """ Decode a batch of messages that are made up of interleaved blocks (see decode_many()). Each
+        block of every message is decoded separately, and the data bytes are then re-interleaved. """
+        num_blocks = self._num_blocks
+        msg_length = encoded_msgs.shape[1]
+        block_decoder = ReedSolomonDecoder((msg_length - num_data_bytes) // num_blocks)
+
+        results = np.zeros((len(encoded_msgs), num_data_bytes), dtype=int)
+        errors = [None] * len(encoded_msgs)
+        for block in range(num_blocks):
+            data_positions = np.arange(block, num_data_bytes, num_blocks)
+            error_positions = np.arange(num_data_bytes + block, msg_length, num_blocks)
+            block_msgs = encoded_msgs[:, np.concatenate((data_positions, error_positions))]
+
+            for i, decoded in enumerate(block_decoder.decode_many(block_msgs, len(data_positions))):
+                if isinstance(decoded, ReedSolomonError):
+                    errors[i] = errors[i] or decoded
+                else:
+                    results[i, data_positions] = decoded
+
+        return [error or data for error, data in zip(errors, results.tolist())]
+
     def _correct_msg(self, msg_in, num_symbols):
         if len(msg_in) > 255:
             raise ReedSolomonError("Message too long")
@@ -57,19 +164,19 @@ class ReedSolomonDecoder:
         msg_out = list(msg_in)  # copy of message
 
         # find erasures
-        erase_pos = []
-        for i in range(0, len(msg_out)):
-            if msg_out[i] < 0:
-                msg_out[i] = 0
-                erase_pos.append(i)
-
+        erase_pos = [i for i, c in enumerate(msg_out) if c < 0]
         if len(erase_pos) > num_symbols:
             raise ReedSolomonError("Too many erasures to correct")
 
-        syndromes = self._calculate_syndromes(msg_out, num_symbols)
-        if max(syndromes) == 0:
+        for i in erase_pos:
+            msg_out[i] = 0
+
+        # Fast path - most messages are read cleanly
+        syndromes = self.gf.syndromes(msg_out, num_symbols)
+        if not syndromes.any():
             return msg_out[:-num_symbols]  # no errors
 
+        syndromes = syndromes.tolist()
         forney_syndromes = self._forney_syndromes(syndromes, erase_pos, len(msg_out))
         err_pos = self._find_errors(forney_syndromes, len(msg_out))
         if err_pos is None:
@@ -84,7 +191,7 @@ class ReedSolomonDecoder:
         return msg_out[:-num_symbols]
 
     def _calculate_syndromes(self, msg, num_symbols):
-        return [self.gf.poly_eval(msg, self.gf.exp(i + self.gf.base())) for i in range(num_symbols)]
+        return self.gf.syndromes(msg, num_symbols).tolist()
 
     def _forney_syndromes(self, syndromes, erase_positions, nmess):
         fsynd = list(syndromes)  # make a copy
@@ -148,11 +255,31 @@ class ReedSolomonDecoder:
                 adj = self.gf.mul(adj, x)
             msg[pos[i]] ^= adj
 
-    def encode(self, msg_in, num_ecc_symbols):
+    def encode(self, msg_in, num_ecc_symbols=None):
+        if num_ecc_symbols is None:
+            num_ecc_symbols = self._num_error_bytes
+
+        if self._num_blocks > 1:
+            return self._encode_interleaved(msg_in, num_ecc_symbols)
+
+        return self._encode_block(msg_in, num_ecc_symbols)
+
+    def _encode_interleaved(self, msg_in, num_ecc_symbols):
+        num_blocks = self._num_blocks
+        block_decoder = ReedSolomonDecoder()
+
+        msg_out = bytearray(len(msg_in) + num_ecc_symbols)
+        msg_out[:len(msg_in)] = msg_in
+        for block in range(num_blocks):
+            block_msg = block_decoder.encode(msg_out[block:len(msg_in):num_blocks], num_ecc_symbols // num_blocks)
+            msg_out[len(msg_in) + block::num_blocks] = block_msg[-(num_ecc_symbols // num_blocks):]
+        return msg_out
+
+    def _encode_block(self, msg_in, num_ecc_symbols):
         if len(msg_in) + num_ecc_symbols > 255:
             raise ReedSolomonError("Message too long")
 
-        gen = self._generator_poly(num_ecc_symbols)
+        gen = self.gf.generator_poly(num_ecc_symbols)
         msg_out = bytearray(len(msg_in) + num_ecc_symbols)
         msg_out[:len(msg_in)] = msg_in
         for i in range(0, len(msg_in)):
@@ -163,12 +290,6 @@ class ReedSolomonDecoder:
         msg_out[:len(msg_in)] = msg_in
         return msg_out
 
-    def _generator_poly(self, num_symbols):
-        g = [1]
-        for i in range(0, num_symbols):
-            g = self.gf.poly_mul(g, [1, self.gf.exp(i + self.gf.base())])
-        return g
-
 
 class GaloisField:
     DATAMATRIX = "datamatrix"
@@ -180,6 +301,9 @@ class GaloisField:
     QR_CODE_PRIMITIVE = 0x11d
     QR_CODE_GEN_BASE = 0
 
+    # Fields shared by every decoder, see shared()
+    _shared_fields = {}
+
     def __init__(self, field_type):
         if field_type == self.DATAMATRIX:
             self._primitive = self.DATAMATRIX_PRIMITIVE
@@ -194,6 +318,30 @@ class GaloisField:
         self._exp = [1] * 512
         self._log = [0] * 256
         self._generate_tables()
+        self._exp = tuple(self._exp)
+        self._log = tuple(self._log)
+
+        # Full multiplication table; the rows are also kept as bytearrays for fast scalar lookups (unlike
+        # bytes, a bytearray indexes to an int on Python 2 as well as 3)
+        self._mul_table = self._generate_mul_table(self._exp, self._log)
+        self._mul_table.flags.writeable = False
+        self._mul_flat = self._mul_table.ravel()
+        self._mul = tuple(bytearray(row.tobytes()) for row in self._mul_table)
+
+        # Caches of values derived from the tables, filled on first use
+        self._syndrome_matrices = {}
+        self._generator_polys = {}
+
+    @staticmethod
+    def shared(field_type):
+        """ The process-wide instance of the specified field. The tables of a field never change once they
+        have been generated (nothing writes to the tuples, bytearrays and read-only arrays that they are
+        stored in), so a single instance of each field is safely shared by every decoder.
+        """
+        fields = GaloisField._shared_fields
+        if field_type not in fields:
+            fields[field_type] = GaloisField(field_type)
+        return fields[field_type]
 
     def _generate_tables(self):
         x = 1
@@ -208,6 +356,15 @@ class GaloisField:
         for i in range(255, 512):
             self._exp[i] = self._exp[i - 255]
 
+    @staticmethod
+    def _generate_mul_table(exp, log):
+        exp = np.asarray(exp, dtype=np.uint8)
+        log = np.asarray(log)
+        table = exp[log[:, np.newaxis] + log[np.newaxis, :]]
+        table[0, :] = 0
+        table[:, 0] = 0
+        return table
+
     def base(self):
         return self._generator_base
 
@@ -215,9 +372,7 @@ class GaloisField:
         return self._exp[i]
 
     def mul(self, x, y):
-        if x == 0 or y == 0:
-            return 0
-        return self._exp[self._log[x] + self._log[y]]
+        return self._mul[x][y]
 
     def div(self, x, y):
         if y == 0:
@@ -227,7 +382,8 @@ class GaloisField:
         return self._exp[self._log[x] + 255 - self._log[y]]
 
     def poly_scale(self, p, x):
-        return [self.mul(p[i], x) for i in range(0, len(p))]
+        mul_x = self._mul[x]
+        return [mul_x[c] for c in p]
 
     def poly_add(self, p, q):
         r = [0] * max(len(p), len(q))
@@ -240,12 +396,59 @@ class GaloisField:
     def poly_mul(self, p, q):
         r = [0] * (len(p) + len(q) - 1)
         for j in range(0, len(q)):
+            mul_q = self._mul[q[j]]
             for i in range(0, len(p)):
-                r[i + j] ^= self.mul(p[i], q[j])
+                r[i + j] ^= mul_q[p[i]]
         return r
 
     def poly_eval(self, p, x):
+        mul_x = self._mul[x]
         y = p[0]
         for i in range(1, len(p)):
-            y = self.mul(y, x) ^ p[i]
+            y = mul_x[y] ^ p[i]
         return y
+
+    def syndromes(self, msg, num_symbols):
+        """ Evaluate the message polynomial at each of the roots of the generator polynomial,
+        i.e., x = a^(i + base) for i in [0, num_symbols). All of the evaluations are done at once as
+        a matrix product in GF(256): S_i = sum_j msg[j] * a^((i + base) * (len(msg) - 1 - j)).
+        Returns a numpy array of the syndromes.
+
+        A 2D array of messages (one per row, all the same length) may also be supplied, in which case
+        the syndromes of all of them are calculated at once and returned as one row per message.
+        """
+        msg = np.asarray(msg, dtype=np.uint8)
+        matrix = self._syndrome_matrix(msg.shape[-1], num_symbols)
+        products = self._mul_flat[matrix + msg[..., np.newaxis, :]]
+        return np.bitwise_xor.reduce(products, axis=-1)
+
+    def _syndrome_matrix(self, msg_length, num_symbols):
+        """ Matrix of the powers of the generator roots used to calculate the syndromes (cached for
+        each message length and number of error correction symbols). The powers are stored as offsets
+        of the corresponding rows in the flattened multiplication table. """
+        key = (msg_length, num_symbols)
+        if key not in self._syndrome_matrices:
+            roots = np.arange(num_symbols) + self._generator_base
+            powers = np.arange(msg_length - 1, -1, -1)
+            exponents = (roots[:, np.newaxis] * powers[np.newaxis, :]) % 255
+            powers_of_roots = np.asarray(self._exp, dtype=np.intp)[exponents]
+            matrix = powers_of_roots * 256
+            matrix.flags.writeable = False
+            self._syndrome_matrices[key] = matrix
+
+        return self._syndrome_matrices[key]
+
+    def generator_poly(self, num_symbols):
+        """ The generator polynomial for the given number of error correction symbols (cached). """
+        if num_symbols not in self._generator_polys:
+            g = [1]
+            for i in range(0, num_symbols):
+                g = self.poly_mul(g, [1, self.exp(i + self.base())])
+            self._generator_polys[num_symbols] = tuple(g)
+
+        return self._generator_polys[num_symbols]
+
+
+# Build the tables for each of the fields once, when the module is first imported
+for _field_type in (GaloisField.DATAMATRIX, GaloisField.QR_CODE):
+    GaloisField.shared(_field_type)
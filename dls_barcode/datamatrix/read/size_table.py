@@ -1,3 +1,6 @@
+from __future__ import division
+
+
 class DatamatrixSizeError(Exception):
     pass
 
@@ -6,7 +9,14 @@ class DatamatrixSizeTable:
     """ Table of the sizes of datamatrix available including the number of bytes used for data
     and for error correction.
 
-    Only square datamatrices are currently accounted for.
+    Both the square and the rectangular ECC200 symbols are included. A square symbol's size is identified
+    by the number of modules along each edge (e.g. 14), and a rectangular symbol's size by a string giving
+    the number of rows and columns (e.g. "8x18"). The functions in this class accept either form (or a
+    (rows, columns) tuple).
+
+    Larger symbols are divided into several data regions, each surrounded by its own finder and timing
+    patterns (the alignment patterns). The largest symbols also split their codewords into several
+    interleaved Reed-Solomon blocks.
 
     See:
     http://www.gs1.org/docs/barcodes/GS1_DataMatrix_Guideline.pdf
@@ -14,43 +24,134 @@ class DatamatrixSizeTable:
     http://www.codecorp.com/assets/white_paper/C001684-WhitePaper-DataMatrixECCLevels.pdf
     """
 
-    # Square matrix size (including border): [num data bytes, num error bytes]
-    CAPACITY = {
-        10: [3, 5],
-        12: [5, 7],
-        14: [8, 10],
-        16: [12, 12],
-        18: [18, 14],
-        20: [22, 18],
-        22: [30, 20],
-        24: [36, 24],
-        26: [44, 28]
+    # Symbol size, (rows, columns) including the borders: [num data bytes, num error bytes,
+    #                                                      data region rows, data region columns, num blocks]
+    SYMBOLS = {
+        (10, 10): [3, 5, 8, 8, 1],
+        (12, 12): [5, 7, 10, 10, 1],
+        (14, 14): [8, 10, 12, 12, 1],
+        (16, 16): [12, 12, 14, 14, 1],
+        (18, 18): [18, 14, 16, 16, 1],
+        (20, 20): [22, 18, 18, 18, 1],
+        (22, 22): [30, 20, 20, 20, 1],
+        (24, 24): [36, 24, 22, 22, 1],
+        (26, 26): [44, 28, 24, 24, 1],
+        (32, 32): [62, 36, 14, 14, 1],
+        (36, 36): [86, 42, 16, 16, 1],
+        (40, 40): [114, 48, 18, 18, 1],
+        (44, 44): [144, 56, 20, 20, 1],
+        (48, 48): [174, 68, 22, 22, 1],
+        (52, 52): [204, 84, 24, 24, 2],
+        (64, 64): [280, 112, 14, 14, 2],
+        (72, 72): [368, 144, 16, 16, 4],
+        (80, 80): [456, 192, 18, 18, 4],
+        (88, 88): [576, 224, 20, 20, 4],
+        (96, 96): [696, 272, 22, 22, 4],
+        (104, 104): [816, 336, 24, 24, 6],
+        (120, 120): [1050, 408, 18, 18, 6],
+        (132, 132): [1304, 496, 20, 20, 8],
+        (144, 144): [1558, 620, 22, 22, 10],
+
+        (8, 18): [5, 7, 6, 16, 1],
+        (8, 32): [10, 11, 6, 14, 1],
+        (12, 26): [16, 14, 10, 24, 1],
+        (12, 36): [22, 18, 10, 16, 1],
+        (16, 36): [32, 24, 14, 16, 1],
+        (16, 48): [49, 28, 14, 22, 1],
     }
 
     @staticmethod
     def valid_sizes():
-        sizes = list(DatamatrixSizeTable.CAPACITY.keys())
-        return sorted(sizes)
+        """ All of the valid sizes; the square sizes (in order) followed by the rectangular sizes. """
+        dimensions = sorted(DatamatrixSizeTable.SYMBOLS.keys(), key=lambda dims: (dims[0] != dims[1], dims))
+        return [DatamatrixSizeTable.canonical_size(dims) for dims in dimensions]
+
+    @staticmethod
+    def square_sizes():
+        return [size for size in DatamatrixSizeTable.valid_sizes() if not DatamatrixSizeTable.is_rectangular(size)]
+
+    @staticmethod
+    def dimensions(size):
+        """ The number of (rows, columns) of modules in a datamatrix of the specified size. """
+        if isinstance(size, tuple):
+            dims = tuple(size)
+        else:
+            try:
+                parts = [int(part) for part in str(size).lower().split("x")]
+            except ValueError:
+                parts = []
+            dims = tuple(parts) * 2 if len(parts) == 1 else tuple(parts)
+
+        if dims not in DatamatrixSizeTable.SYMBOLS:
+            raise DatamatrixSizeError("Invalid or unimplemented datamatrix size: {}".format(size))
+
+        return dims
+
+    @staticmethod
+    def canonical_size(size):
+        """ The standard form of the specified size: an int for a square datamatrix or a "<rows>x<columns>"
+        string for a rectangular one. """
+        rows, cols = DatamatrixSizeTable.dimensions(size)
+        if rows == cols:
+            return rows
+        return "{}x{}".format(rows, cols)
+
+    @staticmethod
+    def is_rectangular(size):
+        rows, cols = DatamatrixSizeTable.dimensions(size)
+        return rows != cols
+
+    @staticmethod
+    def aspect_ratio(size):
+        """ The ratio of the number of columns to the number of rows of a datamatrix of the specified size. """
+        rows, cols = DatamatrixSizeTable.dimensions(size)
+        return cols / rows
 
     @staticmethod
     def num_data_bytes(size):
-        """ The number of bytes used to encode data in a square datamatrix of the specified size. """
-        DatamatrixSizeTable.check_datamatrix_size(size)
-        return DatamatrixSizeTable.CAPACITY[size][0]
+        """ The number of bytes used to encode data in a datamatrix of the specified size. """
+        return DatamatrixSizeTable._entry(size)[0]
 
     @staticmethod
     def num_error_bytes(size):
-        """ The number of bytes used for error correction in a square datamatrix of the specified size. """
-        DatamatrixSizeTable.check_datamatrix_size(size)
-        return DatamatrixSizeTable.CAPACITY[size][1]
+        """ The number of bytes used for error correction in a datamatrix of the specified size. """
+        return DatamatrixSizeTable._entry(size)[1]
 
     @staticmethod
     def num_bytes(size):
-        """ The total number of bytes encoded in a square datamatrix of the specified size. """
-        DatamatrixSizeTable.check_datamatrix_size(size)
-        return sum(DatamatrixSizeTable.CAPACITY[size])
+        """ The total number of bytes encoded in a datamatrix of the specified size. """
+        return sum(DatamatrixSizeTable._entry(size)[:2])
+
+    @staticmethod
+    def data_region_size(size):
+        """ The number of (rows, columns) of data modules in each data region of a datamatrix of the
+        specified size (i.e., not including the surrounding finder and timing patterns). """
+        return tuple(DatamatrixSizeTable._entry(size)[2:4])
+
+    @staticmethod
+    def num_data_regions(size):
+        """ The number of data regions (rows, columns) in a datamatrix of the specified size. """
+        rows, cols = DatamatrixSizeTable.dimensions(size)
+        region_rows, region_cols = DatamatrixSizeTable.data_region_size(size)
+        return rows // (region_rows + 2), cols // (region_cols + 2)
+
+    @staticmethod
+    def mapping_matrix_size(size):
+        """ The number of (rows, columns) of data modules in a datamatrix of the specified size, once the
+        finder, timing and alignment patterns have been removed. """
+        region_rows, region_cols = DatamatrixSizeTable.data_region_size(size)
+        num_rows, num_cols = DatamatrixSizeTable.num_data_regions(size)
+        return region_rows * num_rows, region_cols * num_cols
+
+    @staticmethod
+    def num_blocks(size):
+        """ The number of interleaved Reed-Solomon blocks in a datamatrix of the specified size. """
+        return DatamatrixSizeTable._entry(size)[4]
 
     @staticmethod
     def check_datamatrix_size(size):
-        if size not in DatamatrixSizeTable.CAPACITY:
-            raise DatamatrixSizeError("Invalid or unimplemented datamatrix size: {}".format(size))
+        DatamatrixSizeTable.dimensions(size)
+
+    @staticmethod
+    def _entry(size):
+        return DatamatrixSizeTable.SYMBOLS[DatamatrixSizeTable.dimensions(size)]
@@ -2,7 +2,7 @@ from __future__ import division
 
 import math
 
-from dls_util.shape import Point, Circle
+from dls_util.shape import Point, Circle, CircleGrid
 from .unipuck_template import UnipuckTemplate as Template
 
 
@@ -24,6 +24,7 @@ class Unipuck:
         self._rotation = rotation
 
         self._slot_bounds = []
+        self._slot_grid = None
         self.set_rotation(rotation)
 
     def center(self): return self._center
@@ -54,11 +55,8 @@ class Unipuck:
 
     def containing_slot(self, point):
         """ Returns the number of the slot which contains the specified point or None otherwise. """
-        for i, bounds in enumerate(self._slot_bounds):
-            if bounds.contains_point(point):
-                return i + 1
-
-        return None
+        index = self._slot_grid.first_containing(point)
+        return None if index is None else index + 1
 
     def set_center(self, center):
         """ Set the center of the puck to the specified position. Recalculate the positions of the slots. """
@@ -78,6 +76,11 @@ class Unipuck:
     def _reset_slot_bounds(self):
         self._slot_bounds = self.calculate_slot_bounds(self._center, self._radius, self._rotation)
 
+        # Index of the slots, so that the slot containing a point can be found without checking each one
+        self._slot_grid = CircleGrid(2 * self.slot_radius())
+        for bounds in self._slot_bounds:
+            self._slot_grid.add(bounds)
+
     @staticmethod
     def calculate_slot_bounds(center, radius, rotation):
         """ Calculates the bounds (position and radius) of all of the slots in the puck, based on the
@@ -3,7 +3,6 @@ from __future__ import division
 import math
 
 import numpy as np
-from scipy.optimize import fmin
 
 from dls_util.shape import Point
 from .exception import GeometryAlignmentError
@@ -12,6 +11,11 @@ from .unipuck_template import UnipuckTemplate
 
 MIN_POINTS_FOR_ALIGNMENT = 6
 
+# Parameters of the robust (Huber) concentric circle fit: the number of reweighting iterations, and the
+# residual (relative to the robust standard deviation of the residuals) beyond which points are down-weighted
+HUBER_ITERATIONS = 5
+HUBER_K = 1.345
+
 
 class UnipuckCalculator:
     """ Creates a Unipuck object, determining its size, position, and orientation. This is all
@@ -23,6 +27,17 @@ class UnipuckCalculator:
     center of each slot, the unique orientation and position of the puck can be determined.
     This is possible even if some of the slot locations are not none.
     """
+    # Rotations (in degrees) tried when determining the orientation of the puck: every COARSE_ANGLE_STEP
+    # around the whole circle, then in finer steps around the best of those
+    COARSE_ANGLE_STEP = 2
+    FINE_ANGLE_STEPS = [0.2, 0.02]
+
+    # Whether the puck center is fitted robustly, i.e., points that don't fit the layers well (e.g., misplaced
+    # barcodes or badly detected empty slots) are given less weight; see _fit_concentric_circles(). This is off
+    # by default, which gives the same center as the original (least squares) fit; it is set by the "Robust Puck
+    # Center Fit" option
+    ROBUST_CENTER_FIT = False
+
     def __init__(self, slot_centers):
         """ Determine the puck geometry (position and orientation) for the locations of the
         centers of some (or all of the pins).
@@ -70,8 +85,8 @@ class UnipuckCalculator:
         be a bit out. Instead, we use the average center position (the centroid) as a starting
         point and divide the slots into two groups based on how close they are to the centroid.
         As long as not too many slots are missing, the division into groups should work well.
-        We then iterate over different values for the puck center position, attempting to find
-        a location that is equidistant from all of the slot centers.
+        We then find the center position that is (as close as possible to being) equidistant
+        from all of the slot centers in each layer.
         """
         centroid = calculate_centroid(pin_centers)
 
@@ -84,8 +99,8 @@ class UnipuckCalculator:
         first_layer = [p for p, d in distances[:layer_break]]
         second_layer = [p for p, d in distances[layer_break:]]
 
-        # Optimise for the puck center by finding the point that is equidistant from every point in each layer
-        center = fmin(func=_center_minimiser, x0=centroid.tuple(), args=tuple([[first_layer, second_layer]]), xtol=1, disp=False)
+        # Find the puck center as the point that is equidistant from every point in each layer
+        center = _fit_concentric_circles([first_layer, second_layer], UnipuckCalculator.ROBUST_CENTER_FIT)
         center = Point(center[0], center[1]).intify()
 
         return center
@@ -110,53 +125,29 @@ class UnipuckCalculator:
     def _determine_puck_orientation(puck, pin_centers):
         """ Using the known size and position of the puck in the image, determine the correct
         orientation of puck. Try the template at a set of incremental rotations and determine
-        which is the best orientation by looking at sum of squared errors. This algorithm can
-        definitely be improved upon but this does the job
+        which is the best orientation by looking at sum of squared errors. The rotations are
+        first tried every COARSE_ANGLE_STEP degrees around the whole circle, and then at each of
+        the FINE_ANGLE_STEPS in turn around the best angle found so far.
         """
-        # TODO: finding orientation takes 80-90% of the alignment time; find a better algorithm
+        center = puck.center()
+        pins = np.array([[p.x - center.x, p.y - center.y] for p in pin_centers], dtype=np.float64)
 
-        errors = []
-        best_sse = 10000000
-        best_angle = 0
-        original_angle = puck.angle()
-
-        # For each angular increment, calculate the sum of squared errors in slot center position
-        for a in range(0, 360, 2):
-            angle = a / (180 / math.pi)
-            puck.set_rotation(angle)
-            sse = 0
-            for p in pin_centers:
-                sse += UnipuckCalculator._shortest_sq_distance(puck, p)
-            if sse < best_sse:
-                best_sse = sse
-                best_angle = angle
-            errors.append([angle, sse])
+        angles = np.radians(np.arange(0, 360, UnipuckCalculator.COARSE_ANGLE_STEP))
+        errors = _orientation_errors(pins, puck.radius(), angles)
+        best_angle, best_sse = angles[np.argmin(errors)], np.min(errors)
 
-        # Set the puck back to its original angle
-        puck.set_rotation(original_angle)
+        step = UnipuckCalculator.COARSE_ANGLE_STEP
+        for fine_step in UnipuckCalculator.FINE_ANGLE_STEPS:
+            angles = best_angle + np.radians(np.arange(-step, step + fine_step / 2, fine_step))
+            errors = _orientation_errors(pins, puck.radius(), angles)
+            best_angle, best_sse = angles[np.argmin(errors)], np.min(errors)
+            step = fine_step
 
         average_error = best_sse / puck.radius() ** 2 / len(pin_centers)
         if average_error > 0.003:
             raise GeometryAlignmentError("Unable to determine Unipuck orientation")
 
-        return best_angle
-
-    @staticmethod
-    def _shortest_sq_distance(puck, point):
-        """ Returns the distance from the specified point to the closest slot in the puck. """
-        low_l_sq = 100000000
-        slot_sq = puck.slot_radius()**2
-
-        for num in range(puck.num_slots()):
-            center = puck.slot_center(num+1)
-            length_sq = point.distance_to_sq(center)
-            if length_sq < low_l_sq:
-                low_l_sq = length_sq
-                # Slots are non-overlapping so if its in the slot radius, it must be the closest
-                if length_sq < slot_sq:
-                    return length_sq
-
-        return low_l_sq
+        return float(best_angle % (2 * math.pi))
 
 
 def calculate_centroid(points):
@@ -167,22 +158,65 @@ def calculate_centroid(points):
     return Point((sum(x) / len(points)), (sum(y) / len(points))).intify()
 
 
-def _center_minimiser(center, layers):
-    """ Used as the cost function in an optimisation routine. The puck consists of 2 layers of slots.
-    Within a given layer, each slot is the same distance from the center point of the puck. Therefore
-    for a trial center point, we calculate an error that is the sum of the squares of the deviation
-    of the distance of each slot from the mean distance of all the slots in the layer.
+def _orientation_errors(pins, puck_radius, angles):
+    """ For each of the puck rotation angles, the sum over all of the pins (relative to the puck center)
+    of the squared distance from the pin to the closest slot.
+
+    The slots in a layer are evenly spaced around a circle, so the closest slot in the layer is the
+    one that is closest in angle, and the distance to it can be calculated directly from the pin's
+    angle relative to the slots (see Unipuck.calculate_slot_bounds() for the positions of the slots).
+    The closest slot overall is then the closer of the closest slots in each layer.
     """
-    errors = []
-    center = Point.from_array(center)
-    for layer in layers:
-        distances = [p.distance_to_sq(center) for p in layer]
+    pin_radii = np.hypot(pins[:, 0], pins[:, 1])[:, np.newaxis]
+    pin_angles = np.arctan2(pins[:, 1], pins[:, 0])[:, np.newaxis]
+
+    dist_sq = None
+    for layer_count, layer_radius in zip(UnipuckTemplate.N, UnipuckTemplate.LAYER_RADII):
+        layer_radius *= puck_radius
+        spacing = 2 * math.pi / layer_count
+
+        # Angle (pins x angles) between each pin and the closest slot, the first slot being at -pi/2
+        offset = np.mod(pin_angles + math.pi / 2 - angles + spacing / 2, spacing) - spacing / 2
+        layer_dist_sq = pin_radii ** 2 + layer_radius ** 2 - 2 * pin_radii * layer_radius * np.cos(offset)
+        dist_sq = layer_dist_sq if dist_sq is None else np.minimum(dist_sq, layer_dist_sq)
+
+    return np.sum(dist_sq, axis=0)
+
 
-        mean = np.mean(distances)
-        layer_errors = [(d-mean)**2 for d in distances]
-        errors.extend(layer_errors)
+def _fit_concentric_circles(layers, robust=False):
+    """ Find the center of a set of concentric circles, given points that lie on each of the circles (the
+    layers of slots in the puck). Returns the center as an (x, y) array.
+
+    A point (x, y) on a circle of radius r about (a, b) satisfies x^2 + y^2 = 2ax + 2by + c, where
+    c = r^2 - a^2 - b^2, which is linear in a and b (and in a separate c for each circle), so the center
+    is found directly as a linear least squares solution. The residual for each point is the difference
+    between its squared distance from the center and the square of the radius of its circle, and the
+    solution minimises the sum of the squares of these.
+
+    If robust, the fit is repeated several times, each time giving less weight to the points with large
+    residuals (iteratively reweighted least squares with Huber weights), so that the result is not pulled
+    off by a few badly placed points.
+    """
+    points = np.array([[p.x, p.y] for layer in layers for p in layer], dtype=np.float64)
+    layer_index = np.repeat(np.arange(len(layers)), [len(layer) for layer in layers])
+
+    coefficients = np.zeros((len(points), 2 + len(layers)))
+    coefficients[:, :2] = 2 * points
+    coefficients[np.arange(len(points)), 2 + layer_index] = 1
+    values = np.sum(points ** 2, axis=1)
+
+    weights = np.ones(len(points))
+    for _ in range(HUBER_ITERATIONS if robust else 1):
+        root_weights = np.sqrt(weights)
+        solution = np.linalg.lstsq(coefficients * root_weights[:, np.newaxis], values * root_weights, rcond=-1)[0]
+
+        residuals = np.abs(values - coefficients.dot(solution))
+        scale = HUBER_K * 1.4826 * np.median(residuals)
+        if scale == 0:
+            break
+        weights = np.minimum(1, scale / np.maximum(residuals, 1e-12))
 
-    return sum(errors)
+    return solution[:2]
 
 
 def _partition(numbers):
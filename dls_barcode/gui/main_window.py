@@ -6,7 +6,10 @@ from PyQt4.QtGui import QPushButton, QHBoxLayout
 
 from camera import CameraScanner
 from config import BarcodeConfig, BarcodeConfigDialog
-from scan import GeometryScanner, SlotScanner, OpenScanner
+from dls_barcode.datamatrix import Locator
+from dls_barcode.datamatrix.read import DatamatrixPreFilter
+from dls_barcode.geometry.unipuck_calculator import UnipuckCalculator
+from scan import GeometryScanner, SlotScanner, OpenScanner, PlateScanner
 from dls_util.image import Image
 from .barcode_table import BarcodeTable
 from .image_frame import ImageFrame
@@ -161,6 +164,10 @@ class DiamondBarcodeMainWindow(QtGui.QMainWindow):
             barcode_size = self._config.barcode_size.value()
             SlotScanner.DEBUG = self._config.slot_images.value()
             SlotScanner.DEBUG_DIR = self._config.slot_image_directory.value()
+            DatamatrixPreFilter.ENABLED = self._config.scan_prefilter.value()
+            Locator.NUM_THREADS = max(1, self._config.locator_threads.value())
+            PlateScanner.NUM_THREADS = max(1, self._config.slot_scan_threads.value())
+            UnipuckCalculator.ROBUST_CENTER_FIT = self._config.robust_center_fit.value()
 
             if plate_type == "None":
                 scanner = OpenScanner(barcode_size)
@@ -13,6 +13,7 @@ class Slot:
         self._number = number
         self._bounds = None
         self._barcode_position = None
+        self._square_fit = None
         self._barcode = None
         self._state = self.NO_RESULT
 
@@ -43,6 +44,11 @@ class Slot:
         bounds center as predicted by the geometry. """
         return self._barcode_position
 
+    def square_fit(self):
+        """ Get the finder pattern (in frame coordinates) that the square locator last fitted to the slot,
+        or None if it hasn't been used on this slot. """
+        return self._square_fit
+
     def barcode_this_frame(self):
         """ True if the barcode has been set this frame. """
         return self._barcode_set_this_frame
@@ -53,6 +59,9 @@ class Slot:
     def set_barcode_position(self, coord):
         self._barcode_position = coord
 
+    def set_square_fit(self, finder_pattern):
+        self._square_fit = finder_pattern
+
     def set_barcode(self, barcode):
         if barcode and barcode.is_valid():
             self._barcode = barcode
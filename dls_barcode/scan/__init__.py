@@ -1,2 +1,2 @@
-from .with_geometry import GeometryScanner, SlotScanner
+from .with_geometry import GeometryScanner, SlotScanner, PlateScanner
 from .open import OpenScanner
@@ -15,5 +15,10 @@ class OpenScanResult(ScanResult):
 
         return new
 
+    def is_complete(self):
+        """ The plate of an open scan only holds the newly read barcodes, so the scan is only complete if
+        every barcode that was located has been read. """
+        return all(barcode.is_read() and barcode.is_valid() for barcode in self._barcodes)
+
     def set_old_barcode_data(self, barcode_data):
         self._old_barcode_data = barcode_data[:]
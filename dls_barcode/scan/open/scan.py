@@ -17,13 +17,17 @@ class OpenScanner:
         self._frame_number = 0
         self._frame_img = None
         self._is_single_image = False
+        self._located_barcodes = None
 
         self._old_barcode_data = []
 
-    def scan_next_frame(self, frame_img, is_single_image=False):
+    def scan_next_frame(self, frame_img, is_single_image=False, barcodes=None):
+        """ Scan the frame for barcodes. If they have already been located (e.g., by another process), they
+        can be supplied rather than locating them again. """
         self._frame_img = frame_img
         self._frame_number += 1
         self._is_single_image = is_single_image
+        self._located_barcodes = barcodes
         result = OpenScanResult(self._frame_number)
         result.set_old_barcode_data(self._old_barcode_data)
         result.start_timer()
@@ -54,10 +58,9 @@ class OpenScanner:
 
     def _perform_frame_scan(self):
         barcodes = self._locate_all_barcodes_in_image()
+        DataMatrix.read_many(barcodes, DataMatrix.DIAG_WIGGLES)
 
         for barcode in barcodes:
-            barcode.perform_read(DataMatrix.DIAG_WIGGLES)
-
             if self._is_barcode_new(barcode):
                 # todo: limit number of previous barcodes stored
                 self._old_barcode_data.append(barcode.data())
@@ -71,7 +74,11 @@ class OpenScanner:
 
     def _locate_all_barcodes_in_image(self):
         """ Perform a deep scan to find all the datamatrix barcodes in the image (but don't read them). """
-        if self._is_single_image:
+        if self._located_barcodes is not None:
+            barcodes = self._located_barcodes
+            for barcode in barcodes:
+                barcode.set_image(self._frame_img)
+        elif self._is_single_image:
             barcodes = DataMatrix.locate_all_barcodes_in_image_deep(self._frame_img, self.barcode_size)
         else:
             barcodes = DataMatrix.locate_all_barcodes_in_image(self._frame_img, self.barcode_size)
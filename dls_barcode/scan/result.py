@@ -1,5 +1,8 @@
 import time
 
+from dls_barcode.datamatrix import DataMatrix
+from dls_barcode.datamatrix.locate import ContourLocator
+
 
 class ScanResult:
     def __init__(self, frame_number):
@@ -16,12 +19,57 @@ class ScanResult:
         self._start_time = 0
         self._scan_time = 0
 
+        self._cache_start = (0, 0)
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+        self._pre_filter_start = None
+        self._pre_filter_checked = 0
+        self._pre_filter_rejected = {}
+
+        self._contour_start = None
+        self._contour_polygons = 0
+        self._contour_dropped = {}
+
     def start_timer(self):
         self._start_time = time.time()
+        self._cache_start = self._decode_cache_counts()
+        self._pre_filter_start = self._pre_filter_counts()
+        self._contour_start = ContourLocator.filter_counts()
 
     def end_timer(self):
         self._scan_time = time.time() - self._start_time
 
+        hits, misses = self._decode_cache_counts()
+        self._cache_hits = hits - self._cache_start[0]
+        self._cache_misses = misses - self._cache_start[1]
+
+        checked, rejected = self._pre_filter_counts()
+        start_checked, start_rejected = self._pre_filter_start
+        self._pre_filter_checked = checked - start_checked
+        self._pre_filter_rejected = dict((stage, rejected[stage] - start_rejected[stage]) for stage in rejected)
+
+        # The contour locator's filter counters are also shared by the whole process (see _pre_filter_counts())
+        polygons, dropped = ContourLocator.filter_counts()
+        start_polygons, start_dropped = self._contour_start
+        self._contour_polygons = polygons - start_polygons
+        self._contour_dropped = dict((name, dropped[name] - start_dropped[name]) for name in dropped)
+
+    @staticmethod
+    def _decode_cache_counts():
+        """ The decode cache counters are shared by the whole process, so the hits and misses recorded for a
+        scan are only approximate: they include reads by any other thread of this process during the scan, and
+        not reads done for the scan by another process (e.g., the camera scanner's locator pool). """
+        cache = DataMatrix.DECODE_CACHE
+        return cache.hits(), cache.misses()
+
+    @staticmethod
+    def _pre_filter_counts():
+        """ Like the decode cache counters, the pre-filter counters are shared by the whole process, so the
+        counts recorded for a scan are only approximate. """
+        pre_filter = DataMatrix.PRE_FILTER
+        return pre_filter.num_checked(), dict((stage, pre_filter.num_rejected(stage)) for stage in pre_filter.STAGES)
+
     def set_previous_plate(self, plate):
         self._previous_plate = plate
         self._previous_plate_count = plate.num_valid_barcodes() if plate else 0
@@ -39,6 +87,14 @@ class ScanResult:
 
     def error(self): return self._error
 
+    def decode_cache_hits(self): return self._cache_hits
+
+    def decode_cache_misses(self): return self._cache_misses
+
+    def pre_filter_checked(self): return self._pre_filter_checked
+
+    def pre_filter_rejected(self): return sum(self._pre_filter_rejected.values())
+
     def set_barcodes(self, value): self._barcodes = value
 
     def set_geometry(self, value): self._geometry = value
@@ -65,6 +121,10 @@ class ScanResult:
     def is_full_valid(self):
         return self._plate is not None and self._plate.is_full_valid()
 
+    def is_complete(self):
+        """ True if there is nothing left to read in the frame that was scanned. """
+        return self.is_full_valid()
+
     def scan_time(self):
         return self._scan_time
 
@@ -86,6 +146,24 @@ class ScanResult:
         if self.any_finder_patterns():
             print("Barcodes Located: {}".format(len(self._barcodes)))
 
+        if self._cache_hits or self._cache_misses:
+            print("Decode Cache (this process, approx.): {} hits; {} misses".format(
+                self._cache_hits, self._cache_misses))
+
+        if self._pre_filter_checked:
+            rejected = ["{} {}".format(self._pre_filter_rejected[stage], stage)
+                        for stage in DataMatrix.PRE_FILTER.STAGES if self._pre_filter_rejected.get(stage)]
+            print("Pre-filter (this process, approx.): {} checked; {} rejected{}".format(
+                self._pre_filter_checked, self.pre_filter_rejected(),
+                " ({})".format(", ".join(rejected)) if rejected else ""))
+
+        if self._contour_polygons:
+            dropped = ["{} {}".format(self._contour_dropped[name], name)
+                       for name in ContourLocator.FILTERS if self._contour_dropped.get(name)]
+            print("Contour Filters (this process, approx.): {} polygons; {} dropped{}".format(
+                self._contour_polygons, sum(self._contour_dropped.values()),
+                " ({})".format(", ".join(dropped)) if dropped else ""))
+
         if self.is_aligned():
             print("Geometry - {}".format(self._geometry.to_string()))
 
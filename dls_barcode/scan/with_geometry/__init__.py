@@ -1,2 +1,3 @@
 from .scan_slot import SlotScanner
+from .scan_plate import PlateScanner
 from .scan import GeometryScanner
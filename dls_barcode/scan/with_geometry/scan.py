@@ -1,9 +1,11 @@
 from __future__ import division
 
+import numpy as np
+
 from dls_barcode.datamatrix import DataMatrix
 from dls_barcode.plate import Plate, Slot
 from dls_barcode.plate.geometry_adjuster import UnipuckGeometryAdjuster, GeometryAdjustmentError
-from geometry import Geometry, GeometryException
+from dls_barcode.geometry import Geometry, GeometryException
 from .empty_detector import EmptySlotDetector
 from .scan_plate import PlateScanner
 from .scan_slot import SlotScanner
@@ -15,6 +17,25 @@ class NoBarcodesError(Exception):
 
 
 class GeometryScanner:
+    """ Scans frames (e.g., from a camera) of a sample plate, combining the results of each frame into the
+    plate. If the plate hasn't moved since the last frame, the barcodes are found by tracking them rather
+    than by searching the whole frame: a barcode is kept where it was if the image around it hasn't changed,
+    or looked for in a small area around its previous position if it has (see Locator.track()). The whole
+    frame is still searched if any of the barcodes can't be found again, if the frame looks significantly
+    different to the last one, or every FULL_LOCATE_INTERVAL frames (so that barcodes that have just come
+    into view are found).
+    """
+    # Whether barcodes are tracked from frame to frame
+    TRACKING = True
+
+    # The maximum number of frames between searches of the whole frame
+    FULL_LOCATE_INTERVAL = 10
+
+    # The size of the thumbnail images used to tell if a frame has changed, and the mean difference in
+    # brightness (0-255) between them above which the frame is considered to have changed
+    THUMBNAIL_SIZE = (64, 48)
+    FRAME_CHANGE_LIMIT = 8.0
+
     def __init__(self, plate_type, barcode_size):
         self.plate_type = plate_type
         self.barcode_size = barcode_size
@@ -23,17 +44,27 @@ class GeometryScanner:
         self._plate = None
         self._plate_scan = None
 
+        # State from earlier frames used for tracking
+        self._tracked_barcodes = []
+        self._last_frame_img = None
+        self._last_thumbnail = None
+        self._frames_since_full_locate = 0
+
         self._frame_img = None
         self._geometry = None
         self._barcodes = []
         self._is_single_image = False
+        self._located_barcodes = None
         self._frame_result = None
 
-    def scan_next_frame(self, frame_img, is_single_image=False):
+    def scan_next_frame(self, frame_img, is_single_image=False, barcodes=None):
+        """ Scan the frame and merge the results into the plate. If the barcodes in the frame have already
+        been located (e.g., by another process), they can be supplied rather than locating them again. """
         self._new_frame()
 
         self._frame_img = frame_img
         self._is_single_image = is_single_image
+        self._located_barcodes = barcodes
 
         try:
             self._perform_frame_scan()
@@ -50,6 +81,7 @@ class GeometryScanner:
         self._geometry = None
         self._barcodes = []
         self._is_single_image = False
+        self._located_barcodes = None
 
         self._frame_number += 1
 
@@ -81,17 +113,53 @@ class GeometryScanner:
             self._merge_frame_into_plate()
 
     def _locate_all_barcodes_in_image(self):
-        if self._is_single_image:
+        if self._located_barcodes is not None:
+            # The barcodes may have lost their image on the way from another process
+            barcodes = self._located_barcodes
+            for barcode in barcodes:
+                barcode.set_image(self._frame_img)
+        elif self._is_single_image:
             # barcodes = DataMatrix.locate_all_barcodes_in_image_deep(self._frame_img, self.barcode_size)
             barcodes = DataMatrix.locate_all_barcodes_in_image(self._frame_img, self.barcode_size)
         else:
-            barcodes = DataMatrix.locate_all_barcodes_in_image(self._frame_img, self.barcode_size)
+            barcodes = self._track_barcodes()
+            if barcodes is None:
+                barcodes = DataMatrix.locate_all_barcodes_in_image(self._frame_img, self.barcode_size)
+                self._frames_since_full_locate = 0
+
+        # Remember where the barcodes are so that they can be tracked into the next frame
+        self._tracked_barcodes = barcodes
+        self._last_frame_img = self._frame_img
 
         if len(barcodes) == 0:
             raise NoBarcodesError("No Barcodes Detected In Image")
 
         return barcodes
 
+    def _track_barcodes(self):
+        """ Find each of the barcodes from the previous frame in this frame, close to its previous position.
+        Returns None if tracking isn't possible, in which case the whole frame must be searched. """
+        thumbnail = self._frame_img.resize(self.THUMBNAIL_SIZE).img.astype(np.float32)
+        last_thumbnail, self._last_thumbnail = self._last_thumbnail, thumbnail
+        self._frames_since_full_locate += 1
+
+        if not self.TRACKING or not self._tracked_barcodes or last_thumbnail is None:
+            return None
+
+        if self._frames_since_full_locate >= self.FULL_LOCATE_INTERVAL:
+            return None
+
+        if np.mean(np.abs(thumbnail - last_thumbnail)) > self.FRAME_CHANGE_LIMIT:
+            return None
+
+        barcodes = DataMatrix.track_barcodes(self._frame_img, self._last_frame_img, self._tracked_barcodes,
+                                             self.barcode_size)
+
+        if any(bc is None for bc in barcodes):
+            return None
+
+        return barcodes
+
     def _calculate_geometry(self):
         slot_centers = [bc.center() for bc in self._barcodes]
 
@@ -107,8 +175,7 @@ class GeometryScanner:
         return geometry
 
     def _initialize_plate_from_barcodes(self):
-        for bc in self._barcodes:
-            bc.perform_read()
+        DataMatrix.read_many(self._barcodes)
 
         if self._any_valid_barcodes():
             slot_scanner = self._create_slot_scanner()
@@ -127,7 +194,7 @@ class GeometryScanner:
         return any([bc.is_read() and bc.is_valid() for bc in self._barcodes])
 
     def _create_slot_scanner(self):
-        slot_scanner = SlotScanner(self._frame_img, self._barcodes)
+        slot_scanner = SlotScanner(self._frame_img, self._barcodes, self.barcode_size)
         return slot_scanner
 
     def _find_common_barcode(self, geometry, barcodes):
@@ -1,4 +1,7 @@
 import random
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 
 from plate.slot import Slot
 
@@ -10,12 +13,27 @@ class BadGeometryException(Exception):
 class PlateScanner:
     FRAMES_BEFORE_DEEP = 3
 
+    # Time (in seconds) that can be spent on the deep scans of the unread slots in each frame (None for no limit).
+    # Slots that don't get scanned before it runs out are scanned first in the next frame.
+    DEEP_SCAN_TIME = 0.15
+
+    # Number of threads used to run the deep scans of different slots at the same time (they are independent
+    # and most of the work is done by OpenCV, which releases the GIL). A value of 1 scans them one at a time.
+    NUM_THREADS = 4
+
+    # Thread pools shared by all plate scanners, keyed by size, see _thread_pool()
+    _pools = {}
+    _pool_lock = threading.Lock()
+
     def __init__(self, plate, single_frame=False):
         self._plate = plate
 
         self._frame_num = -1
         self._force_deep_scan = single_frame
 
+        # The number of times each slot (by number) has had a deep scan
+        self._deep_scan_counts = {}
+
     def new_frame(self, geometry, barcodes, slot_scanner):
         """ Merge the set of barcodes from a new scan into the plate. The new set comes from a new image
         of the same plate, so will almost certainly contain many of the same barcodes. Actually reading a
@@ -26,15 +44,24 @@ class PlateScanner:
         object and update the slot position with the actual position of the center of the barcode. The
         position is likely to be similar to, but not exactly the same as, the bound's center. This info
         is retained as it allows us to properly calculate the geometry for future frames.
+
+        Any slots that still haven't been read are then given a deeper scan (see _deep_scans()).
         """
         self._frame_num += 1
         self._plate.set_geometry(geometry)
 
         # Fill each slot with the correct barcodes
+        unread_slots = []
         for slot in self._plate.slots():
-            self._new_slot_frame(barcodes, slot, slot_scanner)
+            if self._new_slot_frame(barcodes, slot, slot_scanner):
+                unread_slots.append(slot)
+
+        # If the barcodes still haven't been read, try a deeper slot scan
+        if self._should_do_deep_scan():
+            self._deep_scans(unread_slots, slot_scanner)
 
     def _new_slot_frame(self, barcodes, slot, slot_scanner):
+        """ Update the slot from the new frame; returns true if it needs a deeper scan. """
         slot.new_frame()
 
         # Find the barcode from the new set that is in the slot position
@@ -51,8 +78,7 @@ class PlateScanner:
             barcode.perform_read()
             slot.set_barcode(barcode)
 
-        # If the barcode still hasn't been read, try a deeper slot scan
-        self._slot_scan(slot, slot_scanner)
+        return self._needs_slot_scan(slot, slot_scanner)
 
     @staticmethod
     def _find_matching_barcode(slot_bounds, barcodes):
@@ -61,45 +87,105 @@ class PlateScanner:
                 return bc
         return None
 
-    def _slot_scan(self, slot, slot_scanner):
+    @staticmethod
+    def _needs_slot_scan(slot, slot_scanner):
         # If the slot barcode has already been read correctly, skip it
         if slot.state() == Slot.VALID:
-            return
+            return False
 
         # Check for empty slot
         if slot_scanner.is_slot_empty(slot):
             slot.set_empty()
-            return
+            return False
 
         # Clear any previous (empty/unread) result
         slot.set_no_result()
-
-        if self._should_do_deep_scan():
-            self._perform_deep_contour_slot_scan(slot, slot_scanner, self._force_deep_scan)
-            self._perform_square_slot_scan(slot, slot_scanner)
+        return True
 
     def _should_do_deep_scan(self):
         return self._force_deep_scan or self._frame_num > self.FRAMES_BEFORE_DEEP
 
-    @staticmethod
-    def _perform_deep_contour_slot_scan(slot, slot_scanner, force_all):
-        if slot.state() != Slot.VALID:
-            barcodes = slot_scanner.deep_scan(slot)
-
-            # Pick a random finder pattern from those returned
-            if not force_all and barcodes:
-                barcodes = [random.choice(barcodes)]
+    def _deep_scans(self, slots, slot_scanner):
+        """ Perform a deep contour scan and then a square scan of each of the slots. The slots are shared
+        out between NUM_THREADS threads, but the barcodes found are always applied to the slots in slot
+        order, and each slot has its own random generator, so the results are the same as if the slots had
+        been scanned one after another.
 
+        Unless every slot must be scanned (a single image), the scans are limited to DEEP_SCAN_TIME: the
+        slots are scanned in order of priority (see _deep_scan_order()), and any that haven't been started
+        when the time runs out are left for the next frame.
+        """
+        force_all = self._force_deep_scan
+        if force_all or self.DEEP_SCAN_TIME is None:
+            deadline = None
+        else:
+            slots = self._deep_scan_order(slots, slot_scanner)
+            deadline = time.time() + self.DEEP_SCAN_TIME
+
+        tasks = [(slot, random.Random(random.random())) for slot in slots]
+
+        def scan(task):
+            if deadline is not None and time.time() > deadline:
+                return None
+
+            slot, rng = task
+            return self._deep_slot_scan(slot, slot_scanner, rng, force_all)
+
+        if PlateScanner.NUM_THREADS > 1 and len(tasks) > 1:
+            results = PlateScanner._thread_pool().map(scan, tasks)
+        else:
+            results = map(scan, tasks)
+
+        scanned = [(slot, barcodes) for slot, barcodes in zip(slots, results) if barcodes is not None]
+        for slot, barcodes in sorted(scanned, key=lambda scan_result: scan_result[0].number()):
+            count = self._deep_scan_counts.get(slot.number(), 0)
+            self._deep_scan_counts[slot.number()] = count + 1
             for barcode in barcodes:
-                slot_scanner.wiggles_read(barcode, "DEEP CONTOUR")
                 slot.set_barcode(barcode)
-                if barcode.is_valid():
-                    break
+
+    def _deep_scan_order(self, slots, slot_scanner):
+        """ Sort the slots by the expected payoff of scanning them. Slots that have had the fewest deep
+        scans come first, so that over successive frames the time is shared round-robin between all of the
+        unread slots; then the brightest, as a bright slot most likely contains a pin with a barcode. """
+        def priority(slot):
+            brightness = slot_scanner.slot_brightness(slot) or 0
+            return self._deep_scan_counts.get(slot.number(), 0), -brightness
+
+        return sorted(slots, key=priority)
 
     @staticmethod
-    def _perform_square_slot_scan(slot, slot_scanner):
-        if slot.state() != Slot.VALID:
-            barcode = slot_scanner.square_scan(slot)
-            if barcode is not None:
-                slot_scanner.wiggles_read(barcode, "SQUARE")
-                slot.set_barcode(barcode)
+    def _deep_slot_scan(slot, slot_scanner, rng, force_all):
+        """ Scan the slot for its barcode, first with the deep contour locator and then (if that doesn't find
+        it) with the square locator. Returns the barcodes that were read, in the order they were tried; the
+        slot itself is left unchanged (apart from the square locator's fit). """
+        read_barcodes = []
+        barcodes = slot_scanner.deep_scan(slot)
+
+        # Pick a random finder pattern from those returned
+        if not force_all and barcodes:
+            barcodes = [rng.choice(barcodes)]
+
+        for barcode in barcodes:
+            slot_scanner.wiggles_read(barcode, "DEEP CONTOUR")
+            read_barcodes.append(barcode)
+            if barcode.is_valid():
+                return read_barcodes
+
+        barcode = slot_scanner.square_scan(slot)
+        if barcode is not None:
+            slot_scanner.wiggles_read(barcode, "SQUARE")
+            read_barcodes.append(barcode)
+
+        return read_barcodes
+
+    @staticmethod
+    def _thread_pool():
+        """ The shared pool of NUM_THREADS threads. A pool is never closed once created, as another thread may
+        still be using it after the number of threads has been changed; the pool for the old number is kept
+        (idle) instead, and reused if that number is chosen again. """
+        with PlateScanner._pool_lock:
+            size = PlateScanner.NUM_THREADS
+            if size not in PlateScanner._pools:
+                PlateScanner._pools[size] = ThreadPool(size)
+
+            return PlateScanner._pools[size]
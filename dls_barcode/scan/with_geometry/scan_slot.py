@@ -9,16 +9,22 @@ import numpy as np
 from dls_barcode.datamatrix import DataMatrix, Locator
 from dls_barcode.plate.slot import Slot
 from dls_util.image import Image, Color
+from dls_util.shape import Point
 
 
 class SlotScanner:
     BRIGHTNESS_RATIO = 5
+
+    # The square locator only starts from the fit found in an earlier frame if its center is within this
+    # fraction of the average barcode radius of the current barcode position
+    WARM_START_DISTANCE = 0.25
     DEBUG = False
     DEBUG_DIR = "./debug"
 
-    def __init__(self, image, barcodes):
+    def __init__(self, image, barcodes, barcode_size=DataMatrix.DEFAULT_SIZE):
         self.image = image
         self.barcodes = barcodes
+        self.barcode_size = barcode_size
 
         self.radius_avg = self._calculate_average_radius()
         self.side_avg = self.radius_avg * (2 / math.sqrt(2))
@@ -28,16 +34,21 @@ class SlotScanner:
         if self.brightness_threshold is None:
             self.brightness_threshold = self._calculate_brightness_threshold()
 
+        brightness = self.slot_brightness(slot)
+        return brightness is not None and brightness < self.brightness_threshold
+
+    def slot_brightness(self, slot):
+        """ The brightness of a small area at the center of the slot, or None if the slot can't be seen in
+        the current frame. """
         center = slot.barcode_position()
 
         # If we cant see the slot in the current frame, skip it
         slot_in_frame = self._image_contains_point(center, self.radius_avg / 2)
         if not slot_in_frame:
-            return False
+            return None
 
         size = self.radius_avg / 2
-        brightness = self.image.calculate_brightness(center, size, size)
-        return brightness < self.brightness_threshold
+        return self.image.calculate_brightness(center, size, size)
 
     def wiggles_read(self, barcode, locate_type="NORMAL"):
         barcode.perform_read(DataMatrix.DIAG_WIGGLES)
@@ -53,6 +64,8 @@ class SlotScanner:
         img = self._slot_image(slot)
         fps = list(Locator().locate_deep(img, self.radius_avg))
         barcodes = [DataMatrix(fp, img) for fp in fps]
+        for barcode in barcodes:
+            barcode.set_matrix_size(self.barcode_size)
 
         self._DEBUG_MULTI_FP_IMAGE(img, fps, slot.number())
 
@@ -62,13 +75,28 @@ class SlotScanner:
         if not self._is_slot_worth_scanning(slot):
             return None
 
-        img = self._slot_image(slot)
-        fp = Locator().locate_square(img, self.side_avg)
+        img, origin = self._slot_image_and_origin(slot)
+
+        # Start from the fit found in this slot in an earlier frame, if there is one and it is still in the
+        # right place (e.g., the geometry may have been adjusted since). Slots are only scanned until they are
+        # read, so the saved fit is one that didn't give a valid read. It is only refined once: a warm started
+        # fit isn't saved, so if it doesn't give a valid read either, the next frame gets a cold search again
+        warm_start = slot.square_fit()
+        max_distance = self.WARM_START_DISTANCE * self.radius_avg
+        if warm_start is not None and warm_start.center.distance_to(slot.barcode_position()) < max_distance:
+            warm_start = warm_start.offset(-origin)
+        else:
+            warm_start = None
+
+        fp = Locator().locate_square(img, self.side_avg, warm_start)
+
+        slot.set_square_fit(fp.offset(origin) if fp is not None and warm_start is None else None)
 
         barcode = None
         if fp is not None:
             self._DEBUG_SQUARE_LOCATOR(img, fp, slot.number())
             barcode = DataMatrix(fp, img)
+            barcode.set_matrix_size(self.barcode_size)
 
         return barcode
 
@@ -87,10 +115,15 @@ class SlotScanner:
         return True
 
     def _slot_image(self, slot):
-        center = slot.barcode_position()
-        slot_img, _ = self.image.sub_image(center, self.radius_avg * 2)
+        slot_img, _ = self._slot_image_and_origin(slot)
         return slot_img
 
+    def _slot_image_and_origin(self, slot):
+        """ The image of the area around the slot, and the position of its top left corner in the frame. """
+        center = slot.barcode_position()
+        slot_img, roi = self.image.sub_image(center, self.radius_avg * 2)
+        return slot_img, Point(roi[0], roi[1])
+
     def _calculate_average_radius(self):
         if self.barcodes:
             return np.mean([bc.radius() for bc in self.barcodes])
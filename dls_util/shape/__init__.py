@@ -1,2 +1,3 @@
 from .point import Point
 from .circle import Circle
+from .circle_grid import CircleGrid
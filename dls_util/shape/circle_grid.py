@@ -0,0 +1,58 @@
+from __future__ import division
+
+import math
+
+
+class CircleGrid:
+    """ Spatial index of a set of circles, used to find the circles that contain a point without checking
+    every circle in turn.
+
+    The plane is divided into square cells and each circle is listed in every cell that its bounding box
+    overlaps. A point can only be inside the circles listed in its own cell, so only those need to be
+    checked. Circles are identified by the order in which they were added, and the results of a query are
+    always in that order.
+    """
+    def __init__(self, cell_size):
+        self._cell_size = max(float(cell_size), 1.0)
+        self._circles = []
+        self._cells = {}
+
+    def __len__(self):
+        return len(self._circles)
+
+    def circle(self, index):
+        return self._circles[index]
+
+    def add(self, circle):
+        """ Add the circle to the grid and return its index. """
+        index = len(self._circles)
+        self._circles.append(circle)
+
+        radius = circle.radius()
+        x_min, y_min = self._cell(circle.x() - radius, circle.y() - radius)
+        x_max, y_max = self._cell(circle.x() + radius, circle.y() + radius)
+        for x in range(x_min, x_max + 1):
+            for y in range(y_min, y_max + 1):
+                self._cells.setdefault((x, y), []).append(index)
+
+        return index
+
+    def containing(self, point):
+        """ Returns the indices of all of the circles that contain the point (in the order they were added). """
+        candidates = self._cells.get(self._cell(point.x, point.y), [])
+        return [i for i in candidates if self._circles[i].contains_point(point)]
+
+    def first_containing(self, point):
+        """ Returns the index of the first circle added that contains the point, or None if there isn't one. """
+        for i in self._cells.get(self._cell(point.x, point.y), []):
+            if self._circles[i].contains_point(point):
+                return i
+
+        return None
+
+    def contains_point(self, point):
+        """ Returns true if the point is within any of the circles. """
+        return self.first_containing(point) is not None
+
+    def _cell(self, x, y):
+        return int(math.floor(x / self._cell_size)), int(math.floor(y / self._cell_size))
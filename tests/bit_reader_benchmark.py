@@ -0,0 +1,62 @@
+from __future__ import division
+
+import itertools
+import timeit
+
+import numpy as np
+
+from datamatrix import DataMatrix
+from datamatrix.finder_pattern import FinderPattern
+from datamatrix.read import DatamatrixBitReader
+from dls_util.shape import Point
+
+"""
+Micro-benchmark of the datamatrix module sampling performed by DatamatrixBitReader.
+
+Compares the batched sampler (all module centres for all of the wiggle offsets computed as one
+array, window averages gathered from an integral image) with the original per-module sampler,
+checks that both produce exactly the same samples, and reports the time per read.
+"""
+
+MATRIX_SIZE = 14
+OFFSETS = DataMatrix.DIAG_WIGGLES
+REPEATS = 200
+
+# A noisy 'frame' with a finder pattern somewhere in the middle of it
+rng = np.random.RandomState(0)
+image = rng.randint(0, 256, (1024, 1280)).astype(np.uint8)
+finder_pattern = FinderPattern(Point(600, 560), Point(63, -9), Point(9, 63))
+
+
+def reference_samples(fp, offset, cv_img, n=MATRIX_SIZE):
+    """ The original implementation: a generator over every module and a separate window average for each. """
+    corner = fp.corner.tuple()
+    base_vec = np.asarray(fp.baseVector.tuple())
+    side_vec = np.asarray(fp.sideVector.tuple())
+
+    samples = np.empty((n, n))
+    for x, y in itertools.product(range(n), range(n)):
+        point = list(map(int, corner + ((2*x+1+offset[0])*base_vec + (2*y+1+offset[1])*side_vec)/(2*n)))
+        x1, y1 = point[0] - 1, point[1] - 1
+        samples[y, x] = int(int(np.sum(cv_img[y1:y1+3, x1:x1+3]) / 9))
+    return samples
+
+
+def reference_all_offsets():
+    return [reference_samples(finder_pattern, offset, image) for offset in OFFSETS]
+
+
+def batched_all_offsets():
+    return DatamatrixBitReader(MATRIX_SIZE).sample_grids(finder_pattern, OFFSETS, image)
+
+
+for ref, new in zip(reference_all_offsets(), batched_all_offsets()):
+    assert np.array_equal(ref, new), "Batched samples differ from the reference implementation"
+
+t_ref = timeit.timeit(reference_all_offsets, number=REPEATS) / REPEATS
+t_new = timeit.timeit(batched_all_offsets, number=REPEATS) / REPEATS
+
+print("Sampling {0}x{0} modules for {1} offsets".format(MATRIX_SIZE, len(OFFSETS)))
+print("Per-module sampler: {:.3f} ms".format(t_ref * 1000))
+print("Batched sampler:    {:.3f} ms".format(t_new * 1000))
+print("Speedup: {:.1f}x".format(t_ref / t_new))
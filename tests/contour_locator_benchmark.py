@@ -0,0 +1,58 @@
+from __future__ import division
+
+import timeit
+
+import cv2
+import numpy as np
+
+from datamatrix.locate import Locator
+from datamatrix.locate.locate_contour import ContourLocator
+from dls_util.image import Image
+from test_datamatrix_sizes import synthesise
+
+"""
+Micro-benchmark of the contour locator on a full size frame.
+
+A 1280x1024 frame of smooth noise is filled with a grid of synthesised datamatrices. The adaptive
+thresholds that the locator derives from its shared local mean image are checked against
+cv2.adaptiveThreshold() for each of the deep search values of C, and then the time taken by the
+thresholding stage and by the shallow and deep locate operations are reported.
+"""
+
+BLOCK_SIZE = 35
+C_VALUES = [16, 8, 0, 4, 20]
+REPEATS = 10
+
+rng = np.random.RandomState(0)
+frame = cv2.GaussianBlur(rng.normal(128, 20, (1024, 1280)).clip(0, 255).astype(np.uint8), (0, 0), 3)
+for i in range(12):
+    image, _ = synthesise("DF150E{:04d}".format(i), 14)
+    y, x = 100 + (i // 4) * 300, 100 + (i % 4) * 300
+    height, width = image.img.shape
+    frame[y:y + height, x:x + width] = image.img
+frame = Image(frame)
+
+
+def threshold_separately():
+    return [cv2.adaptiveThreshold(frame.img, 255.0, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, BLOCK_SIZE, c)
+            for c in C_VALUES]
+
+
+def threshold_shared():
+    locator = ContourLocator()
+    return [locator._cached_threshold(frame, BLOCK_SIZE, c).img for c in C_VALUES]
+
+
+for ref, new in zip(threshold_separately(), threshold_shared()):
+    assert np.array_equal(ref, new), "Shared threshold differs from cv2.adaptiveThreshold()"
+
+t_separate = timeit.timeit(threshold_separately, number=REPEATS) / REPEATS
+t_shared = timeit.timeit(threshold_shared, number=REPEATS) / REPEATS
+t_shallow = timeit.timeit(lambda: Locator().locate_shallow(frame), number=REPEATS) / REPEATS
+t_deep = timeit.timeit(lambda: Locator().locate_deep(frame), number=REPEATS) / REPEATS
+
+print("Thresholding for {} values of C".format(len(C_VALUES)))
+print("Separate adaptive thresholds: {:.3f} ms".format(t_separate * 1000))
+print("Shared local mean:            {:.3f} ms".format(t_shared * 1000))
+print("Locate shallow: {:.1f} ms ({} finder patterns)".format(t_shallow * 1000, len(Locator().locate_shallow(frame))))
+print("Locate deep:    {:.1f} ms ({} finder patterns)".format(t_deep * 1000, len(Locator().locate_deep(frame))))
@@ -0,0 +1,58 @@
+from __future__ import division
+
+import timeit
+
+from datamatrix import DataMatrix
+from datamatrix.read import DatamatrixBitReader, DatamatrixDecodeCache, DatamatrixSizeTable
+from test_datamatrix_sizes import synthesise
+
+"""
+Micro-benchmark of automatic datamatrix size detection.
+
+A symbol of each size that can be detected is synthesised (ASCII encoded message, Reed-Solomon error
+correction and the ECC200 bit placement). Each one is then read by detecting its size from the timing
+pattern and decoding once at that size, and by brute force (trying every valid size in turn until one
+decodes).
+The script checks that both give the right message and reports the time taken by each.
+"""
+
+REPEATS = 50
+
+
+def read_detected(image, fp):
+    barcode = DataMatrix(fp, image)
+    barcode.set_matrix_size(DataMatrix.AUTO_SIZE)
+    barcode.perform_read()
+    return barcode.data()
+
+
+def read_brute_force(image, fp):
+    for size in DatamatrixSizeTable.valid_sizes():
+        barcode = DataMatrix(fp, image)
+        barcode.set_matrix_size(size)
+        barcode.perform_read()
+        if barcode.is_valid():
+            return barcode.data()
+    return ''
+
+
+# Make sure that the repeated reads aren't answered by the decode cache
+DataMatrix.DECODE_CACHE = DatamatrixDecodeCache(max_size=0)
+
+detectable_sizes = [size for size in DatamatrixSizeTable.valid_sizes()
+                    if min(DatamatrixSizeTable.dimensions(size)) <= DatamatrixBitReader.MAX_DETECTED_SIZE]
+
+print(" Size  Detected (ms)  Brute force (ms)")
+for size in detectable_sizes:
+    message = "DATAMATRIX-SIZE-DETECTION"[:DatamatrixSizeTable.num_data_bytes(size) - 1]
+    image, fp = synthesise(message, size)
+
+    if read_brute_force(image, fp) != message:
+        print("{:>5}  (synthesised symbol is not readable at any size)".format(size))
+        continue
+
+    assert read_detected(image, fp) == message, "Detected size read failed for size {}".format(size)
+
+    t_detect = timeit.timeit(lambda: read_detected(image, fp), number=REPEATS) / REPEATS
+    t_brute = timeit.timeit(lambda: read_brute_force(image, fp), number=REPEATS) / REPEATS
+    print("{:>5}  {:13.3f}  {:16.3f}".format(size, t_detect * 1000, t_brute * 1000))
@@ -0,0 +1,36 @@
+import random
+import unittest
+
+from dls_util.shape import Circle, CircleGrid, Point
+from geometry.unipuck import Unipuck
+
+
+class TestCircleGrid(unittest.TestCase):
+    def test_matches_checking_every_circle(self):
+        rng = random.Random(0)
+        circles = [Circle(Point(rng.uniform(0, 500), rng.uniform(0, 500)), rng.uniform(1, 60)) for _ in range(100)]
+        grid = CircleGrid(40)
+        for circle in circles:
+            grid.add(circle)
+
+        for _ in range(500):
+            point = Point(rng.uniform(-50, 550), rng.uniform(-50, 550))
+            expected = [i for i, circle in enumerate(circles) if circle.contains_point(point)]
+            self.assertEqual(expected, grid.containing(point))
+            self.assertEqual(expected[0] if expected else None, grid.first_containing(point))
+
+    def test_point_on_edge_is_outside(self):
+        grid = CircleGrid(10)
+        grid.add(Circle(Point(0, 0), 10))
+        self.assertFalse(grid.contains_point(Point(10, 0)))
+        self.assertTrue(grid.contains_point(Point(-9.9, 0)))
+
+    def test_unipuck_containing_slot(self):
+        puck = Unipuck(Point(400, 300), 250, rotation=0.3)
+        for slot in range(1, puck.num_slots() + 1):
+            self.assertEqual(slot, puck.containing_slot(puck.slot_center(slot)))
+        self.assertIsNone(puck.containing_slot(puck.center()))
+
+
+if __name__ == '__main__':
+    unittest.main()
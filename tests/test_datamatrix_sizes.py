@@ -0,0 +1,138 @@
+import unittest
+
+import numpy as np
+
+from datamatrix import DataMatrix
+from datamatrix.finder_pattern import FinderPattern
+from datamatrix.read import DatamatrixByteExtractor, DatamatrixDecodeCache, DatamatrixSizeTable, ReedSolomonDecoder
+from datamatrix.read.size_table import DatamatrixSizeError
+from dls_util.image import Image
+from dls_util.shape import Point
+
+MODULE_PIXELS = 5
+QUIET_ZONE = 4
+
+DARK = 30
+LIGHT = 220
+
+
+def encode_ascii(message, num_data_bytes):
+    """ ASCII encode the message and fill the remaining data bytes with the (randomised) pad character. """
+    data = [ord(c) + 1 for c in message]
+    if len(data) < num_data_bytes:
+        data.append(129)
+    while len(data) < num_data_bytes:
+        pad = 129 + ((149 * (len(data) + 1)) % 253) + 1
+        data.append(pad if pad <= 254 else pad - 254)
+    return data
+
+
+def symbol_modules(message, size, data=None):
+    """ Boolean array (True is dark) of all of the modules of the symbol, including the finder, timing and
+    alignment patterns, with the finder corner at the bottom left. The data codewords can be given instead
+    of the message. """
+    if data is None:
+        data = encode_ascii(message, DatamatrixSizeTable.num_data_bytes(size))
+    codewords = ReedSolomonDecoder.for_matrix_size(size).encode(data)
+
+    map_rows, map_cols = DatamatrixSizeTable.mapping_matrix_size(size)
+    table = DatamatrixByteExtractor.placement_table(map_rows, map_cols)
+    bits = np.zeros(map_rows * map_cols, dtype=bool)
+    for codeword, positions in zip(codewords, table):
+        bits[positions] = np.unpackbits(np.array([codeword], dtype=np.uint8)).astype(bool)
+    bits = bits.reshape(map_rows, map_cols)
+
+    rows, cols = DatamatrixSizeTable.dimensions(size)
+    region_rows, region_cols = DatamatrixSizeTable.data_region_size(size)
+    modules = np.zeros((rows, cols), dtype=bool)
+    for y in range(0, rows, region_rows + 2):
+        for x in range(0, cols, region_cols + 2):
+            region = modules[y:y + region_rows + 2, x:x + region_cols + 2]
+            r, c = y // (region_rows + 2) * region_rows, x // (region_cols + 2) * region_cols
+            region[1:-1, 1:-1] = bits[r:r + region_rows, c:c + region_cols]
+            region[:, 0] = True
+            region[-1, :] = True
+            region[0, :] = np.arange(region_cols + 2) % 2 == 0
+            region[:, -1] = np.arange(region_rows + 2) % 2 == 1
+    return modules
+
+
+def synthesise(message, size, data=None):
+    """ Render the symbol to an image and return the image and the finder pattern of the symbol. """
+    modules = symbol_modules(message, size, data)
+    pixels = np.kron(np.where(modules, DARK, LIGHT), np.ones((MODULE_PIXELS, MODULE_PIXELS)))
+    image = np.pad(pixels, QUIET_ZONE * MODULE_PIXELS, mode='constant', constant_values=LIGHT).astype(np.uint8)
+
+    rows, cols = modules.shape
+    corner = Point(QUIET_ZONE * MODULE_PIXELS, QUIET_ZONE * MODULE_PIXELS + rows * MODULE_PIXELS)
+    return Image(image), FinderPattern(corner, Point(cols * MODULE_PIXELS, 0), Point(0, -rows * MODULE_PIXELS))
+
+
+def read(image, fp, size):
+    barcode = DataMatrix(fp, image)
+    barcode.set_matrix_size(size)
+    barcode.perform_read()
+    return barcode
+
+
+class TestDatamatrixSizes(unittest.TestCase):
+    def setUp(self):
+        self._decode_cache = DataMatrix.DECODE_CACHE
+        DataMatrix.DECODE_CACHE = DatamatrixDecodeCache()
+
+    def tearDown(self):
+        DataMatrix.DECODE_CACHE = self._decode_cache
+
+    def test_size_table(self):
+        self.assertEqual((14, 14), DatamatrixSizeTable.dimensions(14))
+        self.assertEqual((14, 14), DatamatrixSizeTable.dimensions("14"))
+        self.assertEqual((8, 18), DatamatrixSizeTable.dimensions("8x18"))
+        self.assertEqual("12x26", DatamatrixSizeTable.canonical_size((12, 26)))
+        self.assertEqual(144, DatamatrixSizeTable.canonical_size("144x144"))
+
+        self.assertEqual((1, 2), DatamatrixSizeTable.num_data_regions("16x36"))
+        self.assertEqual((28, 28), DatamatrixSizeTable.mapping_matrix_size(32))
+        self.assertRaises(DatamatrixSizeError, DatamatrixSizeTable.dimensions, "18x8")
+        self.assertRaises(DatamatrixSizeError, DatamatrixSizeTable.dimensions, 15)
+
+        for size in DatamatrixSizeTable.valid_sizes():
+            rows, cols = DatamatrixSizeTable.mapping_matrix_size(size)
+            num_codewords = len(DatamatrixByteExtractor.placement_table(rows, cols))
+            self.assertEqual(DatamatrixSizeTable.num_bytes(size), num_codewords)
+
+    def test_read_rectangular(self):
+        for i, size in enumerate(["8x18", "8x32", "12x26", "12x36", "16x36", "16x48"]):
+            message = "RECT{}".format(i)
+            image, fp = synthesise(message, size)
+            self.assertEqual(message, read(image, fp, size).data())
+
+    def test_read_multiple_regions(self):
+        for size in [32, 52, 64]:
+            message = "REGIONS{}".format(size)
+            image, fp = synthesise(message, size)
+            self.assertEqual(message, read(image, fp, size).data())
+
+    def test_detect_rectangular_size(self):
+        image, fp = synthesise("RECT", "12x26")
+        barcode = read(image, fp, DataMatrix.AUTO_SIZE)
+        self.assertEqual("12x26", barcode.matrix_size())
+        self.assertEqual("RECT", barcode.data())
+
+    def test_pre_filter_can_be_disabled(self):
+        image, fp = synthesise("FILTER", 14)
+        pre_filter = DataMatrix.PRE_FILTER
+        checked = pre_filter.num_checked()
+        self.assertEqual("FILTER", read(image, fp, 14).data())
+        self.assertEqual(checked + 1, pre_filter.num_checked())
+
+        checked = pre_filter.num_checked()
+        type(pre_filter).ENABLED = False
+        try:
+            self.assertEqual("FILTER", read(image, fp, 14).data())
+        finally:
+            type(pre_filter).ENABLED = True
+        self.assertEqual(checked, pre_filter.num_checked())
+
+
+if __name__ == '__main__':
+    unittest.main()
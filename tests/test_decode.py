@@ -1,6 +1,10 @@
+import pickle
 import unittest
 
-from datamatrix.read import DatamatrixByteInterpreter
+from datamatrix import DataMatrix
+from datamatrix.read import DatamatrixByteInterpreter, DatamatrixDecodeCache
+
+from .test_datamatrix_sizes import encode_ascii, read, synthesise
 
 cases = [
     ([85, 102, 116, 117, 129], "Test"),
@@ -9,8 +13,30 @@ cases = [
     ([x+1 for x in range(32, 127)], str(bytearray([x for x in range(32, 127)]), 'utf-8'))
 ]
 
+# One case for each of the encodation schemes and special codewords
+encodation_cases = [
+    ([230, 89, 222, 38, 9, 6, 67, 254, 123], "AB12 C!z"),  # C40 with a shift 2 character
+    ([230, 10, 255, 254], "\xc1"),  # C40 upper shift
+    ([239, 134, 42, 160, 164, 16, 53, 197, 186, 254], "hello World"),  # Text
+    ([238, 89, 233, 7, 15, 44, 17, 254], "ABC*123>\r"),  # ANSI X12
+    ([240, 20, 66, 64, 24, 16, 223, 85], "EDI@FACT"),  # EDIFACT, returning to ASCII for the last codeword
+    ([231, 46, 2, 153, 129], "AB"),  # Base 256
+    ([235, 102], "\xe5"),  # ASCII upper shift
+    ([232, 66], "\x1dA"),  # FNC1
+    ([233, 18, 1, 1, 66], "A"),  # Structured append
+    ([241, 27, 66], "A"),  # ECI
+    ([236, 66, 129], "[)>\x1e05\x1dA\x1e\x04"),  # Macro 05
+]
+
 
 class TestDecode(unittest.TestCase):
+    def setUp(self):
+        self._decode_cache = DataMatrix.DECODE_CACHE
+        DataMatrix.DECODE_CACHE = DatamatrixDecodeCache()
+
+    def tearDown(self):
+        DataMatrix.DECODE_CACHE = self._decode_cache
+
     def test_datamatrix_decode(self):
         decoder = DatamatrixByteInterpreter()
 
@@ -18,5 +44,40 @@ class TestDecode(unittest.TestCase):
             dec = decoder.interpret_bytes(bytes)
             assert dec == message
 
+    def test_datamatrix_decode_encodation_schemes(self):
+        for bytes, message in encodation_cases:
+            dec = DatamatrixByteInterpreter.interpret_bytes(bytes)
+            assert dec == message
+
+    def test_datamatrix_decode_invalid_codeword(self):
+        self.assertRaises(ValueError, DatamatrixByteInterpreter.interpret_bytes, [66, 250])
+
+    def test_datamatrix_decode_invalid_text_mode_pair(self):
+        # The pair 0, 0 would give negative values, which mustn't index from the end of the character set
+        self.assertRaises(ValueError, DatamatrixByteInterpreter.interpret_bytes, [230, 0, 0, 254])
+        self.assertRaises(ValueError, DatamatrixByteInterpreter.interpret_bytes, [239, 0, 0, 254])
+        self.assertRaises(ValueError, DatamatrixByteInterpreter.interpret_bytes, [238, 0, 0, 254])
+
+    def test_invalid_encoding_in_batch(self):
+        # Code 0 isn't used in ASCII encodation, but the symbol is otherwise valid
+        bad_image, bad_fp = synthesise(None, 14, data=[0] + encode_ascii("BAD", 7)[:-1])
+        good_image, good_fp = synthesise("GOOD", 14)
+        barcodes = [DataMatrix(bad_fp, bad_image), DataMatrix(good_fp, good_image)]
+        for barcode in barcodes:
+            barcode.set_matrix_size(14)
+        DataMatrix.read_many(barcodes)
+
+        self.assertFalse(barcodes[0].is_valid())
+        self.assertIn("not used", barcodes[0]._error_message)
+        self.assertEqual("GOOD", barcodes[1].data())
+
+    def test_pickle_without_image(self):
+        # Barcodes are passed between processes without the image that they were read from
+        image, fp = synthesise("PICKLED", 14)
+        barcode = pickle.loads(pickle.dumps(read(image, fp, 14)))
+        self.assertEqual("PICKLED", barcode.data())
+        self.assertIsNone(barcode._image)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,50 @@
+import unittest
+
+import numpy as np
+
+from datamatrix.read import DatamatrixDecodeCache
+
+
+def bit_arrays(count, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.randint(0, 2, (count, 12, 12)).astype(bool)
+
+
+class TestDecodeCache(unittest.TestCase):
+    def test_keys_identify_bit_arrays(self):
+        bits = bit_arrays(2)
+        keys = DatamatrixDecodeCache.keys(np.concatenate((bits, bits)))
+        self.assertEqual(keys[0], keys[2])
+        self.assertEqual(keys[1], keys[3])
+        self.assertNotEqual(keys[0], keys[1])
+
+    def test_hits_and_misses(self):
+        cache = DatamatrixDecodeCache()
+        key, other = DatamatrixDecodeCache.keys(bit_arrays(2))
+
+        self.assertIsNone(cache.get(key))
+        cache.put(key, "DF150E0443", "")
+        cache.put(other, None, "Unable to correct encoding errors")
+
+        self.assertEqual(("DF150E0443", ""), cache.get(key))
+        self.assertEqual((None, "Unable to correct encoding errors"), cache.get(other))
+        self.assertEqual(2, cache.hits())
+        self.assertEqual(1, cache.misses())
+
+    def test_least_recently_used_is_evicted(self):
+        cache = DatamatrixDecodeCache(max_size=2)
+        a, b, c = DatamatrixDecodeCache.keys(bit_arrays(3))
+
+        cache.put(a, "a", "")
+        cache.put(b, "b", "")
+        cache.get(a)
+        cache.put(c, "c", "")
+
+        self.assertEqual(2, cache.size())
+        self.assertEqual(1, cache.evictions())
+        self.assertIsNone(cache.get(b))
+        self.assertEqual(("a", ""), cache.get(a))
+
+
+if __name__ == '__main__':
+    unittest.main()
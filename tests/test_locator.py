@@ -0,0 +1,142 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from datamatrix import DataMatrix, Locator
+from datamatrix.locate.locate_square import SquareLocator
+from datamatrix.locate.locate_contour import ContourLocator
+from dls_util.image import Image
+
+from .test_datamatrix_sizes import synthesise, LIGHT
+
+
+def puck_image():
+    """ An image with a grid of (synthesised) datamatrices. """
+    frame = np.full((600, 600), LIGHT, dtype=np.uint8)
+    for i in range(9):
+        image, _ = synthesise("PIN{}".format(i), 14)
+        y, x = 50 + (i // 3) * 180, 50 + (i % 3) * 180
+        height, width = image.img.shape
+        frame[y:y + height, x:x + width] = image.img
+    return Image(frame)
+
+
+def slot_image(angle):
+    """ Slot image with a (synthesised) datamatrix, 70 pixels across, slightly off center at the specified
+    angle. """
+    symbol, _ = synthesise("SQUARE", 14)
+    frame = np.full((200, 200), LIGHT, dtype=np.uint8)
+    height, width = symbol.img.shape
+    frame[100 - height // 2:100 - height // 2 + height, 100 - width // 2:100 - width // 2 + width] = symbol.img
+    matrix = cv2.getRotationMatrix2D((100, 100), angle, 1.0)
+    frame = cv2.warpAffine(frame, matrix, (200, 200), borderValue=LIGHT)
+    return Image(frame[3:193, 8:198].copy())
+
+
+def summary(finder_patterns):
+    return [(fp.corner.tuple(), fp.baseVector.tuple(), fp.sideVector.tuple()) for fp in finder_patterns]
+
+
+class TestLocator(unittest.TestCase):
+    def setUp(self):
+        self._num_threads = Locator.NUM_THREADS
+
+    def tearDown(self):
+        Locator.NUM_THREADS = self._num_threads
+
+    def test_deep_search_threads_give_same_order(self):
+        image = puck_image()
+
+        Locator.NUM_THREADS = 1
+        sequential = summary(Locator().locate_deep(image))
+
+        Locator.NUM_THREADS = 4
+        threaded = summary(Locator().locate_deep(image))
+
+        self.assertEqual(sequential, threaded)
+        self.assertEqual(9, len(Locator._filter_overlapping_patterns(Locator().locate_deep(image))))
+
+    def test_vectorized_filters_match_edge_filters(self):
+        image = puck_image()
+        locator = ContourLocator()
+        threshold = locator._cached_threshold(image, 35, 16)
+        polygons = locator._contours_to_polygons(locator._get_contours(locator._do_close_morph(threshold, 3)))
+
+        filters = [ContourLocator._filter_non_trivial, ContourLocator._filter_longest_adjacent,
+                   ContourLocator._filter_longest_approx_orthogonal, ContourLocator._filter_longest_similar_in_length]
+        expected = [k for k, polygon in enumerate(polygons)
+                    if all(f(ContourLocator._polygons_to_edges(polygon)) for f in filters)]
+
+        ContourLocator.reset_filter_counts()
+        survivors, _ = ContourLocator._filter_polygons(polygons)
+        num_polygons, dropped = ContourLocator.filter_counts()
+
+        self.assertEqual(expected, survivors)
+        self.assertEqual(len(polygons), num_polygons)
+        self.assertEqual(len(polygons) - len(survivors), sum(dropped.values()))
+
+    def test_locate_rectangular(self):
+        for size in ["8x18", "16x48"]:
+            symbol, _ = synthesise("RECT", size)
+            frame = np.full((400, 500), LIGHT, dtype=np.uint8)
+            height, width = symbol.img.shape
+            frame[50:50 + height, 30:30 + width] = symbol.img
+            image = Image(frame)
+
+            self.assertEqual([], DataMatrix.locate_all_barcodes_in_image(image, 14))
+            for matrix_size in [size, DataMatrix.AUTO_SIZE]:
+                for locate in [DataMatrix.locate_all_barcodes_in_image, DataMatrix.locate_all_barcodes_in_image_deep]:
+                    barcodes = locate(image, matrix_size)
+                    DataMatrix.read_many(barcodes)
+                    self.assertEqual(["RECT"], [barcode.data() for barcode in barcodes])
+
+    def test_track_finder_patterns(self):
+        image = puck_image()
+        fps = Locator().locate_shallow(image)
+
+        # Nothing has moved
+        self.assertEqual(summary(fps), summary(Locator.track(image, image, fps)))
+
+        # Move one of the datamatrices
+        moved = image.img.copy()
+        moved[50:160, 50:160] = LIGHT
+        moved[55:165, 54:164] = image.img[50:160, 50:160]
+        tracked = Locator.track(Image(moved), image, fps)
+        changed = [(old.center.x, old.center.y, new.center.x, new.center.y)
+                   for old, new in zip(fps, tracked) if old.center.tuple() != new.center.tuple()]
+        self.assertEqual(1, len(changed))
+        x, y, new_x, new_y = changed[0]
+        self.assertAlmostEqual(4, new_x - x, delta=1)
+        self.assertAlmostEqual(5, new_y - y, delta=1)
+
+        # Move all of them
+        shifted = Image(np.roll(image.img, 6, axis=1))
+        self.assertEqual([None] * len(fps), Locator.track(shifted, image, fps))
+
+    def test_square_locator_finds_rotated_datamatrix(self):
+        for angle in [0, 25, 130, 290]:
+            image = slot_image(angle)
+            barcode = DataMatrix(Locator.locate_square(image, 70), image)
+            barcode.perform_read(DataMatrix.DIAG_WIGGLES)
+            self.assertEqual("SQUARE", barcode.data())
+
+    def test_square_locator_warm_start(self):
+        image = slot_image(40)
+        cold = SquareLocator()
+        fp = cold.locate(image, 70)
+
+        warm = SquareLocator()
+        warm_fp = warm.locate(image, 70, warm_start=fp)
+        self.assertLess(warm.count, cold.count)
+        self.assertEqual(summary([fp]), summary([warm_fp]))
+
+    def test_square_locator_budget(self):
+        locator = SquareLocator()
+        fp = locator.locate(slot_image(40), 70, max_evaluations=30)
+        self.assertIsNotNone(fp)
+        self.assertEqual(30, locator.count)
+        self.assertTrue(locator.budget_exhausted())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+import numpy as np
+
+from datamatrix.read import DatamatrixPreFilter
+
+DARK = 30
+LIGHT = 220
+
+
+def datamatrix_grid(n=14, seed=0):
+    """ A grid of samples with solid finder edges, alternating timing edges and random data modules. """
+    rng = np.random.RandomState(seed)
+    grid = np.where(rng.randint(0, 2, (n, n)), DARK, LIGHT).astype(float)
+    timing = np.where((np.arange(n) + 1) % 2 == 1, DARK, LIGHT)
+    grid[:, -1] = timing
+    grid[-1, :] = timing
+    grid[0, :] = DARK
+    grid[:, 0] = DARK
+    return grid
+
+
+class TestPreFilter(unittest.TestCase):
+    def test_datamatrix_passes(self):
+        pre_filter = DatamatrixPreFilter()
+        grids = np.array([datamatrix_grid(seed=s) for s in range(10)])
+        passed, rejected_by = pre_filter.check(grids)
+
+        self.assertTrue(passed.all())
+        self.assertEqual([None] * 10, rejected_by)
+        self.assertEqual(0, pre_filter.num_rejected())
+
+    def test_stage_rejections_are_counted(self):
+        no_timing = datamatrix_grid()
+        no_timing[:, -1] = DARK
+        no_timing[-1, :] = LIGHT
+
+        no_finder = datamatrix_grid()
+        no_finder[0, :] = LIGHT
+
+        too_dark = datamatrix_grid()
+        too_dark[1:-1, 1:-1] = DARK
+
+        pre_filter = DatamatrixPreFilter()
+        passed, rejected_by = pre_filter.check(np.array([no_timing, no_finder, too_dark, datamatrix_grid()]))
+
+        self.assertEqual([False, False, False, True], passed.tolist())
+        self.assertEqual([DatamatrixPreFilter.TIMING, DatamatrixPreFilter.FINDER,
+                          DatamatrixPreFilter.DARK_RATIO, None], rejected_by)
+        self.assertEqual(4, pre_filter.num_checked())
+        self.assertEqual(3, pre_filter.num_rejected())
+        self.assertEqual(1, pre_filter.num_rejected(DatamatrixPreFilter.FINDER))
+
+
+if __name__ == '__main__':
+    unittest.main()
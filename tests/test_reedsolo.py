@@ -1,6 +1,7 @@
 import unittest
 
 from datamatrix.read import ReedSolomonDecoder, ReedSolomonError
+from datamatrix.read.reedsolo import GaloisField
 
 
 """
@@ -37,13 +38,60 @@ class TestReedSolo(unittest.TestCase):
     def test_correctable_barcode(self):
         decoder = ReedSolomonDecoder()
         for case in msg_bytes_correctable:
-            corrected = decoder.decode(case, num_ecc_bytes)
+            corrected = decoder.decode(case, len(msg_bytes))
             self.assertEquals(msg_bytes, corrected)
 
     def test_uncorrectable_barcode(self):
         decoder = ReedSolomonDecoder()
         for case in msg_bytes_uncorrectable:
-            self.assertRaises(ReedSolomonError, decoder.decode, case, num_ecc_bytes)
+            self.assertRaises(ReedSolomonError, decoder.decode, case, len(msg_bytes))
+
+    def test_clean_barcode(self):
+        decoder = ReedSolomonDecoder()
+        corrected = decoder.decode(msg_bytes_encoded, len(msg_bytes))
+        self.assertEqual(msg_bytes, corrected)
+
+    def test_decode_many(self):
+        decoder = ReedSolomonDecoder()
+        cases = [msg_bytes_encoded] + msg_bytes_correctable + msg_bytes_uncorrectable
+        results = decoder.decode_many(cases, len(msg_bytes))
+        for case, result in zip(cases, results):
+            if case in msg_bytes_uncorrectable:
+                self.assertIsInstance(result, ReedSolomonError)
+            else:
+                self.assertEqual(msg_bytes, result)
+
+    def test_matrix_size_decoder(self):
+        decoder = ReedSolomonDecoder.for_matrix_size(14)
+        self.assertIs(decoder, ReedSolomonDecoder.for_matrix_size(14))
+        self.assertIs(decoder.gf, ReedSolomonDecoder().gf)
+        self.assertEqual(msg_bytes_encoded, list(decoder.encode(msg_bytes)))
+        for case in msg_bytes_correctable:
+            self.assertEqual(msg_bytes, decoder.decode(case))
+
+    def test_interleaved_blocks(self):
+        # A 52x52 datamatrix has 204 data bytes and 84 error bytes, split into 2 interleaved blocks
+        decoder = ReedSolomonDecoder.for_matrix_size(52)
+        data = [(7 * i) % 256 for i in range(204)]
+        encoded = list(decoder.encode(data))
+        self.assertEqual(288, len(encoded))
+
+        # Each block can correct 21 errors, so 40 errors spread over both blocks are correctable
+        damaged = list(encoded)
+        for i in range(40):
+            damaged[i] ^= 0xff
+        self.assertEqual(data, decoder.decode(damaged))
+
+        # But not 22 in the same block
+        for i in [41, 43]:
+            damaged[i] ^= 0xff
+        self.assertIsInstance(decoder.decode_many([damaged])[0], ReedSolomonError)
+
+    def test_syndromes_match_polynomial_evaluation(self):
+        gf = GaloisField(GaloisField.DATAMATRIX)
+        for case in [msg_bytes_encoded] + msg_bytes_correctable + msg_bytes_uncorrectable:
+            expected = [gf.poly_eval(case, gf.exp(i + gf.base())) for i in range(num_ecc_bytes)]
+            self.assertEqual(expected, gf.syndromes(case, num_ecc_bytes).tolist())
 
 
 if __name__ == '__main__':
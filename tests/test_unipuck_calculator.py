@@ -0,0 +1,48 @@
+from __future__ import division
+
+import math
+import random
+import unittest
+
+from dls_util.shape import Point
+from geometry.unipuck import Unipuck
+from geometry.unipuck_calculator import UnipuckCalculator
+
+
+def angle_difference(a, b):
+    return abs((a - b + math.pi) % (2 * math.pi) - math.pi)
+
+
+class TestUnipuckCalculator(unittest.TestCase):
+    def test_puck_orientation(self):
+        rng = random.Random(0)
+        for _ in range(20):
+            angle = rng.uniform(0, 2 * math.pi)
+            puck = Unipuck(Point(600, 500), 300, angle)
+            pins = [puck.slot_center(i + 1) for i in rng.sample(range(Unipuck.NUM_SLOTS), 12)]
+
+            found = UnipuckCalculator._determine_puck_orientation(Unipuck(Point(600, 500), 300), pins)
+            self.assertLess(angle_difference(angle, found), math.radians(0.5))
+
+    def test_puck_center(self):
+        puck = Unipuck(Point(600, 500), 300, 0.3)
+        pins = [puck.slot_center(i + 1) for i in range(Unipuck.NUM_SLOTS)]
+        self.assertLessEqual(UnipuckCalculator._find_puck_center(pins).distance_to(puck.center()), 1.5)
+
+        # A badly placed point should have less effect on the robust fit
+        pins[12] = Point(pins[12].x + 50, pins[12].y + 40)
+        errors = []
+        default = UnipuckCalculator.ROBUST_CENTER_FIT
+        try:
+            for robust in [False, True]:
+                UnipuckCalculator.ROBUST_CENTER_FIT = robust
+                errors.append(UnipuckCalculator._find_puck_center(list(pins)).distance_to(puck.center()))
+        finally:
+            UnipuckCalculator.ROBUST_CENTER_FIT = default
+
+        self.assertLess(errors[1], errors[0])
+        self.assertLessEqual(errors[1], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()